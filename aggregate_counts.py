@@ -0,0 +1,222 @@
+import argparse
+import datetime
+import glob
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import openpyxl
+
+from class_taxonomy import read_taxonomy_file
+
+# ==========================
+# TỔNG HỢP NHIỀU 作業管理表 - KHÔNG CẦN TK
+# ==========================
+# Ngày lấy từ tên file: 作業管理表_20251015.xlsx hoặc 作業管理表_1015.xlsx
+_DAY_RE = re.compile(r"_(\d{8}|\d{4})\.xlsx$", re.IGNORECASE)
+
+# Taxonomy của từng process con, nạp một lần trong initializer
+_TAXONOMY = None
+
+def _init_worker(classes_file):
+    global _TAXONOMY
+    _TAXONOMY = read_taxonomy_file(classes_file)
+
+def parse_working_time(value):
+    """Working Time ("HH:MM:SS", time hoặc timedelta) → số giây"""
+    if isinstance(value, datetime.timedelta):
+        return int(value.total_seconds())
+    if isinstance(value, datetime.time):
+        return value.hour * 3600 + value.minute * 60 + value.second
+    text = str(value) if value is not None else ""
+    if ":" not in text:
+        return 0
+    try:
+        h, m, s = map(int, text.split(":"))
+    except ValueError:
+        return 0
+    return h * 3600 + m * 60 + s
+
+def workbook_day(filename):
+    """Ngày YYYY-MM-DD của workbook (cùng dạng cột day của SqliteDatasetStore).
+
+    Tên _MMDD lấy năm theo mtime của file; không có ngày trong tên thì dùng mtime.
+    """
+    modified = datetime.date.fromtimestamp(os.path.getmtime(filename))
+    match = _DAY_RE.search(os.path.basename(filename))
+    if match is None:
+        return modified.isoformat()
+    day = match.group(1)
+    if len(day) == 4:
+        day = f"{modified.year:04d}{day}"
+    return f"{day[:4]}-{day[4:6]}-{day[6:]}"
+
+def read_workbook_counts(filename):
+    """Đọc streaming các sheet Counts_<lang> của một workbook.
+
+    Cột được ghép về class index theo ngôn ngữ của sheet, nên workbook lưu
+    bằng ngôn ngữ khác nhau vẫn cộng được với nhau. Một dataset có mặt ở
+    nhiều sheet ngôn ngữ chỉ được tính một lần.
+    Trả về (file, ngày, [(dataset, giây, counts theo child_indices)], lỗi).
+    """
+    taxonomy = _TAXONOMY
+    position = {index: i for i, index in enumerate(taxonomy.child_indices)}
+    datasets = {}
+    # Mọi lỗi của file hỏng (kể cả khi đang đọc sheet) chỉ bỏ qua file đó
+    try:
+        wb = openpyxl.load_workbook(filename, read_only=True, data_only=True)
+    except Exception as e:
+        return filename, None, [], str(e)
+
+    try:
+        for sheet_name in wb.sheetnames:
+            if not sheet_name.startswith("Counts_"):
+                continue
+            rows = wb[sheet_name].iter_rows(values_only=True)
+            header = next(rows, None)
+            if not header or len(header) < 3:
+                continue
+            lang = taxonomy.language_by_header.get(tuple(header[2:]))
+            if lang is None and sheet_name[len("Counts_"):] in taxonomy.languages:
+                lang = sheet_name[len("Counts_"):]
+            columns = [(column, position[index])
+                       for column, index in enumerate(taxonomy.resolve_header(header[2:], lang), start=2)
+                       if index is not None]
+
+            for row in rows:
+                if not row or not isinstance(row[0], str) or row[0] in datasets:
+                    continue
+                counts = [0] * len(position)
+                for column, slot in columns:
+                    value = row[column] if column < len(row) else None
+                    if isinstance(value, (int, float)):
+                        counts[slot] = int(value)
+                datasets[row[0]] = (parse_working_time(row[1] if len(row) > 1 else None), counts)
+        day = workbook_day(filename)
+    except Exception as e:
+        return filename, None, [], str(e)
+    finally:
+        wb.close()
+
+    return filename, day, [(name, seconds, counts) for name, (seconds, counts) in datasets.items()], None
+
+# ==========================
+# GOM KẾT QUẢ
+# ==========================
+def _add_into(total, counts):
+    for i, value in enumerate(counts):
+        total[i] += value
+
+def aggregate(results, class_count):
+    """Cộng dồn theo class, theo dataset và theo ngày"""
+    by_class = [0] * class_count
+    by_dataset = {}
+    by_day = {}
+    for _, day, datasets, _ in results:
+        for name, seconds, counts in datasets:
+            _add_into(by_class, counts)
+
+            entry = by_dataset.setdefault(name, {"seconds": 0, "days": set(), "counts": [0] * class_count})
+            entry["seconds"] += seconds
+            entry["days"].add(day)
+            _add_into(entry["counts"], counts)
+
+            entry = by_day.setdefault(day, {"seconds": 0, "datasets": 0, "counts": [0] * class_count})
+            entry["seconds"] += seconds
+            entry["datasets"] += 1
+            _add_into(entry["counts"], counts)
+    return by_class, by_dataset, by_day
+
+def format_seconds_hms(seconds):
+    return f"{seconds // 3600:02d}:{(seconds % 3600) // 60:02d}:{seconds % 60:02d}"
+
+def write_summary(output, class_names, by_class, by_dataset, by_day):
+    """Ghi kết quả ra workbook (write-only) với 3 sheet tổng hợp"""
+    wb = openpyxl.Workbook(write_only=True)
+
+    ws = wb.create_sheet("By Class")
+    ws.append(["Class", "Total"])
+    for name, total in zip(class_names, by_class):
+        ws.append([name, total])
+
+    ws = wb.create_sheet("By Dataset")
+    ws.append(["Dataset Name", "Days", "Working Time", "Total"] + list(class_names))
+    for name, entry in sorted(by_dataset.items()):
+        ws.append([name, ", ".join(sorted(entry["days"])), format_seconds_hms(entry["seconds"]),
+                   sum(entry["counts"])] + entry["counts"])
+
+    ws = wb.create_sheet("By Day")
+    ws.append(["Day", "Datasets", "Working Time", "Total"] + list(class_names))
+    for day, entry in sorted(by_day.items()):
+        ws.append([day, entry["datasets"], format_seconds_hms(entry["seconds"]),
+                   sum(entry["counts"])] + entry["counts"])
+
+    wb.save(output)
+
+def print_summary(class_names, by_class, by_day):
+    for day, entry in sorted(by_day.items()):
+        print(f"{day}\tdatasets={entry['datasets']}\ttime={format_seconds_hms(entry['seconds'])}"
+              f"\ttotal={sum(entry['counts'])}")
+    print()
+    for name, total in zip(class_names, by_class):
+        if total:
+            print(f"{total}\t{name}")
+
+def expand_inputs(paths):
+    """File, thư mục hoặc pattern glob → danh sách .xlsx (bỏ file khóa ~$)"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            matches = glob.glob(os.path.join(path, "*.xlsx"))
+        elif glob.has_magic(path):
+            matches = glob.glob(path)
+        else:
+            matches = [path]
+        files.extend(m for m in sorted(matches) if not os.path.basename(m).startswith("~$"))
+    return files
+
+# ==========================
+# CHẠY TỪ DÒNG LỆNH
+# ==========================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Aggregate Counts_<lang> sheets from many workbooks.")
+    parser.add_argument("inputs", nargs="+", help="workbooks, directories or glob patterns")
+    parser.add_argument("--classes", default="classes.txt", help="taxonomy file (default: classes.txt)")
+    parser.add_argument("--lang", help="language for class names in the output (default: first in file)")
+    parser.add_argument("--output", help="write the summary to this .xlsx instead of printing it")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.classes):
+        parser.error(f"file {args.classes} not found")
+    taxonomy = read_taxonomy_file(args.classes)
+    if not taxonomy:
+        parser.error(f"no class definitions found in {args.classes}")
+    lang = args.lang or taxonomy.languages[0]
+    if lang not in taxonomy.languages:
+        parser.error(f"unknown language '{lang}', choose from: {', '.join(taxonomy.languages)}")
+
+    files = expand_inputs(args.inputs)
+    if not files:
+        parser.error("no workbooks found")
+
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+                             initargs=(args.classes,)) as executor:
+        results = list(executor.map(read_workbook_counts, files, chunksize=4))
+
+    for filename, _, _, error in results:
+        if error:
+            print(f"WARNING: skipped {filename}: {error}", file=sys.stderr)
+
+    class_names = taxonomy.child_names[lang]
+    by_class, by_dataset, by_day = aggregate(results, len(class_names))
+    if args.output:
+        write_summary(args.output, class_names, by_class, by_dataset, by_day)
+        print(f"Aggregated {len(files)} workbooks, {len(by_dataset)} datasets -> {args.output}")
+    else:
+        print_summary(class_names, by_class, by_day)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
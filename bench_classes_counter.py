@@ -0,0 +1,322 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import openpyxl
+
+import classes_counter
+from class_taxonomy import ClassTaxonomy, parse_classes_text
+from classes_counter import (
+    SqliteDatasetStore,
+    build_export_rows,
+    load_classes_from_file,
+    read_dataset_row,
+    write_workbook_rows,
+)
+
+# ==========================
+# BENCHMARK CLASSES_COUNTER - SAVE/LOAD/RENDER
+# ==========================
+# Taxonomy: (số class con, số ngôn ngữ); workbook: (số sheet, số dòng);
+# kho SQLite: số dataset có sẵn
+DEFAULT_TAXONOMIES = "67x3,500x5,2000x10"
+DEFAULT_WORKBOOKS = "1x10,10x1000,50x10000"
+FULL_WORKBOOKS = "1x10,10x1000,50x10000,50x100000"
+DEFAULT_STORES = "10,1000,10000"
+FULL_STORES = "10,1000,10000,100000"
+
+# Tên parent chứa từ khóa cột để lưới có đủ 3 cột
+PARENT_NAMES = ("Lane", "Center line", "Others", "Crosswalk", "Intersection", "Roadside")
+CHILDREN_PER_PARENT = 12
+
+def generate_taxonomy_text(class_count, language_count):
+    """Nội dung classes.txt giả với class_count class con cho mỗi ngôn ngữ"""
+    parent_count = max(1, -(-class_count // CHILDREN_PER_PARENT))
+    lines = []
+    for lang_number in range(1, language_count + 1):
+        lines.append(f"{lang_number}. Lang{lang_number}")
+        remaining = class_count
+        for parent_number in range(1, parent_count + 1):
+            parent_name = PARENT_NAMES[(parent_number - 1) % len(PARENT_NAMES)]
+            lines.append(f"{lang_number}.{parent_number}. {parent_name} {parent_number} L{lang_number}")
+            for child_number in range(1, min(CHILDREN_PER_PARENT, remaining) + 1):
+                lines.append(f"{lang_number}.{parent_number}.{child_number}. "
+                             f"Class {parent_number}-{child_number} L{lang_number}")
+            remaining -= min(CHILDREN_PER_PARENT, remaining)
+        lines.append("")
+    return "\n".join(lines)
+
+def generate_workbook(filename, taxonomy, sheet_count, row_count, seed=0):
+    """Workbook giả: sheet phụ trước, sheet Counts_<lang> đầu tiên ở cuối"""
+    rng = random.Random(seed)
+    lang = taxonomy.languages[0]
+    header = ["Dataset Name", "Working Time"] + list(taxonomy.child_names[lang])
+    class_count = len(taxonomy.child_indices)
+
+    wb = openpyxl.Workbook(write_only=True)
+    sheet_names = [f"Sheet{i}" for i in range(1, sheet_count)] + [f"Counts_{lang}"]
+    for sheet_name in sheet_names:
+        ws = wb.create_sheet(sheet_name)
+        ws.append(header)
+        for row in range(row_count):
+            ws.append([f"ds{row}", f"00:{row % 60:02d}:{row % 60:02d}"]
+                      + [rng.randint(0, 50) for _ in range(class_count)])
+    wb.save(filename)
+    return f"ds{row_count - 1}"
+
+# ==========================
+# ĐO THỜI GIAN
+# ==========================
+def measure(func, repeat, setup=None):
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+def record(results, name, params, times):
+    entry = {
+        "name": name,
+        "params": params,
+        "times": times,
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.fmean(times),
+    }
+    results.append(entry)
+    print(f"{name:<28} {json.dumps(params, ensure_ascii=False):<40} median={entry['median'] * 1000:10.2f} ms",
+          file=sys.stderr)
+
+def bench_taxonomy(results, workdir, class_count, language_count, repeat):
+    params = {"classes": class_count, "languages": language_count}
+    path = os.path.join(workdir, "classes.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(generate_taxonomy_text(class_count, language_count))
+
+    record(results, "load_classes_from_file", dict(params, cache=False),
+           measure(lambda: load_classes_from_file(path, use_cache=False), repeat))
+    load_classes_from_file(path)
+    record(results, "load_classes_from_file", dict(params, cache=True),
+           measure(lambda: load_classes_from_file(path), repeat))
+    return load_classes_from_file(path)
+
+def bench_workbook(results, workdir, taxonomy, sheet_count, row_count, repeat):
+    params = {"classes": len(taxonomy.child_indices), "sheets": sheet_count, "rows": row_count}
+    source = os.path.join(workdir, f"wb_{sheet_count}x{row_count}.xlsx")
+    last_dataset = generate_workbook(source, taxonomy, sheet_count, row_count)
+    target = os.path.join(workdir, "target.xlsx")
+
+    def fresh_copy():
+        shutil.copyfile(source, target)
+
+    def load():
+        lang, header, row = read_dataset_row(target, last_dataset, taxonomy)
+        taxonomy.resolve_header(header[2:], lang)
+
+    fresh_copy()
+    record(results, "load_from_excel", params, measure(load, repeat))
+
+    counts = [1] * len(taxonomy.child_indices)
+    lang = taxonomy.languages[0]
+    update_rows = build_export_rows(taxonomy, {last_dataset: ("00:00:01", counts)}, [lang])
+    record(results, "_save_to_excel_internal", dict(params, upsert="update"),
+           measure(lambda: write_workbook_rows(target, update_rows), repeat, setup=fresh_copy))
+
+def fill_store(store, taxonomy, dataset_count):
+    """Tạo sẵn dataset_count dataset trong một transaction.
+
+    Gọi save() từng dataset thì mỗi lần là một commit; 10 000 dataset mất
+    cả phút trước khi đo được gì.
+    """
+    rng = random.Random(0)
+    keys = [taxonomy.class_keys[index] for index in taxonomy.child_indices]
+    digest = taxonomy.identity_digest
+    now = time.localtime()
+    saved_at, day = time.strftime("%Y-%m-%d %H:%M:%S", now), time.strftime("%Y-%m-%d", now)
+    with store.conn:
+        store.conn.execute("INSERT OR IGNORE INTO taxonomies (digest, identity) VALUES (?, ?)",
+                           (digest, json.dumps(taxonomy.identity, ensure_ascii=False)))
+        store.conn.executemany(
+            "INSERT INTO datasets (name, working_seconds, language, saved_at, day, taxonomy) "
+            "VALUES (?, ?, NULL, ?, ?, ?)",
+            ((f"ds{number}", number, saved_at, day, digest) for number in range(dataset_count)))
+        store.conn.executemany(
+            "INSERT INTO counts (dataset, class_key, count) VALUES (?, ?, ?)",
+            ((f"ds{number}", key, rng.randint(0, 50)) for number in range(dataset_count) for key in keys))
+
+def bench_store(results, workdir, taxonomy, dataset_count, repeat):
+    """Lưu/nạp một dataset trong kho SQLite đã có dataset_count dataset"""
+    params = {"classes": len(taxonomy.child_indices), "datasets": dataset_count}
+    path = os.path.join(workdir, f"store_{dataset_count}.db")
+    store = SqliteDatasetStore(path)
+    fill_store(store, taxonomy, dataset_count)
+
+    counts = {taxonomy.class_keys[index]: 1 for index in taxonomy.child_indices}
+    last_dataset = f"ds{dataset_count - 1}"
+    record(results, "store.save", params,
+           measure(lambda: store.save(last_dataset, 1, counts, None, taxonomy), repeat))
+    record(results, "store.load", params, measure(lambda: store.load(last_dataset, taxonomy), repeat))
+    store.close()
+
+# ==========================
+# PHẦN TK - CHẠY TRÊN DISPLAY THẬT HOẶC XVFB
+# ==========================
+def start_virtual_display():
+    """Khởi động Xvfb nếu chưa có DISPLAY; trả về process hoặc None"""
+    if os.environ.get("DISPLAY") or sys.platform == "win32":
+        return None
+    xvfb = shutil.which("Xvfb")
+    if xvfb is None:
+        return None
+    process = subprocess.Popen([xvfb, ":99", "-screen", "0", "1600x1000x24", "-nolisten", "tcp"],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    os.environ["DISPLAY"] = ":99"
+    time.sleep(0.5)
+    return process
+
+def bench_tk(results, workdir, class_count, language_count, repeat):
+    import tkinter as tk
+
+    params = {"classes": class_count, "languages": language_count}
+    with open(os.path.join(workdir, "classes.txt"), "w", encoding="utf-8") as f:
+        f.write(generate_taxonomy_text(class_count, language_count))
+
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        root = tk.Tk()
+        start = time.perf_counter()
+        app = classes_counter.CounterApp(root)
+        root.update()
+        record(results, "CounterApp.__init__", params, [time.perf_counter() - start])
+
+        languages = app.languages
+
+        def switch_languages():
+            for lang in languages:
+                app.update_language(lang)
+            root.update()
+
+        record(results, "update_language", params, measure(switch_languages, repeat))
+
+        # Thay cho _rebuild_ui_from_cache cũ: nạp lại taxonomy có một class mới
+        text = generate_taxonomy_text(class_count, language_count)
+        changed = ClassTaxonomy(**parse_classes_text(
+            text.replace("1.1.1. Class 1-1 L1", "1.1.1. Class 1-1 L1\n1.1.99. Inserted L1")))
+        original = ClassTaxonomy(**parse_classes_text(text))
+        toggle = [changed, original]
+
+        def reload_taxonomy():
+            app.reload_taxonomy(toggle[0])
+            toggle.reverse()
+            root.update()
+
+        record(results, "reload_taxonomy", params, measure(reload_taxonomy, repeat))
+        app.on_close()
+    finally:
+        os.chdir(cwd)
+
+# ==========================
+# SO SÁNH VỚI KẾT QUẢ TRƯỚC
+# ==========================
+def _result_key(entry):
+    return entry["name"], json.dumps(entry["params"], sort_keys=True)
+
+def compare(results, baseline_path, threshold):
+    """In tỉ lệ median so với baseline; trả về số phép đo chậm hơn ngưỡng"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {_result_key(entry): entry for entry in json.load(f)["results"]}
+    regressions = 0
+    for entry in results:
+        old = baseline.get(_result_key(entry))
+        if old is None or not old["median"]:
+            continue
+        ratio = entry["median"] / old["median"]
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(f"{entry['name']:<28} {_result_key(entry)[1]:<60} x{ratio:5.2f}{flag}", file=sys.stderr)
+    return regressions
+
+def _parse_pairs(text):
+    return [tuple(int(part) for part in item.split("x")) for item in text.split(",") if item]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark classes_counter save/load/render paths.")
+    parser.add_argument("--taxonomies", default=DEFAULT_TAXONOMIES, help="CLASSESxLANGUAGES,... ")
+    parser.add_argument("--workbooks", default=DEFAULT_WORKBOOKS, help="SHEETSxROWS,...")
+    parser.add_argument("--stores", default=DEFAULT_STORES, help="datasets already in the SQLite store,...")
+    parser.add_argument("--full", action="store_true",
+                        help=f"use workbooks {FULL_WORKBOOKS} and stores {FULL_STORES}")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-gui", action="store_true", help="skip the Tk benchmarks")
+    parser.add_argument("--output", help="write JSON results here (default: stdout)")
+    parser.add_argument("--compare", help="baseline JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown before flagging (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    results = []
+    xvfb = None
+    with tempfile.TemporaryDirectory() as workdir:
+        workbook_taxonomy = None
+        for class_count, language_count in _parse_pairs(args.taxonomies):
+            taxonomy = bench_taxonomy(results, workdir, class_count, language_count, args.repeat)
+            if workbook_taxonomy is None:
+                workbook_taxonomy = taxonomy
+
+        workbooks = FULL_WORKBOOKS if args.full else args.workbooks
+        for sheet_count, row_count in _parse_pairs(workbooks):
+            bench_workbook(results, workdir, workbook_taxonomy, sheet_count, row_count, args.repeat)
+        stores = FULL_STORES if args.full else args.stores
+        for dataset_count in (int(item) for item in stores.split(",") if item):
+            bench_store(results, workdir, workbook_taxonomy, dataset_count, args.repeat)
+
+        if not args.no_gui:
+            xvfb = start_virtual_display()
+            try:
+                for class_count, language_count in _parse_pairs(args.taxonomies):
+                    tk_dir = os.path.join(workdir, f"tk_{class_count}x{language_count}")
+                    os.makedirs(tk_dir)
+                    bench_tk(results, tk_dir, class_count, language_count, args.repeat)
+            except Exception as e:
+                # Không có display - bỏ qua phần Tk, vẫn ghi kết quả còn lại
+                print(f"WARNING: Tk benchmarks skipped: {e}", file=sys.stderr)
+            finally:
+                if xvfb is not None:
+                    xvfb.terminate()
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "openpyxl": openpyxl.__version__,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    else:
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+
+    if args.compare:
+        return 1 if compare(results, args.compare, args.threshold) else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
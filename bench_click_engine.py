@@ -0,0 +1,185 @@
+import argparse
+import json
+import platform
+import random
+import statistics
+import sys
+import threading
+import time
+
+from click_engine import (HotkeyDispatcher, PlaybackEngine, RecordingBackend, SyntheticScreen, compile_playlist,
+                          compile_steps, format_color)
+
+# ==========================
+# BENCHMARK ENGINE PHÁT LẠI CỦA EXCEL.PY - KHÔNG CẦN DESKTOP
+# ==========================
+def make_steps(count, delay):
+    return compile_steps([(100 + i % 50, 200 + i % 30, delay) for i in range(count)], 1)
+
+def bench_max_rate(engine, clicks):
+    """Tốc độ click tối đa: delay 0, chỉ còn chi phí vòng lặp + backend"""
+    report = engine.play(make_steps(clicks, 0.0))
+    return {"clicks": report["clicks"], "elapsed": report["elapsed"], "rate": report["rate"]}
+
+def bench_playlist(engine, clicks):
+    """Tốc độ tối đa của playlist có vòng lặp lồng nhau và bộ con (delay 0)"""
+    click_sets = {"A": [{"x": i, "y": i, "delay": 0} for i in range(10)]}
+    outer = max(1, clicks // 100)
+    text = f"""
+        def B {{
+            click 1 2 0
+            double 3 4 0
+            right 5 6 0
+        }}
+        repeat {outer} {{
+            repeat 9 {{
+                set A
+                wait 0
+            }}
+            call B
+        }}
+    """
+    start = time.perf_counter()
+    program = compile_playlist(text, click_sets, 0.0)
+    compile_time = time.perf_counter() - start
+    report = engine.play(program)
+    return {"instructions": len(program), "clicks": report["clicks"], "compile_ms": compile_time * 1000,
+            "elapsed": report["elapsed"], "rate": report["rate"]}
+
+def bench_schedule(engine, clicks, delay):
+    """Độ chính xác lịch: lệch tổng thời gian và jitter so với deadline"""
+    report = engine.play(make_steps(clicks, delay))
+    return {key: report[key] for key in ("clicks", "elapsed", "target", "rate", "target_rate", "drift_ms",
+                                         "jitter_mean_ms", "jitter_p99_ms", "jitter_max_ms")}
+
+def bench_stop_latency(engine, backend, delay, trials, seed=0):
+    """Thời gian từ lúc nhấn F9 tới khi worker phát lại kết thúc.
+
+    F9 đi qua đúng đường của excel.py: callback phím nóng → dispatcher →
+    engine.stop() ngay trong callback (immediate). Phím được nhấn ở thời
+    điểm ngẫu nhiên giữa hai click.
+    """
+    rng = random.Random(seed)
+    dispatcher = HotkeyDispatcher(backend)
+    dispatcher.bind("F9", "stop", engine.stop, immediate=True)
+    latencies = []
+    for _ in range(trials):
+        done = threading.Event()
+        finished_at = []
+
+        def on_done(report, error):
+            finished_at.append(time.perf_counter())
+            done.set()
+
+        engine.start(make_steps(1000, delay), on_done=on_done)
+        time.sleep(delay * rng.uniform(2.0, 3.0))
+        pressed_at = time.perf_counter()
+        if hasattr(backend, "press"):
+            backend.press("F9")
+        else:
+            dispatcher.post("stop")
+        done.wait()
+        latencies.append(finished_at[0] - pressed_at)
+    dispatcher.close()
+    return {
+        "trials": trials,
+        "delay": delay,
+        "median_ms": statistics.median(latencies) * 1000,
+        "max_ms": max(latencies) * 1000,
+    }
+
+def bench_adaptive_wait(clicks, latency_min, latency_max, seed=0):
+    """Chờ màu so với delay cố định trên màn hình giả.
+
+    Sau mỗi click "ứng dụng" bận một khoảng ngẫu nhiên trong
+    [latency_min, latency_max] rồi nút mới về màu sẵn sàng. Delay cố định
+    phải bằng latency_max để không click hụt; chờ màu click ngay khi sẵn sàng.
+    """
+    ready, busy = (40, 160, 60), (90, 90, 90)
+    button = (100, 200, 1, 1)
+    rng = random.Random(seed)
+    screen = SyntheticScreen(320, 240)
+    screen.fill(button, ready)
+    missed = []
+
+    def on_click(x, y):
+        if screen(button) != bytes(ready):
+            missed.append((x, y))
+        screen.fill(button, busy)
+        screen.fill_after(rng.uniform(latency_min, latency_max), button, ready)
+
+    backend = RecordingBackend(frame_source=screen, on_click=on_click)
+    engine = PlaybackEngine(backend)
+    until = {"x": button[0], "y": button[1], "color": format_color(ready), "timeout": latency_max * 4}
+    results = {}
+    for name, steps in (("fixed_delay", [(button[0], button[1], latency_max)]),
+                        ("adaptive", [(button[0], button[1], 0.0, until)])):
+        missed.clear()
+        screen.fill(button, ready)
+        report = engine.play(compile_steps(steps, clicks))
+        results[name] = {"clicks": report["clicks"], "elapsed": report["elapsed"], "rate": report["rate"],
+                         "missed": len(missed), "condition_wait_ms": report["condition_wait_ms"],
+                         "timeouts": report["timeouts"]}
+    engine.close()
+    results["speedup"] = results["fixed_delay"]["elapsed"] / results["adaptive"]["elapsed"]
+    return results
+
+def make_backend(name, click_cost):
+    if name == "recording":
+        return RecordingBackend(click_cost=click_cost), None
+    # Backend thật dưới Xvfb (hoặc DISPLAY có sẵn)
+    from bench_classes_counter import start_virtual_display
+    from click_engine import PyAutoGuiBackend
+    xvfb = start_virtual_display()
+    return PyAutoGuiBackend(), xvfb
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the excel.py playback engine headlessly.")
+    parser.add_argument("--backend", choices=("recording", "x"), default="recording",
+                        help="recording (in memory) or x (pyautogui, starts Xvfb if needed)")
+    parser.add_argument("--click-cost", type=float, default=0.0, help="simulated seconds per click (recording)")
+    parser.add_argument("--clicks", type=int, default=2000)
+    parser.add_argument("--delay", type=float, default=0.005, help="target delay for the schedule benchmark")
+    parser.add_argument("--stop-delay", type=float, default=0.2, help="step delay for the stop latency benchmark")
+    parser.add_argument("--trials", type=int, default=10)
+    parser.add_argument("--wait-clicks", type=int, default=20, help="clicks for the adaptive wait benchmark")
+    parser.add_argument("--latency", type=float, nargs=2, default=(0.03, 0.08), metavar=("MIN", "MAX"),
+                        help="simulated app response time range for the adaptive wait benchmark")
+    parser.add_argument("--output", help="write JSON results here (default: stdout)")
+    args = parser.parse_args(argv)
+
+    backend, xvfb = make_backend(args.backend, args.click_cost)
+    try:
+        engine = PlaybackEngine(backend)
+        results = {
+            "max_rate": bench_max_rate(engine, args.clicks),
+            "playlist": bench_playlist(engine, args.clicks),
+            "schedule": bench_schedule(engine, args.clicks, args.delay),
+            "stop_latency": bench_stop_latency(engine, backend, args.stop_delay, args.trials),
+            "adaptive_wait": bench_adaptive_wait(args.wait_clicks, *args.latency),
+        }
+        engine.close()
+    finally:
+        if xvfb is not None:
+            xvfb.terminate()
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "backend": args.backend,
+            "click_cost": args.click_cost,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    else:
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
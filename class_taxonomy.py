@@ -0,0 +1,346 @@
+import functools
+import hashlib
+import json
+import marshal
+import os
+import re
+import sys
+from types import MappingProxyType
+
+# ==========================
+# TAXONOMY CLASS - CHỈ ĐỌC, DỰNG MỘT LẦN
+# ==========================
+class ClassTaxonomy:
+    """Taxonomy class đa ngôn ngữ với index parent→children dựng sẵn.
+
+    Mọi bảng tra cứu đều được tạo một lần khi đọc file và không thay đổi
+    sau đó; save/load/render chỉ đọc từ đây.
+    """
+
+    def __init__(self, class_sets, class_mapping, parent_classes, child_classes, children_by_parent,
+                 class_keys=None, columns=None, indexes=None):
+        self.class_sets = MappingProxyType({lang: tuple(names) for lang, names in class_sets.items()})
+        self.languages = tuple(class_sets.keys())
+        self.class_mapping = MappingProxyType(
+            {index: MappingProxyType(names) for index, names in class_mapping.items()}
+        )
+        self.class_indexes = tuple(class_mapping.keys())
+        self.parent_classes = MappingProxyType(dict(parent_classes))
+        self.parent_indices = tuple(sorted(parent_classes))
+        self.child_classes = tuple(child_classes)
+
+        # Key đánh số bỏ phần ngôn ngữ ("1.1.3" → "1.3"), giống nhau trên mọi ngôn ngữ
+        self.class_keys = MappingProxyType(dict(class_keys or {}))
+        self.index_by_key = MappingProxyType({key: index for index, key in self.class_keys.items()})
+
+        # Cột hiển thị (LEFT/CENTER/RIGHT) của từng parent
+        self.columns = MappingProxyType(dict(columns or {}))
+
+        # parent → (child, ...) theo thứ tự xuất hiện trong file
+        self.children_by_parent = MappingProxyType({
+            parent_index: tuple(children_by_parent.get(parent_index, ()))
+            for parent_index in self.parent_indices
+        })
+
+        self.parent_of = MappingProxyType({
+            index: parent_index for parent_index, children in self.children_by_parent.items() for index in children
+        })
+
+        # Danh sách class con theo thứ tự dùng cho header Excel
+        self.child_indices = tuple(sorted(
+            index for children in self.children_by_parent.values() for index in children
+        ))
+
+        # Tên class con theo từng ngôn ngữ, cùng thứ tự với child_indices
+        self.child_names = MappingProxyType({
+            lang: tuple(self.class_mapping[index].get(lang, f"Class_{index}") for index in self.child_indices)
+            for lang in self.languages
+        })
+
+        # Bảng tra ngược lấy từ cache nếu có (xem build_indexes)
+        if indexes is None:
+            indexes = self.build_indexes()
+        self.name_index = MappingProxyType(indexes["name_index"])
+        self.unique_name_index = MappingProxyType(indexes["unique_name_index"])
+        self.language_by_header = MappingProxyType(indexes["language_by_header"])
+
+    def build_indexes(self):
+        """Bảng tra ngược dạng dict thường (lưu được vào cache taxonomy)"""
+        # (ngôn ngữ, tên class) → index, chỉ cho class con
+        name_index = {}
+        indices_by_name = {}
+        for lang, names in self.child_names.items():
+            for index, name in zip(self.child_indices, names):
+                name_index.setdefault((lang, name), index)
+                indices_by_name.setdefault(name, set()).add(index)
+
+        # Header class (tuple) → ngôn ngữ, để nhận diện sheet trong O(1)
+        language_by_header = {}
+        for lang, names in self.child_names.items():
+            language_by_header.setdefault(names, lang)
+
+        return {
+            "name_index": name_index,
+            # Tên không phân biệt ngôn ngữ - chỉ giữ tên trỏ tới đúng một class
+            "unique_name_index": {
+                name: next(iter(indices)) for name, indices in indices_by_name.items() if len(indices) == 1
+            },
+            "language_by_header": language_by_header,
+        }
+
+    @functools.cached_property
+    def identity(self):
+        """Danh tính class theo key: key → [là parent, {ngôn ngữ: tên}].
+
+        Lưu kèm số đếm theo key để khi classes.txt bị chèn dòng và đánh số
+        lại vẫn ghép được về class đúng (xem class_key_mapping).
+        """
+        return {key: [index in self.parent_classes, dict(self.class_mapping[index])]
+                for index, key in self.class_keys.items()}
+
+    @functools.cached_property
+    def identity_digest(self):
+        """sha256 của identity - giống nhau thì key không cần ghép lại"""
+        text = json.dumps(self.identity, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def __bool__(self):
+        return bool(self.languages)
+
+    def class_name(self, index, lang, default=None):
+        """Tên class theo ngôn ngữ, trả về default nếu không có"""
+        names = self.class_mapping.get(index)
+        if names is None:
+            return default
+        return names.get(lang, default)
+
+    def resolve_header(self, excel_classes, lang=None):
+        """Ánh xạ cột header Excel → class index trong một lượt.
+
+        Nếu không biết ngôn ngữ, chọn ngôn ngữ khớp nhiều cột nhất. Cột
+        không khớp ngôn ngữ đó chỉ được nhận khi tên là duy nhất trên mọi
+        ngôn ngữ; còn lại trả về None.
+        """
+        if lang is None and self.languages:
+            lang = max(
+                self.languages,
+                key=lambda l: sum((l, name) in self.name_index for name in excel_classes),
+            )
+        lookup = self.name_index.get
+        fallback = self.unique_name_index.get
+        return tuple(lookup((lang, name), fallback(name)) for name in excel_classes)
+
+
+# ==========================
+# PHÂN TÍCH CLASSES.TXT - MỘT LƯỢT, CÓ CACHE
+# ==========================
+# Từ khóa tên parent → cột hiển thị, xét theo thứ tự, khớp tên ở mọi ngôn ngữ
+COLUMN_KEYWORDS = (
+    ("LEFT", ("車線", "Lane", "Làn đường")),
+    ("LEFT", ("横断", "Crosswalk", "Vạch sang đường")),
+    ("CENTER", ("センター", "Center", "Đường tâm")),
+    ("CENTER", ("交差点", "Intersection", "Giao lộ")),
+    ("CENTER", ("道路端", "Roadside", "Lề đường")),
+    ("RIGHT", ("その他", "Others", "Khác")),
+)
+
+# "1. Ngôn ngữ", "1.2. Parent", "1.2.3. Class con" trong một regex
+_CLASS_LINE_RE = re.compile(r"^(\d+)\.(?:(\d+)\.)?(?:(\d+)\.)?\s(.*)$")
+
+TAXONOMY_CACHE_SUFFIX = ".cache"
+# Đổi khi cấu trúc dữ liệu cache thay đổi
+TAXONOMY_CACHE_VERSION = 2
+
+def _column_for_parent(names):
+    for column_type, keywords in COLUMN_KEYWORDS:
+        if any(keyword in name for name in names for keyword in keywords):
+            return column_type
+    return "CENTER"
+
+def parse_classes_text(text):
+    """Phân tích nội dung classes.txt trong một lượt.
+
+    Trả về dict tham số cho ClassTaxonomy (chỉ gồm kiểu dữ liệu cơ bản để
+    có thể lưu cache).
+    """
+    lang_dict = {}
+    class_mapping = {}
+    current_lang = None
+    current_class_index = 0
+    current_parent = None
+    parent_classes = {}
+    child_classes = []
+    children_by_parent = {}
+    class_keys = {}
+    match_line = _CLASS_LINE_RE.match
+
+    for line in text.splitlines():
+        line = line.strip()
+        match = match_line(line) if line else None
+        if match is None:
+            continue
+        _, parent_number, child_number, cls_name = match.groups()
+
+        if parent_number is None:
+            current_lang = cls_name
+            lang_dict[current_lang] = []
+            current_class_index = 0
+            current_parent = None
+            continue
+        if not current_lang:
+            continue
+
+        lang_dict[current_lang].append(cls_name)
+        is_new = current_class_index not in class_mapping
+        if is_new:
+            class_mapping[current_class_index] = {}
+        class_mapping[current_class_index][current_lang] = cls_name
+
+        if child_number is None:
+            if is_new:
+                children_by_parent[current_class_index] = []
+                class_keys[current_class_index] = parent_number
+            parent_classes[current_class_index] = cls_name
+            current_parent = current_class_index
+        elif is_new:
+            class_keys[current_class_index] = f"{parent_number}.{child_number}"
+            child_classes.append(current_class_index)
+            if current_parent is not None:
+                children_by_parent[current_parent].append(current_class_index)
+        current_class_index += 1
+
+    columns = {
+        parent_index: _column_for_parent(class_mapping[parent_index].values())
+        for parent_index in parent_classes
+    }
+
+    return {
+        "class_sets": lang_dict,
+        "class_mapping": class_mapping,
+        "parent_classes": parent_classes,
+        "child_classes": child_classes,
+        "children_by_parent": children_by_parent,
+        "class_keys": class_keys,
+        "columns": columns,
+    }
+
+def _taxonomy_cache_key(raw):
+    """Khóa cache: nội dung file + phiên bản cache + phiên bản Python (marshal)"""
+    digest = hashlib.sha256(raw)
+    digest.update(f"{TAXONOMY_CACHE_VERSION}:{sys.version_info[:2]}".encode())
+    return digest.hexdigest()
+
+def _read_taxonomy_cache(cache_path, key):
+    try:
+        with open(cache_path, "rb") as f:
+            # loads(read()) thay vì load(f): load đọc từng mẩu nhỏ qua file object, chậm hơn cả parse lại
+            cached = marshal.loads(f.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    if isinstance(cached, dict) and cached.get("key") == key:
+        return cached.get("data")
+    return None
+
+def _write_taxonomy_cache(cache_path, key, data):
+    tmp_path = cache_path + ".tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            marshal.dump({"key": key, "data": data}, f)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        # Cache chỉ để khởi động nhanh - lỗi ghi thì bỏ qua
+        pass
+
+def read_taxonomy_file(filename="classes.txt", use_cache=True):
+    """Đọc taxonomy, dùng cache nhị phân nếu nội dung file không đổi.
+
+    Không cần Tk nên dùng được ở process con (aggregate_counts); file không
+    tồn tại thì ném FileNotFoundError.
+    """
+    with open(filename, "rb") as f:
+        raw = f.read()
+
+    cache_path = filename + TAXONOMY_CACHE_SUFFIX
+    key = _taxonomy_cache_key(raw)
+    data = _read_taxonomy_cache(cache_path, key) if use_cache else None
+    if data is not None:
+        return ClassTaxonomy(**data)
+
+    data = parse_classes_text(raw.decode("utf-8"))
+    taxonomy = ClassTaxonomy(**data)
+    if use_cache:
+        # Lưu kèm bảng tra ngược để lần sau không phải dựng lại
+        indexes = {name: dict(getattr(taxonomy, name)) for name in ("name_index", "unique_name_index",
+                                                                   "language_by_header")}
+        _write_taxonomy_cache(cache_path, key, dict(data, indexes=indexes))
+    return taxonomy
+
+def match_taxonomies(old, new):
+    """Ghép class của taxonomy cũ với taxonomy mới theo danh tính ổn định.
+
+    Ưu tiên tên class (khớp ở bất kỳ ngôn ngữ nào có trong cả hai), đúng cả
+    khi dòng được chèn và đánh số lại; class không khớp tên thì ghép theo key
+    đánh số không kèm ngôn ngữ ("1.3"), nên sửa tên vẫn giữ được số đếm.
+    Parent chỉ ghép với parent, class con với class con.
+    Trả về dict index cũ → index mới.
+    """
+    new_by_name = {}
+    for index, names in new.class_mapping.items():
+        for lang, name in names.items():
+            new_by_name.setdefault((lang, name), set()).add(index)
+
+    mapping = {}
+    used = set()
+    unmatched = []
+    for old_index, names in old.class_mapping.items():
+        is_parent = old_index in old.parent_classes
+        candidates = {
+            new_index
+            for lang, name in names.items()
+            for new_index in new_by_name.get((lang, name), ())
+            if (new_index in new.parent_classes) == is_parent
+        }
+        if len(candidates) == 1 and not candidates & used:
+            new_index = candidates.pop()
+            mapping[old_index] = new_index
+            used.add(new_index)
+        else:
+            unmatched.append((old_index, is_parent, candidates))
+
+    for old_index, is_parent, candidates in unmatched:
+        new_index = new.index_by_key.get(old.class_keys.get(old_index))
+        if new_index is None or new_index in used or (new_index in new.parent_classes) != is_parent:
+            continue
+        if candidates and new_index not in candidates:
+            continue
+        mapping[old_index] = new_index
+        used.add(new_index)
+    return mapping
+
+def taxonomy_from_identity(identity):
+    """Dựng lại taxonomy từ ClassTaxonomy.identity đã lưu (đủ cho match_taxonomies)"""
+    class_sets = {}
+    class_mapping = {}
+    parent_classes = {}
+    child_classes = []
+    class_keys = {}
+    for index, (key, (is_parent, names)) in enumerate(identity.items()):
+        class_mapping[index] = names
+        class_keys[index] = key
+        for lang, name in names.items():
+            class_sets.setdefault(lang, []).append(name)
+        if is_parent:
+            parent_classes[index] = next(iter(names.values()), key)
+        else:
+            child_classes.append(index)
+    return ClassTaxonomy(class_sets, class_mapping, parent_classes, child_classes, {}, class_keys)
+
+def class_key_mapping(identity, taxonomy):
+    """key theo taxonomy cũ (identity đã lưu) → key trong taxonomy hiện tại.
+
+    Class không còn trong taxonomy hiện tại không có mặt trong kết quả.
+    """
+    old = taxonomy_from_identity(identity)
+    new_keys = taxonomy.class_keys
+    return {old.class_keys[old_index]: new_keys[new_index]
+            for old_index, new_index in match_taxonomies(old, taxonomy).items()}
@@ -1,60 +1,1046 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
+from array import array
 import openpyxl
 import os
+import sys
+import json
 import time
-import re
+import queue
+import sqlite3
+import stat
+import tempfile
+import threading
+import functools
+import logging
+import logging.handlers
+
+from class_taxonomy import (
+    ClassTaxonomy,
+    class_key_mapping,
+    match_taxonomies,
+    read_taxonomy_file,
+    taxonomy_from_identity,
+)
+
+try:
+    import gpx_routes
+except ImportError:
+    # Cần numpy - không có thì bỏ qua phần route GPX
+    gpx_routes = None
+
+# ==========================
+# ĐO THỜI GIAN ĐOẠN NÓNG - TRACE JSON-LINES
+# ==========================
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+class _Span:
+    __slots__ = ("tracer", "name", "fields", "start")
+
+    def __init__(self, tracer, name, fields):
+        self.tracer = tracer
+        self.name = name
+        self.fields = fields
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.tracer.record(self.name, time.perf_counter() - self.start, self.fields, error=exc_type)
+        return False
+
+class Tracer:
+    """Đo thời gian các đoạn nóng (I/O workbook, khớp header, đổi ngôn ngữ, tạo hàng...).
+
+    Tắt mặc định; khi tắt span() chỉ trả về một context manager rỗng dùng
+    chung. Khi bật, mỗi span được ghi một dòng JSON vào file trace xoay vòng
+    và cộng vào thống kê (số lần, tổng, max, lần cuối) cho bảng Stats.
+    An toàn khi gọi từ luồng ghi Excel.
+    """
+
+    def __init__(self, path="trace.jsonl", max_bytes=5 * 1024 * 1024, backup_count=3):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.enabled = False
+        self.stats = {}
+        self._lock = threading.Lock()
+        self._logger = None
+
+    def enable(self):
+        if self._logger is None:
+            handler = logging.handlers.RotatingFileHandler(
+                self.path, maxBytes=self.max_bytes, backupCount=self.backup_count, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._logger = logging.getLogger("classes_counter.trace")
+            self._logger.setLevel(logging.INFO)
+            self._logger.propagate = False
+            self._logger.addHandler(handler)
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def span(self, name, **fields):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, fields)
+
+    def record(self, name, seconds, fields=None, error=None, log=True):
+        with self._lock:
+            stat = self.stats.get(name)
+            if stat is None:
+                stat = self.stats[name] = {"count": 0, "total": 0.0, "max": 0.0, "last": 0.0}
+            stat["count"] += 1
+            stat["total"] += seconds
+            stat["last"] = seconds
+            if seconds > stat["max"]:
+                stat["max"] = seconds
+        if not log or self._logger is None:
+            return
+        entry = {"ts": round(time.time(), 3), "span": name, "ms": round(seconds * 1000, 3),
+                 "thread": threading.current_thread().name}
+        if fields:
+            entry.update(fields)
+        if error is not None:
+            entry["error"] = error.__name__
+        self._logger.info(json.dumps(entry, ensure_ascii=False, default=str))
+
+    def snapshot_stats(self):
+        with self._lock:
+            return {name: dict(stat) for name, stat in self.stats.items()}
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats.clear()
+
+tracer = Tracer()
+if os.environ.get("CLASSES_COUNTER_TRACE"):
+    tracer.enable()
+
+def traced(name):
+    """Decorator: đo cả hàm như một span; khi tracer tắt chỉ thêm một phép kiểm tra"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+            with _Span(tracer, name, None):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
 
 # ==========================
 # ĐỌC FILE CLASS ĐA NGÔN NGỮ - TỐI ƯU
 # ==========================
-def load_classes_from_file(filename="classes.txt"):
+@traced("taxonomy.load")
+def load_classes_from_file(filename="classes.txt", use_cache=True):
+    """Đọc taxonomy (xem class_taxonomy.read_taxonomy_file), báo lỗi nếu thiếu file"""
     if not os.path.exists(filename):
         messagebox.showerror("Error", f"File {filename} not found.")
-        return {}, [], {}
-
-    with open(filename, "r", encoding="utf-8") as f:
-        lines = [line.strip() for line in f if line.strip()]
-
-    lang_dict = {}
-    class_mapping = {}
-    current_lang = None
-    current_class_index = 0
-    parent_classes = {}
-    child_classes = []
-
-    for line in lines:
-        if re.match(r"^\d+\.\s", line):
-            lang_name = line.split(". ", 1)[1]
-            current_lang = lang_name
-            lang_dict[current_lang] = []
-            current_class_index = 0
-        elif re.match(r"^\d+\.\d+\.\s", line) and current_lang:
-            cls_name = line.split(". ", 1)[1]
-            lang_dict[current_lang].append(cls_name)
-            
-            if current_class_index not in class_mapping:
-                class_mapping[current_class_index] = {}
-            class_mapping[current_class_index][current_lang] = cls_name
-            parent_classes[current_class_index] = cls_name
-            current_class_index += 1
-        elif re.match(r"^\d+\.\d+\.\d+\.\s", line) and current_lang:
-            cls_name = line.split(". ", 1)[1]
-            lang_dict[current_lang].append(cls_name)
-            
-            if current_class_index not in class_mapping:
-                class_mapping[current_class_index] = {}
-            class_mapping[current_class_index][current_lang] = cls_name
-            child_classes.append(current_class_index)
-            current_class_index += 1
-
-    languages = list(lang_dict.keys())
-    return lang_dict, languages, class_mapping, parent_classes, child_classes
+        return ClassTaxonomy({}, {}, {}, [], {})
+    return read_taxonomy_file(filename, use_cache)
 
 # Hàm validate chỉ cho phép nhập số
 def validate_number_input(new_value):
     return new_value == "" or new_value.isdigit()
 
+# ==========================
+# BỘ ĐẾM - MẢNG SỐ NGUYÊN THEO CLASS INDEX
+# ==========================
+class CountStore:
+    """Lưu số đếm trong một mảng số nguyên, đánh index theo class index.
+
+    Không phụ thuộc Tk: giao diện chỉ đăng ký on_change để cập nhật các
+    hàng đang hiển thị. on_change(index) được gọi sau mỗi thay đổi một
+    class, on_change(None) sau các thao tác hàng loạt. on_record(index,
+    cũ, mới) nhận cùng các thay đổi đó kèm giá trị (index None khi hàng
+    loạt), dùng cho nhật ký phiên.
+    """
+
+    def __init__(self, size):
+        self.values = array("l", [0]) * size
+        self.on_change = None
+        self.on_record = None
+
+    def __len__(self):
+        return len(self.values)
+
+    def _notify(self, index, old=None, new=None):
+        if self.on_change is not None:
+            self.on_change(index)
+        if self.on_record is not None:
+            self.on_record(index, old, new)
+
+    def get(self, index):
+        return self.values[index]
+
+    def set(self, index, value):
+        value = max(int(value), 0)
+        old = self.values[index]
+        if old != value:
+            self.values[index] = value
+            self._notify(index, old, value)
+
+    def increment(self, index, amount=1):
+        self.set(index, self.values[index] + amount)
+
+    def decrement(self, index, amount=1):
+        self.set(index, self.values[index] - amount)
+
+    def add(self, deltas):
+        """Cộng dồn nhiều thay đổi {index: delta} trong một lần"""
+        values = self.values
+        changed = []
+        for index, delta in deltas.items():
+            old = values[index]
+            value = max(old + delta, 0)
+            if old != value:
+                values[index] = value
+                changed.append((index, old, value))
+        for index, old, value in changed:
+            self._notify(index, old, value)
+
+    def take(self, indices):
+        """Giá trị theo danh sách index (vd. child_indices khi lưu)"""
+        values = self.values
+        return [values[index] for index in indices]
+
+    def assign(self, values):
+        """Thay toàn bộ giá trị bằng một dãy cùng độ dài"""
+        self.values = array("l", values)
+        self._notify(None)
+
+    def reset(self):
+        self.values = array("l", [0]) * len(self.values)
+        self._notify(None)
+
+    def snapshot(self):
+        return array("l", self.values)
+
+    def remap(self, mapping, size):
+        """Chuyển số đếm sang bố cục index mới (dict index cũ → index mới)"""
+        old_values = self.values
+        values = array("l", [0]) * size
+        for old_index, new_index in mapping.items():
+            if old_index < len(old_values):
+                values[new_index] = old_values[old_index]
+        self.values = values
+        self._notify(None)
+
+    def total(self, indices=None):
+        if indices is None:
+            return sum(self.values)
+        return sum(self.take(indices))
+
+    def diff(self, other):
+        """Danh sách (index, giá trị cũ, giá trị mới) khác với snapshot other"""
+        return [(index, old, new) for index, (old, new) in enumerate(zip(other, self.values)) if old != new]
+
+# ==========================
+# NHẬT KÝ PHIÊN - APPEND-ONLY, KHÔI PHỤC SAU CRASH
+# ==========================
+class SessionJournal:
+    """Nhật ký phiên làm việc dạng append-only (mỗi dòng một bản ghi JSON).
+
+    Bản ghi: [ts, "c", key, cũ, mới] khi đổi số đếm, [ts, "snap", {key: số},
+    tổng giây] sau thao tác hàng loạt, [ts, "start"] / [ts, "pause", tổng
+    giây] / [ts, "tick"] cho bộ hẹn giờ. Class ghi theo key đánh số; key
+    đổi khi classes.txt bị chèn dòng, nên [ts, "tax", identity] ghi lại
+    ClassTaxonomy.identity áp dụng cho các bản ghi sau nó và replay ghép
+    key về taxonomy hiện tại. Ghi vào buffer, fsync theo lô qua sync();
+    compact() ghi snapshot rồi làm rỗng nhật ký.
+    """
+
+    COMPACT_EVERY = 5000
+
+    def __init__(self, path="session.journal"):
+        self.path = path
+        self.snapshot_path = path + ".snapshot"
+        self.record_count = 0
+        # Danh tính taxonomy của các key đang ghi (None: nhật ký cũ, không rõ)
+        self.identity = None
+        self._file = None
+        self._dirty = False
+
+    @staticmethod
+    def _remap(counts, changes, identity, taxonomy):
+        """Đổi key của counts/changes ghi theo identity sang key của taxonomy"""
+        keys = class_key_mapping(identity, taxonomy)
+        return ({keys[key]: value for key, value in counts.items() if key in keys},
+                [(keys[key], old, new) for key, old, new in changes if key in keys])
+
+    def replay(self, taxonomy=None):
+        """Đọc snapshot và nhật ký, trả về (counts theo key, tổng giây, các
+        thay đổi [(key, cũ, mới)] kể từ snapshot cuối).
+
+        Có taxonomy thì key được ghép về taxonomy đó nếu nhật ký ghi theo
+        một phiên bản classes.txt khác.
+        """
+        counts = {}
+        total_work_time = 0.0
+        session_start = None
+        changes = []
+        last_ts = None
+        identity = None
+
+        try:
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+            counts = dict(snapshot.get("counts", {}))
+            total_work_time = float(snapshot.get("total_work_time", 0.0))
+            session_start = snapshot.get("session_start")
+            last_ts = snapshot.get("ts")
+            identity = snapshot.get("taxonomy")
+        except (OSError, ValueError, TypeError, AttributeError):
+            pass
+
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                lines = f.readlines()
+        except OSError:
+            lines = []
+
+        for line in lines:
+            try:
+                record = json.loads(line)
+                ts, kind = record[0], record[1]
+            except (ValueError, IndexError, TypeError):
+                # Dòng ghi dở lúc crash - bỏ qua
+                continue
+            last_ts = ts
+            if kind == "c":
+                _, _, key, old, new = record
+                counts[key] = new
+                changes.append((key, old, new))
+            elif kind == "snap":
+                counts = dict(record[2])
+                total_work_time = float(record[3])
+                changes = []
+            elif kind == "start":
+                session_start = ts
+            elif kind == "pause":
+                total_work_time = float(record[2])
+                session_start = None
+            elif kind == "tax":
+                if identity is not None and (counts or changes) and record[2] != identity:
+                    counts, changes = self._remap(counts, changes, identity, taxonomy_from_identity(record[2]))
+                identity = record[2]
+        self.record_count = len(lines)
+        self.identity = identity
+
+        if taxonomy is not None and identity is not None and identity != taxonomy.identity:
+            counts, changes = self._remap(counts, changes, identity, taxonomy)
+
+        # Phiên đang chạy lúc crash: tính đến bản ghi cuối cùng
+        if session_start is not None and last_ts is not None:
+            total_work_time += max(last_ts - session_start, 0.0)
+        return counts, total_work_time, changes
+
+    def open(self):
+        self._file = open(self.path, "a", encoding="utf-8")
+        # Dòng cuối ghi dở lúc crash: xuống dòng để bản ghi mới không dính vào
+        if self._file.tell() > 0:
+            with open(self.path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self._file.write("\n")
+
+    def append(self, *record):
+        line = json.dumps([round(time.time(), 3), *record], ensure_ascii=False, separators=(",", ":"))
+        self._file.write(line + "\n")
+        self._dirty = True
+        self.record_count += 1
+
+    def set_taxonomy(self, taxonomy):
+        """Ghi danh tính taxonomy cho các bản ghi sau (không ghi nếu không đổi)"""
+        if taxonomy.identity != self.identity:
+            self.append("tax", taxonomy.identity)
+            self.identity = taxonomy.identity
+
+    def sync(self):
+        """Flush và fsync các bản ghi đang nằm trong buffer"""
+        if self._dirty and self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._dirty = False
+
+    def needs_compaction(self):
+        return self.record_count >= self.COMPACT_EVERY
+
+    def compact(self, counts, total_work_time, session_start=None):
+        """Ghi snapshot nguyên tử rồi làm rỗng nhật ký"""
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"ts": round(time.time(), 3), "counts": counts, "total_work_time": total_work_time,
+                       "session_start": session_start, "taxonomy": self.identity}, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        _match_file_mode(tmp_path, self.snapshot_path)
+        os.replace(tmp_path, self.snapshot_path)
+
+        if self._file is not None:
+            self._file.close()
+        self._file = open(self.path, "w", encoding="utf-8")
+        self._dirty = False
+        self.record_count = 0
+
+    def close(self):
+        self.sync()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+# ==========================
+# PHÍM TẮT ĐẾM - ĐỌC FILE MAPPING
+# ==========================
+def modifier_masks(platform=sys.platform):
+    """Bit trạng thái của modifier trong event.state theo nền tảng.
+
+    Alt là 0x20000 trên Windows (0x0008 ở đó là NumLock), Option là Mod2
+    (0x0010) trên macOS, còn X11 dùng Mod1 (0x0008).
+    """
+    if platform == "win32":
+        alt = 0x20000
+    elif platform == "darwin":
+        alt = 0x0010
+    else:
+        alt = 0x0008
+    return {"Shift": 0x0001, "Control": 0x0004, "Alt": alt}
+
+MODIFIER_MASKS = modifier_masks()
+
+def load_hotkeys_from_file(taxonomy, filename="hotkeys.json"):
+    """Đọc mapping phím → class và biên dịch thành dict keysym → class index.
+
+    File JSON: {"decrement_modifier": "Control", "keys": {"q": "1.1", ...}}
+    Class được chỉ định bằng key đánh số không kèm ngôn ngữ ("1.1" = 1.1.1,
+    2.1.1, 3.1.1) hoặc bằng tên class duy nhất ở bất kỳ ngôn ngữ nào.
+    Trả về (dict keysym → index, mask của modifier giảm).
+    """
+    if not os.path.exists(filename):
+        return {}, MODIFIER_MASKS["Control"]
+
+    with open(filename, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    modifier = data.get("decrement_modifier", "Control")
+    if modifier not in MODIFIER_MASKS:
+        raise ValueError(f"Unknown decrement modifier '{modifier}' in {filename}")
+
+    hotkeys = {}
+    for keysym, class_ref in data.get("keys", {}).items():
+        index = taxonomy.index_by_key.get(class_ref, taxonomy.unique_name_index.get(class_ref))
+        if index is None or index in taxonomy.parent_classes:
+            print(f"WARNING: hotkey '{keysym}' refers to unknown class '{class_ref}'")
+            continue
+        # Phím chữ được so khớp không phân biệt hoa/thường (Shift đổi keysym)
+        hotkeys[keysym.lower() if len(keysym) == 1 else keysym] = index
+    return hotkeys, MODIFIER_MASKS[modifier]
+
+def _to_count(value):
+    """Chuyển giá trị ô Excel thành số đếm, None nếu không hợp lệ"""
+    try:
+        return max(int(value), 0)
+    except (TypeError, ValueError):
+        return None
+
+# ==========================
+# ĐỌC WORKBOOK - STREAMING (READ-ONLY)
+# ==========================
+def _read_header(ws):
+    """Đọc riêng dòng header của sheet ở chế độ streaming"""
+    for header in ws.iter_rows(min_row=1, max_row=1, values_only=True):
+        return list(header)
+    return []
+
+@traced("header.match")
+def find_counts_sheet(wb, taxonomy):
+    """Tìm sheet có header khớp danh sách class con của một ngôn ngữ.
+
+    Ưu tiên các sheet Counts_<lang>; chỉ đọc dòng header của từng sheet.
+    Trả về (sheet, ngôn ngữ, header); nếu không khớp thì dùng sheet active.
+    """
+    preferred = [f"Counts_{lang}" for lang in taxonomy.languages]
+    sheet_names = [name for name in preferred if name in wb.sheetnames]
+    sheet_names += [name for name in wb.sheetnames if name not in sheet_names]
+
+    for sheet_name in sheet_names:
+        sheet = wb[sheet_name]
+        header = _read_header(sheet)
+        if len(header) >= 3:
+            loaded_lang = taxonomy.language_by_header.get(tuple(header[2:]))
+            if loaded_lang:
+                return sheet, loaded_lang, header
+
+    sheet = wb.active
+    return sheet, None, _read_header(sheet) if sheet is not None else []
+
+@traced("workbook.load")
+def read_dataset_row(filename, dataset_name, taxonomy):
+    """Đọc một dòng dataset bằng openpyxl read-only, dừng ngay khi thấy.
+
+    Trả về (ngôn ngữ, header, dòng) hoặc None nếu không tìm thấy.
+    """
+    wb = openpyxl.load_workbook(filename, read_only=True, data_only=True)
+    try:
+        ws, loaded_lang, header = find_counts_sheet(wb, taxonomy)
+        if ws is None:
+            return None
+        for row in ws.iter_rows(min_row=2, values_only=True):
+            if row and row[0] == dataset_name:
+                return loaded_lang, header, row
+        return None
+    finally:
+        wb.close()
+
+def _dataset_rows(ws):
+    """Dataset name → số dòng của sheet, quét cột A một lần"""
+    rows = {}
+    for row_number, (value,) in enumerate(ws.iter_rows(min_row=2, max_col=1, values_only=True), start=2):
+        if isinstance(value, str):
+            rows.setdefault(value, row_number)
+    return rows
+
+def upsert_dataset_row(ws, rows, values):
+    """Cập nhật dòng có cùng dataset name (values[0]) hoặc thêm dòng mới.
+
+    rows: dict dataset name → số dòng của sheet (xem _dataset_rows), được
+    cập nhật khi thêm dòng để ghi nhiều dataset chỉ cần quét sheet một lần.
+    """
+    dataset_name = values[0]
+    row_number = rows.get(dataset_name)
+    if row_number is None:
+        # Thêm dòng mới
+        ws.append(values)
+        rows[dataset_name] = ws.max_row
+        return
+
+    # Cập nhật dòng hiện có
+    for column, value in enumerate(values, start=1):
+        ws.cell(row=row_number, column=column, value=value)
+    # Xóa dữ liệu thừa nếu có
+    for cell in ws[row_number][len(values):]:
+        cell.value = None
+
+# ==========================
+# GHI WORKBOOK - NỀN, GỘP, THAY THẾ NGUYÊN TỬ
+# ==========================
+# umask đọc một lần lúc import: os.umask() đổi giá trị chung của process nên
+# không gọi được an toàn từ luồng ghi nền
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+def _match_file_mode(tmp_path, target):
+    """Đặt quyền file tạm trước os.replace: giữ quyền của file đích nếu đã
+    có, file mới thì theo umask như open() (mkstemp luôn tạo 0600)"""
+    try:
+        mode = stat.S_IMODE(os.stat(target).st_mode)
+    except FileNotFoundError:
+        mode = 0o666 & ~_UMASK
+    os.chmod(tmp_path, mode)
+
+def _ensure_header(ws, header):
+    """Tạo header nếu chưa có hoặc không khớp (xóa sheet và tạo lại)"""
+    if ws.max_row == 0:
+        ws.append(header)
+        return
+    current_header = [cell.value for cell in ws[1]]
+    if current_header != header:
+        ws.delete_rows(1, ws.max_row)
+        ws.append(header)
+
+@traced("workbook.save")
+def write_workbook_rows(filename, rows):
+    """Ghi nhiều dòng dataset vào workbook trong một lần load/save.
+
+    rows: danh sách (sheet_name, header, values). File được ghi ra file
+    tạm cùng thư mục rồi os.replace vào chỗ, nên không bao giờ để lại
+    workbook ghi dở.
+    """
+    if os.path.exists(filename):
+        wb = openpyxl.load_workbook(filename)
+    else:
+        wb = openpyxl.Workbook()
+        wb.active.title = rows[0][0]
+
+    # Index dòng của từng sheet, dựng khi gặp sheet lần đầu trong lần ghi này
+    sheet_rows = {}
+    for sheet_name, header, values in rows:
+        if sheet_name in wb.sheetnames:
+            ws = wb[sheet_name]
+        else:
+            ws = wb.create_sheet(sheet_name)
+        if sheet_name not in sheet_rows:
+            _ensure_header(ws, header)
+            sheet_rows[sheet_name] = _dataset_rows(ws)
+        upsert_dataset_row(ws, sheet_rows[sheet_name], values)
+
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_path = tempfile.mkstemp(suffix=".xlsx", dir=directory)
+    os.close(fd)
+    try:
+        wb.save(tmp_path)
+        _match_file_mode(tmp_path, filename)
+        os.replace(tmp_path, filename)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def build_export_rows(taxonomy, datasets, languages):
+    """Tạo các dòng (sheet, header, values) cho nhiều dataset và ngôn ngữ.
+
+    datasets: dict dataset name → (working time, counts theo child_indices).
+    """
+    rows = []
+    for lang in languages:
+        sheet_name = f"Counts_{lang}"
+        header = ["Dataset Name", "Working Time"] + list(taxonomy.child_names[lang])
+        for dataset_name, (elapsed_str, counts) in datasets.items():
+            rows.append((sheet_name, header, [dataset_name, elapsed_str] + list(counts)))
+    return rows
+
+def build_density_rows(taxonomy, datasets, languages, route_lengths):
+    """Các dòng sheet Density_<lang>: độ dài route và số đếm/km của từng class.
+
+    route_lengths: dict dataset name → (tên route, độ dài m); dataset không
+    có route hoặc route dài 0 bị bỏ qua. Sheet Counts_<lang> giữ nguyên để
+    đọc lại/tổng hợp như cũ.
+    """
+    rows = []
+    densities = {}
+    for dataset_name, (_, counts) in datasets.items():
+        route_name, length_m = route_lengths.get(dataset_name, (None, 0.0))
+        per_km = gpx_routes.density_per_km(counts, length_m) if length_m > 0 else None
+        if per_km is not None:
+            total_per_km = sum(counts) * 1000.0 / length_m
+            densities[dataset_name] = [route_name, round(length_m / 1000, 3), round(total_per_km, 3)] + \
+                [round(value, 3) for value in per_km.tolist()]
+
+    for lang in languages:
+        sheet_name = f"Density_{lang}"
+        header = ["Dataset Name", "Route", "Route Length (km)", "Total/km"] + \
+            [f"{name}/km" for name in taxonomy.child_names[lang]]
+        for dataset_name, values in densities.items():
+            rows.append((sheet_name, header, [dataset_name] + values))
+    return rows
+
+class ExcelSaveWorker:
+    """Luồng nền ghi Excel qua hàng đợi.
+
+    Các lần lưu cùng một file khi file đó còn chờ ghi được gộp lại: mỗi
+    (sheet, dataset) chỉ giữ giá trị mới nhất và cả file được ghi một lần.
+    Kết quả (filename, số dòng, lỗi) được đưa vào self.results để luồng
+    UI lấy ra bằng root.after.
+    """
+
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self.results = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="excel-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, filename, sheet_name, header, values):
+        self.submit_rows(filename, [(sheet_name, header, values)])
+
+    def submit_rows(self, filename, rows):
+        """Đưa nhiều dòng của cùng một file vào một lần ghi"""
+        with self._lock:
+            pending = self._pending.get(filename)
+            if pending is None:
+                pending = self._pending[filename] = {}
+                self._queue.put(filename)
+            for sheet_name, header, values in rows:
+                pending[(sheet_name, values[0])] = (sheet_name, header, values)
+
+    def _run(self):
+        while True:
+            filename = self._queue.get()
+            try:
+                if filename is None:
+                    return
+                with self._lock:
+                    rows = list(self._pending.pop(filename, {}).values())
+                if not rows:
+                    continue
+                try:
+                    write_workbook_rows(filename, rows)
+                    self.results.put((filename, len(rows), None))
+                except Exception as e:
+                    self.results.put((filename, len(rows), e))
+            finally:
+                self._queue.task_done()
+
+    def close(self):
+        """Chờ ghi xong các file đang chờ rồi dừng luồng"""
+        self._queue.put(None)
+        self._thread.join()
+
+# ==========================
+# KHO DATASET - SQLITE LÀ NƠI LƯU CHÍNH, EXCEL CHỈ ĐỂ XUẤT
+# ==========================
+class SqliteDatasetStore:
+    """Kho dataset trên SQLite (chế độ WAL).
+
+    Mỗi (dataset, class) là một dòng của bảng counts; class được lưu bằng
+    key đánh số không kèm ngôn ngữ ("1.3") giống nhật ký phiên, nên dữ liệu
+    không phụ thuộc ngôn ngữ hiển thị. Lưu và nạp chỉ là upsert/truy vấn
+    theo index, không chậm đi khi lịch sử dài ra.
+
+    Key đánh số đổi khi classes.txt bị chèn dòng, nên mỗi dataset ghi kèm
+    digest của taxonomy lúc lưu (bảng taxonomies giữ ClassTaxonomy.identity).
+    Nạp bằng taxonomy khác thì key được ghép lại qua class_key_mapping.
+
+    Một backend khác chỉ cần có cùng các hàm save/load/datasets/days/
+    iter_datasets/link_route/linked_route/route_links/close và được đăng
+    ký trong DATASET_STORES.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS datasets (
+            name TEXT PRIMARY KEY,
+            working_seconds INTEGER NOT NULL,
+            language TEXT,
+            saved_at TEXT NOT NULL,
+            day TEXT NOT NULL,
+            taxonomy TEXT
+        );
+        CREATE INDEX IF NOT EXISTS datasets_day ON datasets (day);
+        CREATE TABLE IF NOT EXISTS counts (
+            dataset TEXT NOT NULL,
+            class_key TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (dataset, class_key)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS taxonomies (
+            digest TEXT PRIMARY KEY,
+            identity TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS routes (
+            dataset TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            digest TEXT
+        );
+    """
+
+    def __init__(self, path="counts.db"):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(datasets)")}
+        if "taxonomy" not in columns:
+            # Kho tạo trước khi có cột taxonomy: dataset cũ giữ nguyên key khi nạp
+            self.conn.execute("ALTER TABLE datasets ADD COLUMN taxonomy TEXT")
+        self._saved_taxonomies = set()
+        # (digest lúc lưu, digest hiện tại) → key cũ → key mới
+        self._key_mappings = {}
+
+    @traced("store.save")
+    def save(self, name, working_seconds, counts_by_key, lang=None, taxonomy=None):
+        """Upsert một dataset; counts_by_key: class key → số đếm theo taxonomy"""
+        now = time.localtime()
+        digest = taxonomy.identity_digest if taxonomy is not None else None
+        with self.conn:
+            if digest is not None and digest not in self._saved_taxonomies:
+                self.conn.execute("INSERT OR IGNORE INTO taxonomies (digest, identity) VALUES (?, ?)",
+                                  (digest, json.dumps(taxonomy.identity, ensure_ascii=False)))
+            self.conn.execute(
+                "INSERT INTO datasets (name, working_seconds, language, saved_at, day, taxonomy) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET working_seconds = excluded.working_seconds, "
+                "language = excluded.language, saved_at = excluded.saved_at, day = excluded.day, "
+                "taxonomy = excluded.taxonomy",
+                (name, int(working_seconds), lang,
+                 time.strftime("%Y-%m-%d %H:%M:%S", now), time.strftime("%Y-%m-%d", now), digest))
+            # Taxonomy có thể đã đổi từ lần lưu trước - bỏ các class không còn
+            self.conn.execute("DELETE FROM counts WHERE dataset = ?", (name,))
+            self.conn.executemany("INSERT INTO counts (dataset, class_key, count) VALUES (?, ?, ?)",
+                                  [(name, key, int(count)) for key, count in counts_by_key.items()])
+        if digest is not None:
+            self._saved_taxonomies.add(digest)
+
+    def _remap_counts(self, counts_by_key, digest, taxonomy):
+        """Đổi key lưu theo taxonomy digest sang key của taxonomy hiện tại"""
+        if taxonomy is None or digest is None or digest == taxonomy.identity_digest:
+            return counts_by_key
+        mapping_key = (digest, taxonomy.identity_digest)
+        keys = self._key_mappings.get(mapping_key)
+        if keys is None:
+            row = self.conn.execute("SELECT identity FROM taxonomies WHERE digest = ?", (digest,)).fetchone()
+            if row is None:
+                return counts_by_key
+            keys = self._key_mappings[mapping_key] = class_key_mapping(json.loads(row[0]), taxonomy)
+        return {keys[key]: count for key, count in counts_by_key.items() if key in keys}
+
+    @traced("store.load")
+    def load(self, name, taxonomy=None):
+        """Trả về (số giây, class key → số đếm, ngôn ngữ) hoặc None.
+
+        Có taxonomy thì key được ghép về taxonomy đó nếu file class đã đổi
+        từ lúc lưu.
+        """
+        row = self.conn.execute("SELECT working_seconds, language, taxonomy FROM datasets WHERE name = ?",
+                                (name,)).fetchone()
+        if row is None:
+            return None
+        counts_by_key = dict(self.conn.execute("SELECT class_key, count FROM counts WHERE dataset = ?", (name,)))
+        return row[0], self._remap_counts(counts_by_key, row[2], taxonomy), row[1]
+
+    def datasets(self, day=None):
+        """Danh sách (tên, số giây, ngôn ngữ, thời điểm lưu), lọc theo ngày nếu có"""
+        query = "SELECT name, working_seconds, language, saved_at FROM datasets"
+        if day is None:
+            return self.conn.execute(query + " ORDER BY name").fetchall()
+        return self.conn.execute(query + " WHERE day = ? ORDER BY name", (day,)).fetchall()
+
+    def days(self):
+        """Các ngày có dataset, mới nhất trước"""
+        return [row[0] for row in self.conn.execute("SELECT DISTINCT day FROM datasets ORDER BY day DESC")]
+
+    def iter_datasets(self, day=None, taxonomy=None):
+        """Đọc hàng loạt cho export: dict tên → (số giây, class key → số đếm, ngôn ngữ).
+
+        Key được ghép về taxonomy như load().
+        """
+        query = ("SELECT d.name, d.working_seconds, d.language, d.taxonomy, c.class_key, c.count "
+                 "FROM datasets d LEFT JOIN counts c ON c.dataset = d.name")
+        if day is None:
+            rows = self.conn.execute(query + " ORDER BY d.name")
+        else:
+            rows = self.conn.execute(query + " WHERE d.day = ? ORDER BY d.name", (day,))
+        result = {}
+        digests = {}
+        for name, seconds, lang, digest, key, count in rows:
+            entry = result.get(name)
+            if entry is None:
+                entry = result[name] = (seconds, {}, lang)
+                digests[name] = digest
+            if key is not None:
+                entry[1][key] = count
+        for name, (seconds, counts_by_key, lang) in result.items():
+            result[name] = (seconds, self._remap_counts(counts_by_key, digests[name], taxonomy), lang)
+        return result
+
+    def link_route(self, name, path, digest=None):
+        """Gắn file GPX với dataset (ghi đè liên kết cũ)"""
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO routes (dataset, path, digest) VALUES (?, ?, ?) "
+                "ON CONFLICT (dataset) DO UPDATE SET path = excluded.path, digest = excluded.digest",
+                (name, path, digest))
+
+    def linked_route(self, name):
+        """Đường dẫn GPX đã gắn với dataset, hoặc None"""
+        row = self.conn.execute("SELECT path FROM routes WHERE dataset = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def route_links(self):
+        """Mọi liên kết (dataset, đường dẫn GPX)"""
+        return self.conn.execute("SELECT dataset, path FROM routes ORDER BY dataset").fetchall()
+
+    def close(self):
+        self.conn.close()
+
+# Phần mở rộng file → backend
+DATASET_STORES = {
+    ".db": SqliteDatasetStore,
+    ".sqlite": SqliteDatasetStore,
+    ".sqlite3": SqliteDatasetStore,
+}
+
+def open_dataset_store(path="counts.db"):
+    """Mở kho dataset theo phần mở rộng của path"""
+    backend = DATASET_STORES.get(os.path.splitext(path)[1].lower())
+    if backend is None:
+        raise ValueError(f"No dataset store for '{path}' (supported: {', '.join(DATASET_STORES)})")
+    return backend(path)
+
+# ==========================
+# DANH SÁCH CLASS ẢO HÓA - CHO TAXONOMY LỚN
+# ==========================
+# Số class con tối đa còn dùng lưới 3 cột; nhiều hơn thì chuyển sang danh sách ảo
+VIRTUAL_LIST_THRESHOLD = 300
+
+class _ClassRow:
+    """Một hàng class trên giao diện (lưới 3 cột hoặc pool của VirtualClassList).
+
+    Callback của nút/entry đọc class_index tại thời điểm gọi, nên hàng có thể
+    được gán lại cho class khác mà không cần tạo lại widget.
+    """
+
+    def __init__(self, frame, label, controls, entry, count_var, count_label, window=None):
+        self.frame = frame
+        self.label = label
+        self.controls = controls
+        self.entry = entry
+        self.count_var = count_var
+        self.count_label = count_label
+        self.window = window
+        self.item = None
+        self.class_index = None
+        self.section = None
+
+class VirtualClassList:
+    """Danh sách class ảo hóa: chỉ tạo widget cho các hàng trong viewport.
+
+    Tiêu đề section và class con được xếp thành một danh sách phẳng theo
+    thứ tự cột LEFT/CENTER/RIGHT. Khi cuộn, các hàng trong pool được gán
+    lại cho vị trí mới thay vì tạo widget mới.
+    """
+
+    BUFFER_ROWS = 5
+    ROW_HEIGHT = 30
+
+    def __init__(self, app, canvas, scrollbar, items, lang):
+        self.app = app
+        self.canvas = canvas
+        self.scrollbar = scrollbar
+        self.items = items
+        self.lang = lang
+        self.slots = []
+        self.first_row = None
+        self.header_font = ("Arial", 10, "bold")
+
+        self.canvas.configure(yscrollincrement=self.ROW_HEIGHT, yscrollcommand=self._on_yscroll,
+                              scrollregion=(0, 0, 0, len(items) * self.ROW_HEIGHT))
+        self.canvas.bind("<Configure>", self._on_canvas_configure)
+
+    def _create_slot(self):
+        app = self.app
+        frame = ttk.Frame(self.canvas)
+        label = ttk.Label(frame, anchor="w")
+        label.pack(side="left")
+
+        controls = ttk.Frame(frame)
+        slot = None
+
+        ttk.Button(controls, text="-", width=2,
+                  command=lambda: slot.class_index is not None and app.decrement(slot.class_index)).pack(side="left")
+
+        entry = ttk.Entry(controls, width=4, justify="center",
+                         validate="key", validatecommand=app.vcmd)
+        entry.pack(side="left", padx=2)
+        entry.bind('<Return>', lambda e: slot.class_index is not None and app.update_from_entry(slot.class_index))
+        entry.bind('<FocusOut>', lambda e: slot.class_index is not None and app.update_from_entry(slot.class_index))
+
+        count_var = tk.IntVar(value=0)
+        count_label = ttk.Label(controls, textvariable=count_var, width=4,
+                              anchor="center", background="white", relief="solid")
+        count_label.pack(side="left", padx=2)
+
+        ttk.Button(controls, text="+", width=2,
+                  command=lambda: slot.class_index is not None and app.increment(slot.class_index)).pack(side="left")
+
+        for widget in (frame, label):
+            widget.bind("<MouseWheel>", app._on_mousewheel)
+
+        window = self.canvas.create_window(0, 0, window=frame, anchor="nw", state="hidden")
+        slot = _ClassRow(frame, label, controls, entry, count_var, count_label, window)
+        return slot
+
+    def _on_canvas_configure(self, event):
+        needed = min(event.height // self.ROW_HEIGHT + 1 + 2 * self.BUFFER_ROWS, len(self.items))
+        while len(self.slots) < needed:
+            self.slots.append(self._create_slot())
+        for slot in self.slots:
+            self.canvas.itemconfigure(slot.window, width=event.width, height=self.ROW_HEIGHT)
+        self.refresh(force=True)
+
+    def _on_yscroll(self, first, last):
+        self.scrollbar.set(first, last)
+        self.refresh()
+
+    def set_language(self, lang):
+        self.lang = lang
+        for slot in self.slots:
+            slot.item = None
+        self.refresh(force=True)
+
+    def set_items(self, items):
+        """Thay danh sách hàng (vd. sau khi taxonomy được nạp lại)"""
+        for slot in self.slots:
+            self._unbind(slot)
+            slot.item = None
+        self.items = items
+        self.canvas.configure(scrollregion=(0, 0, 0, len(items) * self.ROW_HEIGHT))
+        height = self.canvas.winfo_height()
+        needed = min(height // self.ROW_HEIGHT + 1 + 2 * self.BUFFER_ROWS, len(items))
+        while len(self.slots) < needed:
+            self.slots.append(self._create_slot())
+        self.refresh(force=True)
+
+    def refresh(self, force=False):
+        """Gán các hàng trong pool cho vùng đang hiển thị (cộng buffer)"""
+        top_row = int(self.canvas.canvasy(0)) // self.ROW_HEIGHT
+        first_row = max(top_row - self.BUFFER_ROWS, 0)
+        if first_row == self.first_row and not force:
+            return
+        self.first_row = first_row
+
+        for offset, slot in enumerate(self.slots):
+            row = first_row + offset
+            if row >= len(self.items):
+                self._unbind(slot)
+                slot.item = None
+                self.canvas.itemconfigure(slot.window, state="hidden")
+                continue
+            self._bind(slot, self.items[row])
+            self.canvas.coords(slot.window, 0, row * self.ROW_HEIGHT)
+            self.canvas.itemconfigure(slot.window, state="normal")
+
+    def _unbind(self, slot):
+        app = self.app
+        index = slot.class_index
+        if index is None:
+            return
+        # Ghi nhận giá trị đang gõ dở trước khi hàng được dùng cho class khác
+        if app.root.focus_get() is slot.entry:
+            app.update_from_entry(index)
+        if app.count_vars.get(index) is slot.count_var:
+            del app.count_vars[index]
+            del app.entry_widgets[index]
+            del app.count_labels[index]
+        slot.class_index = None
+
+    def _bind(self, slot, item):
+        if slot.item == item:
+            return
+        self._unbind(slot)
+        slot.item = item
+        kind, index, is_others_section = item
+        names = self.app.class_mapping[index]
+
+        if kind == "section":
+            slot.label.config(text=names.get(self.lang, f"Parent_{index}"), font=self.header_font, width=0)
+            slot.controls.pack_forget()
+            return
+
+        app = self.app
+        slot.class_index = index
+        slot.label.config(text=names.get(self.lang, f"Class_{index}"), font="",
+                          width=28 if is_others_section else 22)
+        slot.controls.pack(side="right")
+        slot.count_var.set(app.counts.get(index))
+        app.count_vars[index] = slot.count_var
+        app.entry_widgets[index] = slot.entry
+        app.count_labels[index] = slot.count_label
+        app.sync_entry_value(index)
+
 # ==========================
 # ỨNG DỤNG CHÍNH - ĐÃ TỐI ƯU
 # ==========================
@@ -65,37 +1051,92 @@ class CounterApp:
         self.root.geometry("1400x900")
 
         # Pre-load data
-        self.class_sets, self.languages, self.class_mapping, self.parent_classes, self.child_classes = load_classes_from_file()
+        self.taxonomy_file = "classes.txt"
+        self._taxonomy_stamp = self._stat_taxonomy_file()
+        self._pending_taxonomy_stamp = None
+        self._set_taxonomy(load_classes_from_file(self.taxonomy_file))
         if not self.languages:
             messagebox.showerror("Error", "No class definitions found in classes.txt")
             self.root.destroy()
             return
-
-        # ĐẢM BẢO class_indexes ĐƯỢC KHỞI TẠO
-        self.class_indexes = list(self.class_mapping.keys())
         
         self.current_language = tk.StringVar(value=self.languages[0])
         
         # Cache để tăng tốc độ
-        self._language_cache = {}
         self._column_mapping_cache = None
         
-        # Khởi tạo counts_all
-        self.counts_all = {}
-        for index in self.class_indexes:
-            self.counts_all[index] = tk.IntVar(value=0)
-
+        # Số đếm lưu trong mảng; IntVar chỉ tạo cho các hàng đang hiển thị
+        self.counts = CountStore(max(self.class_indexes) + 1)
+        self.counts.on_change = self._on_count_change
+        self.count_vars = {}
+
+        # Widget dựng một lần, đổi ngôn ngữ chỉ sửa text
+        self.virtual_list = None
+        self.column_frames = {}
+        self.grid_rows = {}
+        self.section_frames = {}
+        self.name_labels = {}
         self.count_labels = {}
         self.entry_widgets = {}
+        # Bảng dataset chờ xuất: name → (working time, counts)
+        self.batch_datasets = {}
         self.total_work_time = 0.0
         self.session_start = None
         self.is_paused = True
 
+        # Nhật ký phiên: khôi phục trạng thái lần trước rồi ghi tiếp
+        self.journal = SessionJournal()
+        self._undo_stack = []
+        self._redo_stack = []
+        self._undoing = False
+        self._last_journal_write = time.time()
+        self._restore_session()
+
         # Đăng ký hàm validate
         self.vcmd = (self.root.register(validate_number_input), '%P')
 
+        # Phím tắt đếm: một binding ở root, cộng dồn và áp dụng lúc idle
+        try:
+            self.hotkeys, self.decrement_mask = load_hotkeys_from_file(self.taxonomy)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("Error", f"Failed to load hotkeys: {e}")
+            self.hotkeys, self.decrement_mask = {}, MODIFIER_MASKS["Control"]
+        self._pending_deltas = {}
+        self._flush_scheduled = False
+        self.root.bind_all("<KeyPress>", self._on_hotkey, add="+")
+
+        # Ghi Excel ở luồng nền, không chặn main loop
+        self.save_worker = ExcelSaveWorker()
+
+        # Kho dataset chính; Excel chỉ là bản xuất khi cần
+        try:
+            self.store = open_dataset_store(os.environ.get("CLASSES_COUNTER_STORE", "counts.db"))
+        except (sqlite3.Error, ValueError) as e:
+            messagebox.showerror("Error", f"Failed to open dataset store: {e}\nSaves will not persist.")
+            self.store = SqliteDatasetStore(":memory:")
+        self.route_cache = gpx_routes.RouteCache() if gpx_routes is not None else None
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+
         self.setup_ui()
         self.update_timer_display()
+        self.poll_save_results()
+        self.watch_taxonomy_file()
+        self.sync_journal()
+        # Đo độ trễ main loop (chỉ khi tracer bật)
+        self._lag_expected = None
+        self.stats_window = None
+        self.monitor_ui_lag()
+
+    def _set_taxonomy(self, taxonomy):
+        """Gán taxonomy và các alias dùng trong app"""
+        self.taxonomy = taxonomy
+        self.class_sets = taxonomy.class_sets
+        self.languages = list(taxonomy.languages)
+        self.class_mapping = taxonomy.class_mapping
+        self.parent_classes = taxonomy.parent_classes
+        self.child_classes = taxonomy.child_classes
+        # ĐẢM BẢO class_indexes ĐƯỢC KHỞI TẠO
+        self.class_indexes = list(taxonomy.class_indexes)
 
     # ----------------------------
     # GIAO DIỆN CHÍNH - TỐI ƯU
@@ -139,6 +1180,17 @@ class CounterApp:
                                    font=("Arial", 11, "bold"))
         self.timer_label.pack(side="left", padx=(20, 0))
 
+        # Undo/redo từ nhật ký phiên và bắt đầu phiên mới
+        ttk.Label(row1_frame, text="Session:").pack(side="left", padx=(40, 5))
+        ttk.Button(row1_frame, text="↶ Undo", 
+                  command=self.undo).pack(side="left", padx=5)
+        ttk.Button(row1_frame, text="↷ Redo", 
+                  command=self.redo).pack(side="left", padx=5)
+        ttk.Button(row1_frame, text="🆕 New Session", 
+                  command=self.new_session).pack(side="left", padx=5)
+        ttk.Button(row1_frame, text="📊 Stats", 
+                  command=self.show_stats).pack(side="left", padx=5)
+
         # Hàng 2: Nút Play/Pause và Save/Load
         row2_frame = ttk.Frame(top_main_frame)
         row2_frame.pack(fill="x", pady=5)
@@ -152,10 +1204,27 @@ class CounterApp:
 
         # Nút Save và Load - ĐƯA LÊN CÙNG HÀNG
         ttk.Label(row2_frame, text="Data Management:").pack(side="left", padx=(40, 5))
-        ttk.Button(row2_frame, text="💾 Save to Excel", 
+        ttk.Button(row2_frame, text="💾 Save", 
+                  command=self.save_dataset).pack(side="left", padx=5)
+        ttk.Button(row2_frame, text="📂 Load", 
+                  command=self.load_dataset).pack(side="left", padx=5)
+        ttk.Button(row2_frame, text="📤 Export to Excel", 
                   command=self.save_to_excel).pack(side="left", padx=5)
-        ttk.Button(row2_frame, text="📂 Load from Excel", 
+        ttk.Button(row2_frame, text="📥 Import from Excel", 
                   command=self.load_from_excel).pack(side="left", padx=5)
+        if gpx_routes is not None:
+            ttk.Button(row2_frame, text="🗺 Link Route", 
+                      command=self.link_route).pack(side="left", padx=5)
+
+        # Xuất nhiều dataset trong một lần ghi
+        ttk.Label(row2_frame, text="Batch:").pack(side="left", padx=(40, 5))
+        ttk.Button(row2_frame, text="➕ Add to Batch", 
+                  command=self.add_to_batch).pack(side="left", padx=5)
+        self.export_batch_button = ttk.Button(row2_frame, text="📤 Export Batch (0)", 
+                                             command=self.export_batch)
+        self.export_batch_button.pack(side="left", padx=5)
+        ttk.Button(row2_frame, text="🗑 Clear Batch", 
+                  command=self.clear_batch).pack(side="left", padx=5)
 
     def setup_class_display(self, parent):
         """Thiết lập hiển thị class với canvas scroll - tối ưu"""
@@ -166,6 +1235,18 @@ class CounterApp:
         # Tạo canvas và scrollbar
         self.canvas = tk.Canvas(container, highlightthickness=0)
         scrollbar = ttk.Scrollbar(container, orient="vertical", command=self.canvas.yview)
+
+        self._precompute_column_mapping()
+
+        # Taxonomy lớn: chỉ tạo widget cho các hàng đang hiển thị
+        if len(self.taxonomy.child_indices) > VIRTUAL_LIST_THRESHOLD:
+            self.canvas.pack(side="left", fill="both", expand=True)
+            scrollbar.pack(side="right", fill="y")
+            self.canvas.bind("<MouseWheel>", self._on_mousewheel)
+            self.virtual_list = VirtualClassList(self, self.canvas, scrollbar, self._virtual_list_items(),
+                                                 self.current_language.get())
+            return
+
         self.scrollable_frame = ttk.Frame(self.canvas)
 
         # Configure canvas scrolling
@@ -186,30 +1267,24 @@ class CounterApp:
         self.class_frame.pack(fill="both", expand=True, padx=5, pady=5)
 
         # Pre-render layout
-        self._precompute_column_mapping()
+        self._build_class_grid(self.current_language.get())
+
+    def _virtual_list_items(self):
+        """Danh sách phẳng (loại, index, thuộc section その他) cho VirtualClassList"""
+        items = []
+        for column_type in ("LEFT", "CENTER", "RIGHT"):
+            for parent_index in self.taxonomy.parent_indices:
+                if self._column_mapping_cache.get(parent_index) != column_type:
+                    continue
+                items.append(("section", parent_index, False))
+                items.extend(("class", child_index, column_type == "RIGHT")
+                             for child_index in self.taxonomy.children_by_parent[parent_index])
+        return items
 
     def _precompute_column_mapping(self):
-        """Tính toán trước column mapping để tăng tốc"""
+        """Column mapping đã được tính sẵn trong taxonomy"""
         if self._column_mapping_cache is None:
-            self._column_mapping_cache = {}
-            for parent_index, parent_name in self.parent_classes.items():
-                # Kiểm tra cache cho ngôn ngữ đầu tiên
-                current_parent_name = self.class_mapping[parent_index].get(self.languages[0], parent_name)
-                
-                if any(x in current_parent_name for x in ["車線", "Lane", "Làn đường"]):
-                    self._column_mapping_cache[parent_index] = "LEFT"
-                elif any(x in current_parent_name for x in ["横断", "Crosswalk", "Vạch sang đường"]):
-                    self._column_mapping_cache[parent_index] = "LEFT"
-                elif any(x in current_parent_name for x in ["センター", "Center", "Đường tâm"]):
-                    self._column_mapping_cache[parent_index] = "CENTER"
-                elif any(x in current_parent_name for x in ["交差点", "Intersection", "Giao lộ"]):
-                    self._column_mapping_cache[parent_index] = "CENTER"
-                elif any(x in current_parent_name for x in ["道路端", "Roadside", "Lề đường"]):
-                    self._column_mapping_cache[parent_index] = "CENTER"
-                elif any(x in current_parent_name for x in ["その他", "Others", "Khác"]):
-                    self._column_mapping_cache[parent_index] = "RIGHT"
-                else:
-                    self._column_mapping_cache[parent_index] = "CENTER"
+            self._column_mapping_cache = dict(self.taxonomy.columns)
 
     def _on_frame_configure(self, event=None):
         """Cấu hình lại canvas khi frame thay đổi kích thước"""
@@ -219,24 +1294,9 @@ class CounterApp:
         """Xử lý sự kiện scroll chuột"""
         self.canvas.yview_scroll(int(-1 * (event.delta / 120)), "units")
 
-    # ----------------------------
-    # CẬP NHẬT NGÔN NGỮ - TỐI ƯU
-    # ----------------------------
-    def update_language(self, lang):
-        """Cập nhật ngôn ngữ với caching để tăng tốc"""
-        # Kiểm tra cache
-        if lang in self._language_cache:
-            cached_data = self._language_cache[lang]
-            self._rebuild_ui_from_cache(cached_data)
-            return
-
-        # Xóa widget cũ một cách hiệu quả
-        for widget in self.class_frame.winfo_children():
-            widget.destroy()
-
-        self.count_labels.clear()
-        self.entry_widgets.clear()
-
+    @traced("ui.grid_build")
+    def _build_class_grid(self, lang):
+        """Dựng lưới class một lần duy nhất - các lần đổi ngôn ngữ dùng lại widget"""
         # Tạo layout 3 cột
         columns_frame = ttk.Frame(self.class_frame)
         columns_frame.pack(fill="both", expand=True)
@@ -250,164 +1310,273 @@ class CounterApp:
         right_column = ttk.Frame(columns_frame)
         right_column.pack(side="left", fill="both", expand=True, padx=5)
 
-        # Cache để lưu kết quả
-        cache_data = {
-            'left': [],
-            'center': [], 
-            'right': []
-        }
+        columns = {"LEFT": left_column, "CENTER": center_column, "RIGHT": right_column}
+        self.column_frames = columns
 
         # Phân bổ các cụm class
-        for parent_index in sorted(self.parent_classes.keys()):
+        for parent_index in self.taxonomy.parent_indices:
             if parent_index not in self._column_mapping_cache:
                 continue
                 
             parent_name = self.class_mapping[parent_index].get(lang, f"Parent_{parent_index}")
             column_type = self._column_mapping_cache[parent_index]
-            
-            if column_type == "LEFT":
-                target_column = left_column
-                cache_key = 'left'
-            elif column_type == "CENTER":
-                target_column = center_column
-                cache_key = 'center'
-            else:  # RIGHT
-                target_column = right_column
-                cache_key = 'right'
 
             # Tạo section
-            section_frame = ttk.LabelFrame(target_column, text=parent_name, padding=5)
+            section_frame = ttk.LabelFrame(columns[column_type], text=parent_name, padding=5)
             section_frame.pack(fill="both", expand=True, pady=5)
+            self.section_frames[parent_index] = section_frame
             
-            # Tìm class con
-            child_indices = self._find_child_indices(parent_index)
-            
-            # Tạo các class con
-            section_data = []
-            for child_index in child_indices:
-                if child_index in self.class_mapping:
-                    class_name = self.class_mapping[child_index].get(lang, f"Class_{child_index}")
-                    row_data = self._create_class_row(section_frame, class_name, child_index, column_type == "RIGHT")
-                    section_data.append(row_data)
-            
-            cache_data[cache_key].append({
-                'parent_name': parent_name,
-                'children': section_data
-            })
-
-        # Lưu vào cache
-        self._language_cache[lang] = cache_data
-
-    def _find_child_indices(self, parent_index):
-        """Tìm class con một cách hiệu quả"""
-        child_indices = []
-        sorted_parents = sorted(self.parent_classes.keys())
-        
-        # Tìm parent tiếp theo
-        next_parent_index = None
-        for next_idx in sorted_parents:
-            if next_idx > parent_index:
-                next_parent_index = next_idx
-                break
-        
-        # Tìm class con trong khoảng
-        if next_parent_index is not None:
-            for idx in range(parent_index + 1, next_parent_index):
-                if idx in self.class_mapping and idx not in self.parent_classes:
-                    child_indices.append(idx)
-        else:
-            for idx in range(parent_index + 1, len(self.class_mapping)):
-                if idx in self.class_mapping and idx not in self.parent_classes:
-                    child_indices.append(idx)
-        
-        return child_indices
+            # Class con lấy từ index dựng sẵn
+            for child_index in self.taxonomy.children_by_parent[parent_index]:
+                class_name = self.class_mapping[child_index].get(lang, f"Class_{child_index}")
+                self._create_class_row(section_frame, class_name, child_index, column_type == "RIGHT")
+
+    # ----------------------------
+    # CẬP NHẬT NGÔN NGỮ - TỐI ƯU
+    # ----------------------------
+    @traced("ui.language_switch")
+    def update_language(self, lang):
+        """Đổi ngôn ngữ bằng cách sửa text của widget có sẵn, không dựng lại"""
+        if self.virtual_list is not None:
+            self.virtual_list.set_language(lang)
+            return
+        for parent_index, section_frame in self.section_frames.items():
+            section_frame.config(text=self.class_mapping[parent_index].get(lang, f"Parent_{parent_index}"))
+        for class_index, name_label in self.name_labels.items():
+            name_label.config(text=self.class_mapping[class_index].get(lang, f"Class_{class_index}"))
 
+    @traced("ui.row_create")
     def _create_class_row(self, frame, class_name, class_index, is_others_section=False):
         """Tạo một hàng class - tối ưu"""
-        count_var = self.counts_all[class_index]
+        count_var = tk.IntVar(value=self.counts.get(class_index))
+        row_data = None
 
         row = ttk.Frame(frame)
         row.pack(fill="x", pady=1)
 
         # Hiển thị tên class - rộng hơn cho section "その他"
         label_width = 28 if is_others_section else 22
-        ttk.Label(row, text=class_name, width=label_width, anchor="w").pack(side="left")
+        name_label = ttk.Label(row, text=class_name, width=label_width, anchor="w")
+        name_label.pack(side="left")
         
         # Frame điều khiển
         control_frame = ttk.Frame(row)
         control_frame.pack(side="right")
         
-        # Nút và entry
+        # Nút và entry - đọc class_index lúc bấm để hàng có thể được gán lại
         ttk.Button(control_frame, text="-", width=2,
-                  command=lambda idx=class_index: self.decrement(idx)).pack(side="left")
+                  command=lambda: self.decrement(row_data.class_index)).pack(side="left")
         
         entry = ttk.Entry(control_frame, width=4, justify="center",
                          validate="key", validatecommand=self.vcmd)
         entry.pack(side="left", padx=2)
-        entry.bind('<Return>', lambda e, idx=class_index: self.update_from_entry(idx))
-        entry.bind('<FocusOut>', lambda e, idx=class_index: self.update_from_entry(idx))
-        
-        self.entry_widgets[class_index] = entry
+        entry.bind('<Return>', lambda e: self.update_from_entry(row_data.class_index))
+        entry.bind('<FocusOut>', lambda e: self.update_from_entry(row_data.class_index))
         
         count_label = ttk.Label(control_frame, textvariable=count_var, width=4,
                               anchor="center", background="white", relief="solid")
         count_label.pack(side="left", padx=2)
-        self.count_labels[class_index] = count_label
         
         ttk.Button(control_frame, text="+", width=2,
-                  command=lambda idx=class_index: self.increment(idx)).pack(side="left")
+                  command=lambda: self.increment(row_data.class_index)).pack(side="left")
+
+        row_data = _ClassRow(row, name_label, control_frame, entry, count_var, count_label)
+        row_data.class_index = class_index
+        row_data.section = frame
+        self._register_row(row_data)
         
         # Đồng bộ giá trị
         self.sync_entry_value(class_index)
-        
-        return {
-            'class_name': class_name,
-            'class_index': class_index,
-            'is_others_section': is_others_section
-        }
-
-    def _rebuild_ui_from_cache(self, cached_data):
-        """Xây dựng lại UI từ cache - rất nhanh"""
-        # Xóa widget cũ
-        for widget in self.class_frame.winfo_children():
-            widget.destroy()
+        return row_data
 
-        self.count_labels.clear()
-        self.entry_widgets.clear()
+    def _register_row(self, row_data):
+        index = row_data.class_index
+        self.grid_rows[index] = row_data
+        self.name_labels[index] = row_data.label
+        self.count_vars[index] = row_data.count_var
+        self.entry_widgets[index] = row_data.entry
+        self.count_labels[index] = row_data.count_label
 
-        # Tạo layout 3 cột
-        columns_frame = ttk.Frame(self.class_frame)
-        columns_frame.pack(fill="both", expand=True)
-        
-        left_column = ttk.Frame(columns_frame)
-        left_column.pack(side="left", fill="both", expand=True, padx=5)
-        
-        center_column = ttk.Frame(columns_frame)
-        center_column.pack(side="left", fill="both", expand=True, padx=5)
-        
-        right_column = ttk.Frame(columns_frame)
-        right_column.pack(side="left", fill="both", expand=True, padx=5)
+    # ----------------------------
+    # NẠP LẠI CLASSES.TXT KHI ĐANG CHẠY
+    # ----------------------------
+    def _stat_taxonomy_file(self):
+        try:
+            st = os.stat(self.taxonomy_file)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def watch_taxonomy_file(self):
+        """Kiểm tra classes.txt mỗi giây, nạp lại khi file thay đổi và đã
+        đứng yên qua hai lần kiểm tra (không đọc file đang lưu dở)"""
+        stamp = self._stat_taxonomy_file()
+        if stamp is None or stamp == self._taxonomy_stamp:
+            self._pending_taxonomy_stamp = None
+        elif stamp != self._pending_taxonomy_stamp:
+            # Vừa đổi - chờ lần kiểm tra sau xem còn đang ghi không
+            self._pending_taxonomy_stamp = stamp
+        else:
+            self._taxonomy_stamp = stamp
+            self._pending_taxonomy_stamp = None
+            try:
+                taxonomy = load_classes_from_file(self.taxonomy_file)
+            except (OSError, UnicodeDecodeError) as e:
+                print(f"WARNING: cannot reload {self.taxonomy_file}: {e}")
+                taxonomy = None
+            # File rỗng hoặc lỗi - giữ taxonomy cũ
+            if taxonomy:
+                mapping = match_taxonomies(self.taxonomy, taxonomy)
+                if self._confirm_dropped_classes(taxonomy, mapping):
+                    self.reload_taxonomy(taxonomy, mapping)
+        self.root.after(1000, self.watch_taxonomy_file)
+
+    def _confirm_dropped_classes(self, new, mapping):
+        """Hỏi người dùng trước khi nạp taxonomy làm mất số đếm của class
+        không còn trong file mới. True nếu không mất gì hoặc người dùng đồng ý."""
+        if self._pending_deltas:
+            self._flush_hotkeys()
+        old = self.taxonomy
+        # Số đếm hiện tại và các dataset trong batch đều theo thứ tự child_indices cũ
+        dropped = [index for position, index in enumerate(old.child_indices)
+                   if index not in mapping and (self.counts.get(index) or any(
+                       counts[position] for _, counts in self.batch_datasets.values()))]
+        if not dropped:
+            return True
+
+        lang = self.current_language.get()
+        names = [old.class_name(index, lang, old.class_keys.get(index, str(index))) for index in dropped]
+        listing = "\n".join(f"  • {name}" for name in names[:15])
+        if len(names) > 15:
+            listing += f"\n  … and {len(names) - 15} more"
+        if messagebox.askyesno(
+                "Classes removed",
+                f"{self.taxonomy_file} changed and these classes with counts no longer exist:\n{listing}\n\n"
+                "Reload anyway and drop their counts?\n"
+                "(No keeps the current classes and counts until the file changes again.)"):
+            return True
+        print(f"WARNING: kept old taxonomy - reload would drop counts of {len(dropped)} classes")
+        return False
+
+    @traced("taxonomy.reload")
+    def reload_taxonomy(self, new, mapping=None):
+        """Áp dụng taxonomy mới: chuyển số đếm theo danh tính class và chỉ
+        sửa các hàng/section bị ảnh hưởng trên giao diện"""
+        old = self.taxonomy
+        if mapping is None:
+            mapping = match_taxonomies(old, new)
+
+        # Ghi nhận phím tắt và giá trị đang gõ dở trước khi đổi index
+        if self._pending_deltas:
+            self._flush_hotkeys()
+        focused = self.root.focus_get()
+        for index, entry in list(self.entry_widgets.items()):
+            if entry is focused:
+                self.update_from_entry(index)
+
+        # Batch lưu counts theo thứ tự child_indices - đổi sang thứ tự mới
+        for dataset_name, (elapsed_str, counts) in list(self.batch_datasets.items()):
+            by_new_index = {mapping[old_index]: value
+                            for old_index, value in zip(old.child_indices, counts) if old_index in mapping}
+            self.batch_datasets[dataset_name] = (elapsed_str, tuple(by_new_index.get(index, 0)
+                                                                      for index in new.child_indices))
+
+        self._set_taxonomy(new)
+        self._column_mapping_cache = dict(new.columns)
+        self._update_language_menu()
+        lang = self.current_language.get()
+
+        # Bỏ view theo index cũ trước khi đổi bố cục số đếm
+        for view in (self.name_labels, self.count_vars, self.entry_widgets, self.count_labels):
+            view.clear()
+        # Snapshot do remap ghi ra đã theo key mới
+        self.journal.set_taxonomy(new)
+        self.counts.remap(mapping, max(self.class_indexes) + 1)
+
+        if self.virtual_list is not None:
+            self.virtual_list.lang = lang
+            self.virtual_list.set_items(self._virtual_list_items())
+        else:
+            self._patch_class_grid(old, new, mapping, lang)
+        self._on_count_change(None)
 
-        # Xây dựng từ cache
-        for section_data in cached_data['left']:
-            self._build_section_from_cache(left_column, section_data)
-        for section_data in cached_data['center']:
-            self._build_section_from_cache(center_column, section_data)
-        for section_data in cached_data['right']:
-            self._build_section_from_cache(right_column, section_data)
-
-    def _build_section_from_cache(self, column, section_data):
-        """Xây dựng section từ cache"""
-        section_frame = ttk.LabelFrame(column, text=section_data['parent_name'], padding=5)
-        section_frame.pack(fill="both", expand=True, pady=5)
-        
-        for child_data in section_data['children']:
-            self._create_class_row(
-                section_frame, 
-                child_data['class_name'], 
-                child_data['class_index'], 
-                child_data['is_others_section']
-            )
+        try:
+            self.hotkeys, self.decrement_mask = load_hotkeys_from_file(self.taxonomy)
+        except (OSError, ValueError) as e:
+            print(f"WARNING: cannot reload hotkeys: {e}")
+
+    def _update_language_menu(self):
+        menu = self.lang_menu["menu"]
+        menu.delete(0, "end")
+        for lang in self.languages:
+            menu.add_command(label=lang, command=tk._setit(self.current_language, lang, self.update_language))
+        if self.current_language.get() not in self.languages:
+            self.current_language.set(self.languages[0])
+
+    def _patch_class_grid(self, old, new, mapping, lang):
+        """Sửa lưới class theo taxonomy mới, giữ lại widget của class không đổi"""
+        # Section giữ lại nếu parent còn và vẫn ở cùng cột
+        sections = {}
+        for old_parent, section_frame in self.section_frames.items():
+            new_parent = mapping.get(old_parent)
+            if new_parent is not None and new.columns.get(new_parent) == old.columns.get(old_parent):
+                sections[new_parent] = section_frame
+            else:
+                section_frame.destroy()
+
+        # Hàng giữ lại nếu class còn và vẫn thuộc section cũ
+        kept_sections = set(sections.values())
+        rows = {}
+        for old_index, row_data in self.grid_rows.items():
+            new_index = mapping.get(old_index)
+            new_parent = new.parent_of.get(new_index)
+            if new_index is not None and sections.get(new_parent) is row_data.section:
+                row_data.class_index = new_index
+                rows[new_index] = row_data
+            elif row_data.section in kept_sections:
+                row_data.frame.destroy()
+
+        self.grid_rows = {}
+        self.section_frames = {}
+
+        for column_type, column in self.column_frames.items():
+            ordered_sections = []
+            for parent_index in new.parent_indices:
+                if new.columns.get(parent_index) != column_type:
+                    continue
+                parent_name = new.class_mapping[parent_index].get(lang, f"Parent_{parent_index}")
+                section_frame = sections.get(parent_index)
+                if section_frame is None:
+                    section_frame = ttk.LabelFrame(column, text=parent_name, padding=5)
+                elif section_frame.cget("text") != parent_name:
+                    section_frame.config(text=parent_name)
+                self.section_frames[parent_index] = section_frame
+                ordered_sections.append(section_frame)
+
+                ordered_rows = []
+                for child_index in new.children_by_parent[parent_index]:
+                    class_name = new.class_mapping[child_index].get(lang, f"Class_{child_index}")
+                    row_data = rows.get(child_index)
+                    if row_data is None:
+                        row_data = self._create_class_row(section_frame, class_name, child_index,
+                                                          column_type == "RIGHT")
+                    else:
+                        if row_data.label.cget("text") != class_name:
+                            row_data.label.config(text=class_name)
+                        self._register_row(row_data)
+                    ordered_rows.append(row_data.frame)
+                self._repack(section_frame, ordered_rows, fill="x", pady=1)
+
+            self._repack(column, ordered_sections, fill="both", expand=True, pady=5)
+
+    def _repack(self, container, ordered, **pack_options):
+        """Pack lại widget con chỉ khi thứ tự hiện tại khác thứ tự mong muốn"""
+        if container.pack_slaves() == ordered:
+            return
+        for widget in ordered:
+            widget.pack_forget()
+        for widget in ordered:
+            widget.pack(**pack_options)
 
     # ----------------------------
     # CÁC HÀM CÒN LẠI - ĐÃ SỬA LỖI
@@ -415,7 +1584,7 @@ class CounterApp:
     def sync_entry_value(self, class_index):
         if class_index in self.entry_widgets:
             self.entry_widgets[class_index].delete(0, tk.END)
-            self.entry_widgets[class_index].insert(0, str(self.counts_all[class_index].get()))
+            self.entry_widgets[class_index].insert(0, str(self.counts.get(class_index)))
 
     def update_from_entry(self, class_index):
         if class_index in self.entry_widgets:
@@ -430,26 +1599,59 @@ class CounterApp:
                         self.entry_widgets[class_index].delete(0, tk.END)
                         self.entry_widgets[class_index].insert(0, "0")
                 except ValueError:
-                    new_value = self.counts_all[class_index].get()
+                    new_value = self.counts.get(class_index)
                     self.entry_widgets[class_index].delete(0, tk.END)
                     self.entry_widgets[class_index].insert(0, str(new_value))
             
-            self.counts_all[class_index].set(new_value)
+            self.counts.set(class_index, new_value)
+
+    def _on_count_change(self, class_index):
+        """Cập nhật view Tk của các hàng đang hiển thị"""
+        if class_index is None:
+            indices = list(self.count_vars)
+        elif class_index in self.count_vars:
+            indices = [class_index]
+        else:
+            return
+        for index in indices:
+            self.count_vars[index].set(self.counts.get(index))
+            self.sync_entry_value(index)
 
     def increment(self, class_index):
-        self.counts_all[class_index].set(self.counts_all[class_index].get() + 1)
-        self.sync_entry_value(class_index)
+        self.counts.increment(class_index)
+
+    def _on_hotkey(self, event):
+        """Tra phím trong dict biên dịch sẵn và cộng dồn vào buffer"""
+        if not self.hotkeys:
+            return
+        # Không bắt phím khi đang gõ vào ô nhập
+        if isinstance(event.widget, (tk.Entry, ttk.Entry)):
+            return
+        keysym = event.keysym
+        index = self.hotkeys.get(keysym.lower() if len(keysym) == 1 else keysym)
+        if index is None:
+            return
+        delta = -1 if event.state & self.decrement_mask else 1
+        self._pending_deltas[index] = self._pending_deltas.get(index, 0) + delta
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            self.root.after_idle(self._flush_hotkeys)
+        return "break"
+
+    def _flush_hotkeys(self):
+        """Áp dụng các lần nhấn đã gom vào bộ đếm trong một lần"""
+        deltas, self._pending_deltas = self._pending_deltas, {}
+        self._flush_scheduled = False
+        self.counts.add(deltas)
 
     def decrement(self, class_index):
-        val = self.counts_all[class_index].get()
-        if val > 0:
-            self.counts_all[class_index].set(val - 1)
-            self.sync_entry_value(class_index)
+        self.counts.decrement(class_index)
 
     def start_timer(self):
         if self.is_paused:
             self.session_start = time.time()
             self.is_paused = False
+            self._journal_append("start")
 
     def pause_timer(self):
         if not self.is_paused and self.session_start:
@@ -457,6 +1659,102 @@ class CounterApp:
             self.total_work_time += elapsed
             self.is_paused = True
             self.session_start = None
+            self._journal_append("pause", self.total_work_time)
+
+    # ----------------------------
+    # NHẬT KÝ PHIÊN - AUTOSAVE, UNDO/REDO
+    # ----------------------------
+    def _restore_session(self):
+        """Replay nhật ký để khôi phục số đếm, thời gian và lịch sử undo"""
+        counts_by_key, total_work_time, changes = self.journal.replay(self.taxonomy)
+        index_by_key = self.taxonomy.index_by_key
+
+        values = array("l", [0]) * len(self.counts)
+        for key, value in counts_by_key.items():
+            index = index_by_key.get(key)
+            if index is not None:
+                values[index] = max(int(value), 0)
+        self.counts.assign(values)
+        self.total_work_time = total_work_time
+
+        for key, old, new in changes:
+            index = index_by_key.get(key)
+            if index is not None:
+                self._undo_stack.append((index, old, new))
+
+        self.journal.open()
+        self.journal.set_taxonomy(self.taxonomy)
+        self.counts.on_record = self._record_count_change
+        # Khôi phục ở trạng thái tạm dừng
+        self._journal_append("pause", self.total_work_time)
+
+    def _journal_append(self, *record):
+        self.journal.append(*record)
+        self._last_journal_write = time.time()
+
+    def _counts_by_key(self):
+        values = self.counts.values
+        return {key: values[index] for index, key in self.taxonomy.class_keys.items() if values[index]}
+
+    def _record_count_change(self, class_index, old, new):
+        if class_index is None:
+            # Thao tác hàng loạt (load, reset, nạp lại taxonomy): ghi snapshot
+            self._journal_append("snap", self._counts_by_key(), self.total_work_time)
+            self._undo_stack.clear()
+            self._redo_stack.clear()
+            return
+        self._journal_append("c", self.taxonomy.class_keys.get(class_index), old, new)
+        if not self._undoing:
+            self._undo_stack.append((class_index, old, new))
+            self._redo_stack.clear()
+
+    def undo(self):
+        if not self._undo_stack:
+            return
+        class_index, old, new = self._undo_stack.pop()
+        self._undoing = True
+        try:
+            self.counts.set(class_index, old)
+        finally:
+            self._undoing = False
+        self._redo_stack.append((class_index, old, new))
+
+    def redo(self):
+        if not self._redo_stack:
+            return
+        class_index, old, new = self._redo_stack.pop()
+        self._undoing = True
+        try:
+            self.counts.set(class_index, new)
+        finally:
+            self._undoing = False
+        self._undo_stack.append((class_index, old, new))
+
+    def new_session(self):
+        if not messagebox.askyesno("New Session", "Reset all counts and working time?"):
+            return
+        self.total_work_time = 0.0
+        self.session_start = None
+        self.is_paused = True
+        self.counts.reset()
+        self.dataset_name_entry.delete(0, tk.END)
+        self.journal.compact({}, 0.0)
+
+    def sync_journal(self):
+        """fsync nhật ký theo lô mỗi giây, compact khi nhật ký đã dài"""
+        running = not self.is_paused and self.session_start
+        # Nhịp định kỳ để tính được thời gian làm việc nếu crash khi đang chạy
+        if running and time.time() - self._last_journal_write > 30:
+            self._journal_append("tick")
+        try:
+            if self.journal.needs_compaction():
+                self.journal.compact(self._counts_by_key(), self.total_work_time,
+                                     self.session_start if running else None)
+            else:
+                self.journal.sync()
+        except OSError as e:
+            print(f"WARNING: cannot write session journal: {e}")
+        self.root.after(1000, self.sync_journal)
 
     def get_total_elapsed_seconds(self):
         if self.is_paused or not self.session_start:
@@ -476,107 +1774,288 @@ class CounterApp:
         self.timer_label.config(text=f"Working Time: {self.format_seconds_hms(total_seconds)}")
         self.root.after(1000, self.update_timer_display)
 
-    def save_to_excel(self):
+    # ----------------------------
+    # LƯU/NẠP QUA KHO DATASET
+    # ----------------------------
+    def _store_counts(self):
+        """Số đếm class con theo class key để ghi vào kho"""
+        values = self.counts.values
+        class_keys = self.taxonomy.class_keys
+        return {class_keys[index]: values[index] for index in self.taxonomy.child_indices}
+
+    def _save_current_dataset(self, dataset_name):
+        try:
+            self.store.save(dataset_name, self.get_total_elapsed_seconds(), self._store_counts(),
+                            self.current_language.get(), self.taxonomy)
+        except sqlite3.Error as e:
+            messagebox.showerror("Error", f"Failed to save dataset '{dataset_name}': {e}")
+            return False
+        return True
+
+    def save_dataset(self):
+        dataset_name = self.dataset_name_entry.get().strip()
+        if not dataset_name:
+            messagebox.showerror("Error", "Please enter dataset name")
+            return
+        if self._save_current_dataset(dataset_name):
+            messagebox.showinfo("Success", f"Saved dataset '{dataset_name}'")
+
+    def load_dataset(self):
+        dataset_name = self.dataset_name_entry.get().strip()
+        if not dataset_name:
+            messagebox.showerror("Error", "Please enter dataset name before loading")
+            return
+        try:
+            result = self.store.load(dataset_name, self.taxonomy)
+        except sqlite3.Error as e:
+            messagebox.showerror("Error", f"Failed to load dataset '{dataset_name}': {e}")
+            return
+        if result is None:
+            messagebox.showinfo("Info", f"Dataset '{dataset_name}' not found")
+            return
+
+        working_seconds, counts_by_key, loaded_lang = result
+        index_by_key = self.taxonomy.index_by_key
+        values = array("l", [0]) * len(self.counts)
+        for key, value in counts_by_key.items():
+            index = index_by_key.get(key)
+            if index is not None:
+                values[index] = max(int(value), 0)
+        self._apply_loaded_dataset(working_seconds, values,
+                                   loaded_lang if loaded_lang in self.taxonomy.languages else None)
+
+    def link_route(self):
+        """Gắn file GPX với dataset hiện tại; route được đọc và cache ngay"""
         dataset_name = self.dataset_name_entry.get().strip()
         if not dataset_name:
             messagebox.showerror("Error", "Please enter dataset name")
             return
+        filename = filedialog.askopenfilename(filetypes=[("GPX files", "*.gpx")])
+        if not filename:
+            return
+        try:
+            route = self.route_cache.load(filename)
+            self.store.link_route(dataset_name, os.path.abspath(filename), route.digest)
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to link route: {e}")
+            return
+        messagebox.showinfo("Success", f"Linked {os.path.basename(filename)} to dataset '{dataset_name}'\n"
+                                       f"Track points: {len(route)}")
 
-        save_lang = tk.StringVar(value=self.current_language.get())
-        save_window = tk.Toplevel(self.root)
-        save_window.title("Select Save Language")
+    def _apply_loaded_dataset(self, working_seconds, values, loaded_lang):
+        """Thay số đếm và thời gian hiện tại bằng dataset vừa nạp (ở trạng thái tạm dừng)"""
+        if working_seconds is not None:
+            self.total_work_time = working_seconds
+        self.session_start = None
+        self.is_paused = True
+        self._journal_append("pause", self.total_work_time)
+        self.counts.assign(values)
 
-        ttk.Label(save_window, text="Select language to save:").pack(pady=10)
-        lang_menu = ttk.OptionMenu(save_window, save_lang, self.current_language.get(), *self.languages)
-        lang_menu.pack(pady=5)
+        if loaded_lang:
+            self.current_language.set(loaded_lang)
+            self.update_language(loaded_lang)
 
-        def confirm_save():
-            self._save_to_excel_internal(dataset_name, save_lang.get())
-            save_window.destroy()
+    def save_to_excel(self):
+        """Xuất các dataset trong kho ra workbook, một lần ghi cho cả lô"""
+        # Dataset đang mở được lưu vào kho trước để bản xuất có số mới nhất
+        dataset_name = self.dataset_name_entry.get().strip()
+        if dataset_name and not self._save_current_dataset(dataset_name):
+            return
+        days = self.store.days()
+        if not days:
+            messagebox.showinfo("Info", "No saved datasets to export")
+            return
 
-        ttk.Button(save_window, text="Save", command=confirm_save).pack(pady=10)
+        export_lang = tk.StringVar(value=self.current_language.get())
+        all_languages = tk.BooleanVar(value=False)
+        all_datasets = "All datasets"
+        export_day = tk.StringVar(value=days[0])
+        export_window = tk.Toplevel(self.root)
+        export_window.title("Export to Excel")
+
+        ttk.Label(export_window, text="Select language to save:").pack(pady=10)
+        ttk.OptionMenu(export_window, export_lang, self.current_language.get(), *self.languages).pack(pady=5)
+        ttk.Checkbutton(export_window, text="Export to all language sheets",
+                        variable=all_languages).pack(pady=5)
+        ttk.Label(export_window, text="Datasets saved on:").pack(pady=(10, 0))
+        ttk.OptionMenu(export_window, export_day, days[0], *days, all_datasets).pack(pady=5)
+
+        def confirm_export():
+            languages = self.languages if all_languages.get() else [export_lang.get()]
+            day = export_day.get()
+            export_window.destroy()
+            filename = filedialog.asksaveasfilename(defaultextension=".xlsx", filetypes=[("Excel files", "*.xlsx")])
+            if not filename:
+                return
+            self._export_store_to_excel(filename, languages, None if day == all_datasets else day)
+
+        ttk.Button(export_window, text="Export", command=confirm_export).pack(pady=10)
+
+    def _export_store_to_excel(self, filename, languages, day=None):
+        class_keys = self.taxonomy.class_keys
+        child_indices = self.taxonomy.child_indices
+        datasets = {}
+        for name, (working_seconds, counts_by_key, _) in self.store.iter_datasets(day, self.taxonomy).items():
+            counts = [counts_by_key.get(class_keys[index], 0) for index in child_indices]
+            datasets[name] = (self.format_seconds_hms(working_seconds), counts)
+
+        rows = build_export_rows(self.taxonomy, datasets, languages)
+        rows += self._density_rows(datasets, languages)
+        # Đưa vào hàng đợi ghi nền - kết quả báo lại qua poll_save_results
+        self.save_worker.submit_rows(filename, rows)
+
+    def _density_rows(self, datasets, languages):
+        """Dòng Density_<lang> cho các dataset có route GPX đã gắn"""
+        if gpx_routes is None:
+            return []
+        links = {name: path for name, path in self.store.route_links() if name in datasets}
+        route_lengths = {}
+        for name, path in links.items():
+            try:
+                route = self.route_cache.load(path)
+            except Exception as e:
+                print(f"WARNING: route {path} of dataset '{name}' skipped: {e}")
+                continue
+            with tracer.span("route.metrics", points=len(route)):
+                route_lengths[name] = (route.name, gpx_routes.route_metrics(route)["length_m"])
+        return build_density_rows(self.taxonomy, datasets, languages, route_lengths) if route_lengths else []
 
-    def _save_to_excel_internal(self, dataset_name, save_lang):
-        filename = filedialog.asksaveasfilename(defaultextension=".xlsx", filetypes=[("Excel files", "*.xlsx")])
-        if not filename:
+    def add_to_batch(self):
+        """Lưu snapshot dataset hiện tại vào bảng batch (ghi đè nếu trùng tên)"""
+        dataset_name = self.dataset_name_entry.get().strip()
+        if not dataset_name:
+            messagebox.showerror("Error", "Please enter dataset name")
             return
 
-        elapsed_seconds = self.get_total_elapsed_seconds()
-        elapsed_str = self.format_seconds_hms(elapsed_seconds)
+        elapsed_str = self.format_seconds_hms(self.get_total_elapsed_seconds())
+        counts = tuple(self.counts.take(self.taxonomy.child_indices))
+        self.batch_datasets[dataset_name] = (elapsed_str, counts)
+        self._update_batch_button()
 
-        # CHỈ LẤY ĐÚNG 67 CLASS CON
-        save_classes = []
-        save_counts = []
-        
-        # Tạo danh sách tất cả class con theo thứ tự
-        all_child_indices = []
-        for parent_index in sorted(self.parent_classes.keys()):
-            child_indices = self._find_child_indices(parent_index)
-            all_child_indices.extend(child_indices)
-        
-        # Sắp xếp và chỉ lấy 67 class con
-        all_child_indices = sorted(all_child_indices)
-        
-        # In debug info
-        print(f"DEBUG: Total child indices found: {len(all_child_indices)}")
-        print(f"DEBUG: Child indices: {all_child_indices}")
-        
-        for index in all_child_indices:
-            if index in self.class_mapping:
-                class_name = self.class_mapping[index].get(save_lang, f"Class_{index}")
-                save_classes.append(class_name)
-                save_counts.append(self.counts_all[index].get())
-
-        print(f"DEBUG: Saving {len(save_classes)} classes to Excel")
-
-        if os.path.exists(filename):
-            wb = openpyxl.load_workbook(filename)
-            sheet_name = f"Counts_{save_lang}"
-            if sheet_name in wb.sheetnames:
-                ws = wb[sheet_name]
+    def clear_batch(self):
+        self.batch_datasets.clear()
+        self._update_batch_button()
+
+    def _update_batch_button(self):
+        self.export_batch_button.config(text=f"📤 Export Batch ({len(self.batch_datasets)})")
+
+    def export_batch(self):
+        if not self.batch_datasets:
+            messagebox.showinfo("Info", "Batch is empty")
+            return
+
+        export_lang = tk.StringVar(value=self.current_language.get())
+        all_languages = tk.BooleanVar(value=False)
+        export_window = tk.Toplevel(self.root)
+        export_window.title("Export Batch")
+
+        ttk.Label(export_window, text="Select language to save:").pack(pady=10)
+        ttk.OptionMenu(export_window, export_lang, self.current_language.get(), *self.languages).pack(pady=5)
+        ttk.Checkbutton(export_window, text="Export to all language sheets",
+                        variable=all_languages).pack(pady=5)
+
+        def confirm_export():
+            languages = self.languages if all_languages.get() else [export_lang.get()]
+            export_window.destroy()
+            filename = filedialog.asksaveasfilename(defaultextension=".xlsx", filetypes=[("Excel files", "*.xlsx")])
+            if not filename:
+                return
+            # Một lần load/save workbook cho toàn bộ batch
+            rows = build_export_rows(self.taxonomy, self.batch_datasets, languages)
+            rows += self._density_rows(self.batch_datasets, languages)
+            self.save_worker.submit_rows(filename, rows)
+
+        ttk.Button(export_window, text="Export", command=confirm_export).pack(pady=10)
+
+    def poll_save_results(self):
+        """Lấy kết quả ghi nền trên luồng UI"""
+        while True:
+            try:
+                filename, row_count, error = self.save_worker.results.get_nowait()
+            except queue.Empty:
+                break
+            if error is not None:
+                messagebox.showerror("Error", f"Failed to save {filename}: {error}")
             else:
-                ws = wb.create_sheet(sheet_name)
-        else:
-            wb = openpyxl.Workbook()
-            ws = wb.active
-            ws.title = f"Counts_{save_lang}"
+                messagebox.showinfo("Success", f"Saved to {filename}\nRows written: {row_count}")
+        self.root.after(200, self.poll_save_results)
 
-        # Tạo header nếu chưa có hoặc không khớp
-        if ws.max_row == 0:
-            ws.append(["Dataset Name", "Working Time"] + save_classes)
+    # ----------------------------
+    # ĐỘ TRỄ UI VÀ BẢNG THỐNG KÊ TRACE
+    # ----------------------------
+    UI_LAG_INTERVAL_MS = 100
+    UI_LAG_LOG_THRESHOLD = 0.02
+
+    def monitor_ui_lag(self):
+        """Độ trễ = callback after() chạy muộn bao lâu so với hẹn; > ngưỡng thì ghi file trace"""
+        now = time.perf_counter()
+        if tracer.enabled:
+            if self._lag_expected is not None:
+                lag = max(0.0, now - self._lag_expected)
+                tracer.record("ui.lag", lag, log=lag > self.UI_LAG_LOG_THRESHOLD)
+            self._lag_expected = now + self.UI_LAG_INTERVAL_MS / 1000
         else:
-            # Kiểm tra header hiện tại
-            current_header = [cell.value for cell in ws[1]]
-            expected_header = ["Dataset Name", "Working Time"] + save_classes
-            
-            if len(current_header) != len(expected_header) or current_header != expected_header:
-                # Header không khớp, xóa toàn bộ sheet và tạo lại
-                ws.delete_rows(1, ws.max_row)
-                ws.append(["Dataset Name", "Working Time"] + save_classes)
-
-        # Tìm và cập nhật dòng hiện có, hoặc thêm mới
-        found = False
-        for row_idx, row in enumerate(ws.iter_rows(min_row=2, max_row=ws.max_row), start=2):
-            if row[0].value == dataset_name:
-                # Cập nhật dòng hiện có
-                row[0].value = dataset_name
-                row[1].value = elapsed_str
-                for i, cell in enumerate(row[2:2+len(save_counts)]):
-                    if i < len(save_counts):
-                        cell.value = save_counts[i]
-                # Xóa dữ liệu thừa nếu có
-                for i in range(2+len(save_counts), len(row)):
-                    if i < len(row):
-                        row[i].value = None
-                found = True
-                break
+            self._lag_expected = None
+        self.root.after(self.UI_LAG_INTERVAL_MS, self.monitor_ui_lag)
 
-        if not found:
-            # Thêm dòng mới
-            ws.append([dataset_name, elapsed_str] + save_counts)
+    def show_stats(self):
+        if self.stats_window is not None and self.stats_window.winfo_exists():
+            self.stats_window.lift()
+            return
+
+        self.stats_window = tk.Toplevel(self.root)
+        self.stats_window.title("Stats")
+        tracing = tk.BooleanVar(value=tracer.enabled)
 
-        wb.save(filename)
-        messagebox.showinfo("Success", f"Saved to {filename}\nTotal classes: {len(save_classes)}")
+        def toggle_tracing():
+            if tracing.get():
+                try:
+                    tracer.enable()
+                except OSError as e:
+                    tracing.set(False)
+                    messagebox.showerror("Error", f"Cannot open {tracer.path}: {e}")
+            else:
+                tracer.disable()
+
+        ttk.Checkbutton(self.stats_window, text=f"Enable tracing (log to {tracer.path})",
+                        variable=tracing, command=toggle_tracing).pack(anchor="w", padx=10, pady=5)
+
+        columns = ("count", "mean", "max", "last")
+        tree = ttk.Treeview(self.stats_window, columns=columns, height=12)
+        tree.heading("#0", text="Span")
+        tree.column("#0", width=180)
+        for column, title in zip(columns, ("Count", "Mean (ms)", "Max (ms)", "Last (ms)")):
+            tree.heading(column, text=title)
+            tree.column(column, width=90, anchor="e")
+        tree.pack(fill="both", expand=True, padx=10)
+
+        def refresh():
+            if not tree.winfo_exists():
+                return
+            tree.delete(*tree.get_children())
+            for name, stat in sorted(tracer.snapshot_stats().items()):
+                tree.insert("", "end", text=name, values=(
+                    stat["count"],
+                    f"{stat['total'] / stat['count'] * 1000:.2f}",
+                    f"{stat['max'] * 1000:.2f}",
+                    f"{stat['last'] * 1000:.2f}",
+                ))
+            self.stats_window.after(1000, refresh)
+
+        def reset():
+            tracer.reset_stats()
+            tree.delete(*tree.get_children())
+
+        ttk.Button(self.stats_window, text="Reset", command=reset).pack(pady=10)
+        refresh()
+
+    def on_close(self):
+        # Chờ các lần lưu còn lại ghi xong trước khi thoát
+        self.save_worker.close()
+        self.pause_timer()
+        self.journal.close()
+        self.store.close()
+        self.root.destroy()
 
     def load_from_excel(self):
         filename = filedialog.askopenfilename(filetypes=[("Excel files", "*.xlsx")])
@@ -589,86 +2068,31 @@ class CounterApp:
             return
 
         try:
-            wb = openpyxl.load_workbook(filename)
+            result = read_dataset_row(filename, dataset_name, self.taxonomy)
+            if result is None:
+                messagebox.showinfo("Info", f"Dataset '{dataset_name}' not found in {filename}")
+                return
+
+            loaded_lang, header, row = result
+            working_seconds = None
+            time_str = str(row[1])
+            if ':' in time_str:
+                h, m, s = map(int, time_str.split(":"))
+                working_seconds = h*3600 + m*60 + s
+
+            # Cột → class index, tính một lần cho cả header
+            with tracer.span("header.resolve", columns=len(header) - 2):
+                column_indices = self.taxonomy.resolve_header(header[2:], loaded_lang)
             
-            ws = None
-            loaded_lang = None
-            for sheet_name in wb.sheetnames:
-                sheet = wb[sheet_name]
-                header = [cell.value for cell in sheet[1]] if sheet.max_row > 0 else []
-                if len(header) >= 3:
-                    excel_classes = header[2:]
-                    for lang in self.languages:
-                        # Tạo danh sách class con cho ngôn ngữ này
-                        lang_child_classes = []
-                        all_child_indices = []
-                        for parent_index in sorted(self.parent_classes.keys()):
-                            child_indices = self._find_child_indices(parent_index)
-                            all_child_indices.extend(child_indices)
-                        
-                        all_child_indices = sorted(all_child_indices)
-                        
-                        for index in all_child_indices:
-                            if index in self.class_mapping:
-                                class_name = self.class_mapping[index].get(lang, f"Class_{index}")
-                                lang_child_classes.append(class_name)
-                        
-                        if excel_classes == lang_child_classes:
-                            ws = sheet
-                            loaded_lang = lang
-                            break
-                if ws:
-                    break
+            values = array("l", [0]) * len(self.counts)
+            for index, value in zip(column_indices, row[2:]):
+                if index is not None:
+                    count = _to_count(value)
+                    if count is not None:
+                        values[index] = count
+            self._apply_loaded_dataset(working_seconds, values, loaded_lang)
             
-            if not ws:
-                ws = wb.active
-
-            found = False
-            for row in ws.iter_rows(min_row=2, values_only=True):
-                if row and row[0] == dataset_name:
-                    time_str = str(row[1])
-                    if ':' in time_str:
-                        h, m, s = map(int, time_str.split(":"))
-                        self.total_work_time = h*3600 + m*60 + s
-                    self.session_start = None
-                    self.is_paused = True
-
-                    header = [cell.value for cell in ws[1]]
-                    excel_classes = header[2:]
-                    
-                    for index in self.class_indexes:
-                        self.counts_all[index].set(0)
-                    
-                    # Tạo danh sách class con để load
-                    all_child_indices = []
-                    for parent_index in sorted(self.parent_classes.keys()):
-                        child_indices = self._find_child_indices(parent_index)
-                        all_child_indices.extend(child_indices)
-                    
-                    all_child_indices = sorted(all_child_indices)
-                    
-                    for i, excel_class in enumerate(excel_classes):
-                        if i + 2 < len(row) and row[i + 2] is not None:
-                            # Tìm class index tương ứng
-                            for index in all_child_indices:
-                                if index in self.class_mapping:
-                                    lang_dict = self.class_mapping[index]
-                                    if excel_class in lang_dict.values():
-                                        self.counts_all[index].set(row[i + 2])
-                                        if index in self.entry_widgets:
-                                            self.sync_entry_value(index)
-                                        break
-
-                    found = True
-                    if loaded_lang:
-                        self.current_language.set(loaded_lang)
-                        self.update_language(loaded_lang)
-                    
-                    messagebox.showinfo("Success", f"Loaded dataset '{dataset_name}' from {filename}")
-                    break
-
-            if not found:
-                messagebox.showinfo("Info", f"Dataset '{dataset_name}' not found in {filename}")
+            messagebox.showinfo("Success", f"Loaded dataset '{dataset_name}' from {filename}")
 
         except Exception as e:
             messagebox.showerror("Error", f"Failed to load file: {e}")
@@ -0,0 +1,905 @@
+import hashlib
+import queue
+import random
+import re
+import sys
+import threading
+import time
+from array import array
+
+# ================= BACKEND NHẬP/MÀN HÌNH =================
+# Mỗi backend có: move(x, y), click(x, y, button, clicks),
+# drag(x1, y1, x2, y2, duration), position(), screenshot(region),
+# grab(region) → bytes RGB của vùng (x, y, w, h),
+# poll_interval(region) → khoảng dò điều kiện hợp lý cho grab(region),
+# add_hotkey(key, callback), clear_hotkeys()
+
+class PyAutoGuiBackend:
+    """Backend thật: pyautogui cho chuột/màn hình, keyboard cho phím nóng.
+
+    Hai thư viện chỉ được import khi tạo backend, nên import module này
+    không cần desktop. Chạy được dưới Xvfb (pyautogui dùng Xlib trên Linux).
+
+    grab() chụp đúng vùng cần bằng mss nếu có cài (XGetImage trên X11,
+    BitBlt trên Windows, CoreGraphics trên macOS). Không có mss thì chỉ
+    pixel 1×1 trên Windows (GetPixel) là đọc riêng vùng; còn lại pyscreeze
+    chụp cả màn hình rồi cắt, nên poll_interval() dò thưa hơn.
+    """
+
+    def __init__(self):
+        import pyautogui
+        self._pyautogui = pyautogui
+        self._keyboard = None
+        self._hotkeys = []
+        try:
+            import mss
+        except ImportError:
+            mss = None
+        self._mss = mss
+        # Đối tượng mss gắn với luồng tạo ra nó (DC trên Windows) - mỗi luồng một cái
+        self._local = threading.local()
+
+    def move(self, x, y):
+        self._pyautogui.moveTo(x, y, _pause=False)
+
+    def click(self, x, y, button="left", clicks=1):
+        # _pause=False: bỏ pyautogui.PAUSE sau mỗi click, lịch tự lo khoảng cách
+        self._pyautogui.click(x, y, clicks=clicks, button=button, _pause=False)
+
+    def drag(self, x1, y1, x2, y2, duration=0.0):
+        self._pyautogui.moveTo(x1, y1, _pause=False)
+        self._pyautogui.dragTo(x2, y2, duration=duration, button="left", _pause=False)
+
+    def position(self):
+        x, y = self._pyautogui.position()
+        return x, y
+
+    def screenshot(self, region=None):
+        return self._pyautogui.screenshot(region=region)
+
+    def _region_grabs(self, region):
+        """True nếu grab(region) chỉ đọc đúng vùng đó, không chụp cả màn hình"""
+        return self._mss is not None or (sys.platform == "win32" and region[2] == 1 and region[3] == 1)
+
+    def grab(self, region):
+        x, y, width, height = region
+        if self._mss is not None:
+            grabber = getattr(self._local, "mss", None)
+            if grabber is None:
+                grabber = self._local.mss = self._mss.mss()
+            return grabber.grab({"left": x, "top": y, "width": width, "height": height}).rgb
+        if self._region_grabs(region):
+            # pixel() chỉ đọc đúng một điểm (GetPixel) trên Windows; trên Linux/macOS
+            # nó chụp cả màn hình rồi getpixel
+            return bytes(self._pyautogui.pixel(x, y)[:3])
+        # pyscreeze: ImageGrab/scrot/screencapture chụp cả màn hình rồi cắt
+        return self._pyautogui.screenshot(region=region).convert("RGB").tobytes()
+
+    def poll_interval(self, region):
+        return CONDITION_POLL_INTERVAL if self._region_grabs(region) else FULL_SCREEN_POLL_INTERVAL
+
+    def add_hotkey(self, key, callback):
+        if self._keyboard is None:
+            import keyboard
+            self._keyboard = keyboard
+        self._hotkeys.append(self._keyboard.add_hotkey(key, callback))
+
+    def clear_hotkeys(self):
+        for handle in self._hotkeys:
+            self._keyboard.remove_hotkey(handle)
+        self._hotkeys = []
+
+class RecordingBackend:
+    """Backend giả, không cần màn hình: ghi mọi thao tác kèm thời điểm vào self.events.
+
+    events: list (time.perf_counter(), tên thao tác, tham số). click_cost giả
+    lập thời gian một click thật tốn (giây). Phím nóng được kích hoạt bằng
+    press(key); screenshot/grab trả về frame từ frame_source(region) nếu có
+    (ví dụ SyntheticScreen). on_click(x, y), nếu có, được gọi sau mỗi click
+    để giả lập phản ứng của ứng dụng.
+    """
+
+    def __init__(self, click_cost=0.0, frame_source=None, on_click=None):
+        self.click_cost = click_cost
+        self.frame_source = frame_source
+        self.on_click = on_click
+        self.events = []
+        self._position = (0, 0)
+        self._hotkeys = {}
+        self._lock = threading.Lock()
+
+    def _record(self, name, *args):
+        with self._lock:
+            self.events.append((time.perf_counter(), name, args))
+
+    def move(self, x, y):
+        self._position = (x, y)
+        self._record("move", x, y)
+
+    def click(self, x, y, button="left", clicks=1):
+        if self.click_cost:
+            end = time.perf_counter() + self.click_cost
+            while time.perf_counter() < end:
+                pass
+        self._position = (x, y)
+        self._record("click", x, y, button, clicks)
+        if self.on_click is not None:
+            self.on_click(x, y)
+
+    def drag(self, x1, y1, x2, y2, duration=0.0):
+        self._position = (x2, y2)
+        self._record("drag", x1, y1, x2, y2, duration)
+
+    def position(self):
+        return self._position
+
+    def screenshot(self, region=None):
+        self._record("screenshot", region)
+        return self.frame_source(region) if self.frame_source is not None else None
+
+    def grab(self, region):
+        if self.frame_source is None:
+            raise RuntimeError("RecordingBackend has no frame_source")
+        return self.frame_source(region)
+
+    def poll_interval(self, region):
+        return CONDITION_POLL_INTERVAL
+
+    def add_hotkey(self, key, callback):
+        self._hotkeys.setdefault(key.lower(), []).append(callback)
+
+    def clear_hotkeys(self):
+        self._hotkeys = {}
+
+    def press(self, key):
+        """Giả lập nhấn phím nóng (gọi callback ngay trên luồng hiện tại)"""
+        self._record("hotkey", key)
+        for callback in self._hotkeys.get(key.lower(), []):
+            callback()
+
+    def clicks(self):
+        """Thời điểm và tọa độ các click đã ghi: list (t, x, y)"""
+        with self._lock:
+            return [(t, args[0], args[1]) for t, name, args in self.events if name == "click"]
+
+    def reset(self):
+        with self._lock:
+            self.events = []
+
+# ================= LỊCH CLICK KHÔNG TRÔI =================
+# Đoạn cuối trước deadline được chờ bận thay vì sleep (sleep có thể trễ vài ms)
+# Đoạn cuối trước deadline được spin thay vì Event.wait (Linux/macOS dậy lệch < 1 ms)
+SPIN_THRESHOLD = 0.002
+# Event.wait trên Windows dậy theo nhịp timer hệ thống, mặc định ~15.6 ms.
+# Lúc phát lại xin nhịp 1 ms bằng timeBeginPeriod (vẫn lệch tới ~2 ms); không
+# xin được thì spin cả một nhịp mặc định.
+WIN32_TIMER_PERIOD_MS = 1
+WIN32_FINE_SPIN = 0.003
+WIN32_COARSE_SPIN = 0.016
+
+def _no_restore():
+    pass
+
+def _fine_timer():
+    """Chuẩn bị đồng hồ cho lúc phát lại.
+
+    Trả về (ngưỡng spin cho sleep_until, hàm trả lại trạng thái cũ). Chỉ
+    Windows cần làm gì đó: xin nhịp timer 1 ms trong lúc phát lại.
+    """
+    if sys.platform != "win32":
+        return SPIN_THRESHOLD, _no_restore
+    try:
+        import ctypes
+        winmm = ctypes.WinDLL("winmm")
+    except (ImportError, AttributeError, OSError):
+        return WIN32_COARSE_SPIN, _no_restore
+    if winmm.timeBeginPeriod(WIN32_TIMER_PERIOD_MS) != 0:
+        # Khác TIMERR_NOERROR - nhịp không đổi
+        return WIN32_COARSE_SPIN, _no_restore
+    return WIN32_FINE_SPIN, lambda: winmm.timeEndPeriod(WIN32_TIMER_PERIOD_MS)
+
+def sleep_until(deadline, stop_event, spin=SPIN_THRESHOLD):
+    """Chờ tới deadline (theo time.perf_counter) hoặc tới khi stop_event được set.
+
+    Phần lớn thời gian chờ bằng Event.wait nên lệnh dừng đánh thức ngay;
+    spin giây cuối thì spin để đúng giờ. Trả về True nếu bị dừng.
+    """
+    while True:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            return stop_event.is_set()
+        if remaining > spin:
+            if stop_event.wait(remaining - spin):
+                return True
+        elif stop_event.is_set():
+            return True
+
+class LatenessStats:
+    """Thống kê độ trễ so với deadline với bộ nhớ cố định.
+
+    Số lần, tổng và max là chính xác; p99 lấy từ reservoir (Algorithm R)
+    tối đa RESERVOIR_SIZE mẫu, nên chính xác khi số click không vượt quá
+    reservoir và là ước lượng khi nhiều hơn. Lặp 10**9 lần vẫn không cấp
+    phát theo số click.
+    """
+
+    RESERVOIR_SIZE = 4096
+
+    def __init__(self, size=RESERVOIR_SIZE, seed=None):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = array("d")
+        self.size = size
+        self._random = random.Random(seed).random
+
+    def __len__(self):
+        return self.count
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        if len(self.samples) < self.size:
+            self.samples.append(value)
+        else:
+            slot = int(self._random() * self.count)
+            if slot < self.size:
+                self.samples[slot] = value
+
+    def percentile(self, fraction):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def schedule_report(start, deadline, lateness, stopped, condition_waits=0, condition_wait=0.0, timeouts=0):
+    """Tốc độ đạt được so với mục tiêu và jitter (độ trễ so với deadline) tính bằng ms.
+
+    lateness: LatenessStats của các lệnh thao tác đã chạy. Sau mỗi lần chờ
+    điều kiện, lịch được tính lại từ lúc điều kiện thỏa, nên target đã gồm
+    cả thời gian chờ điều kiện.
+    """
+    elapsed = time.perf_counter() - start
+    target = deadline - start
+    clicks = lateness.count
+    return {
+        "clicks": clicks,
+        "stopped": stopped,
+        "elapsed": elapsed,
+        "target": target,
+        "rate": clicks / elapsed if elapsed > 0 else 0.0,
+        "target_rate": clicks / target if target > 0 else 0.0,
+        "drift_ms": (elapsed - target) * 1000,
+        "jitter_mean_ms": lateness.total / clicks * 1000 if clicks else 0.0,
+        "jitter_p99_ms": lateness.percentile(0.99) * 1000,
+        "jitter_max_ms": lateness.max * 1000,
+        "condition_waits": condition_waits,
+        "condition_wait_ms": condition_wait * 1000,
+        "timeouts": timeouts,
+    }
+
+def format_schedule_report(report):
+    return (f"{report['clicks']} click trong {report['elapsed']:.3f}s (mục tiêu {report['target']:.3f}s, "
+            f"lệch {report['drift_ms']:+.1f} ms) | tốc độ {report['rate']:.2f}/s (mục tiêu {report['target_rate']:.2f}/s) | "
+            f"jitter trung bình {report['jitter_mean_ms']:.3f} ms, p99 {report['jitter_p99_ms']:.3f} ms, "
+            f"max {report['jitter_max_ms']:.3f} ms"
+            + (f" | chờ điều kiện {report['condition_waits']} lần, {report['condition_wait_ms']:.0f} ms"
+               if report["condition_waits"] else "")
+            + (f" | hết giờ chờ {report['timeouts']} lần" if report["timeouts"] else "")
+            + (" | đã dừng" if report["stopped"] else ""))
+
+# ================= ĐIỀU KIỆN CHỜ - DÒ PIXEL =================
+DEFAULT_CONDITION_TIMEOUT = 5.0
+CONDITION_POLL_INTERVAL = 0.005
+# Khi backend chỉ chụp được cả màn hình rồi cắt: mỗi lần dò tốn hàng chục ms CPU
+FULL_SCREEN_POLL_INTERVAL = 0.05
+
+def parse_color(value):
+    """'#RRGGBB' hoặc [r, g, b] → (r, g, b)"""
+    if isinstance(value, str):
+        text = value.lstrip("#")
+        if len(text) != 6:
+            raise ValueError(f"invalid colour '{value}'")
+        return tuple(bytes.fromhex(text))
+    color = tuple(int(c) for c in value)
+    if len(color) != 3 or not all(0 <= c <= 255 for c in color):
+        raise ValueError(f"invalid colour {value!r}")
+    return color
+
+def format_color(color):
+    return "#" + bytes(color).hex()
+
+def region_hash(data):
+    """Hash ngắn của dữ liệu RGB một vùng, để so vùng lớn hơn vài pixel"""
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+class ColorCondition:
+    """Mọi pixel của vùng nhỏ (mặc định một pixel) lệch màu color không quá tolerance mỗi kênh"""
+
+    def __init__(self, x, y, color, tolerance=0, width=1, height=1):
+        self.region = (x, y, width, height)
+        self.color = color
+        self.tolerance = tolerance
+        self._exact = bytes(color) * (width * height)
+        self._low = [max(c - tolerance, 0) for c in color]
+        self._high = [min(c + tolerance, 255) for c in color]
+
+    def matches(self, data):
+        if data == self._exact:
+            return True
+        if not self.tolerance or len(data) != len(self._exact):
+            return False
+        (r_low, g_low, b_low), (r_high, g_high, b_high) = self._low, self._high
+        for i in range(0, len(data), 3):
+            if not (r_low <= data[i] <= r_high and g_low <= data[i + 1] <= g_high
+                    and b_low <= data[i + 2] <= b_high):
+                return False
+        return True
+
+class HashCondition:
+    """Hash nội dung vùng (x, y, w, h) bằng giá trị đã lưu"""
+
+    def __init__(self, x, y, width, height, digest):
+        self.region = (x, y, width, height)
+        self.digest = digest
+
+    def matches(self, data):
+        return region_hash(data) == self.digest
+
+def condition_from_spec(spec):
+    """Điều kiện từ dict lưu trong bộ nhấp.
+
+    {"x", "y", "color": "#RRGGBB", "tolerance"} hoặc
+    {"region": [x, y, w, h], "hash": "..."}; kèm "timeout" (giây) và
+    "on_timeout": "stop" | "continue". Trả về (điều kiện, timeout, tiếp tục khi hết giờ).
+    """
+    try:
+        if "hash" in spec:
+            x, y, width, height = (int(v) for v in spec["region"])
+            condition = HashCondition(x, y, width, height, str(spec["hash"]))
+        else:
+            condition = ColorCondition(int(spec["x"]), int(spec["y"]), parse_color(spec["color"]),
+                                       int(spec.get("tolerance", 0)))
+        timeout = float(spec.get("timeout", DEFAULT_CONDITION_TIMEOUT))
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"invalid wait condition {spec!r}: {e}") from None
+    return condition, timeout, spec.get("on_timeout", "stop") == "continue"
+
+class SyntheticScreen:
+    """Màn hình giả trong bộ nhớ làm frame_source cho RecordingBackend.
+
+    fill() đổi màu một vùng ngay, fill_after() hẹn đổi sau một khoảng thời
+    gian - đủ để giả lập ứng dụng phản hồi chậm khi thử các lệnh chờ.
+    """
+
+    def __init__(self, width, height, color=(0, 0, 0)):
+        self.width = width
+        self.height = height
+        self.pixels = bytearray(bytes(color) * (width * height))
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def fill(self, region, color):
+        x, y, width, height = region
+        row = bytes(color) * width
+        with self._lock:
+            for line in range(y, y + height):
+                offset = (line * self.width + x) * 3
+                self.pixels[offset:offset + len(row)] = row
+
+    def fill_after(self, seconds, region, color):
+        with self._lock:
+            self._pending.append((time.perf_counter() + seconds, region, color))
+
+    def __call__(self, region):
+        now = time.perf_counter()
+        with self._lock:
+            due = [item for item in self._pending if item[0] <= now]
+            if due:
+                self._pending = [item for item in self._pending if item[0] > now]
+        for _, fill_region, color in sorted(due, key=lambda item: item[0]):
+            self.fill(fill_region, color)
+        x, y, width, height = region
+        with self._lock:
+            return b"".join(bytes(self.pixels[(line * self.width + x) * 3:(line * self.width + x + width) * 3])
+                            for line in range(y, y + height))
+
+# ================= PLAYLIST - BIÊN DỊCH RA BỘ ĐỆM LỆNH PHẲNG =================
+# Mã lệnh; các lệnh thao tác (có hẹn giờ) đứng trước OP_WAIT
+OP_CLICK, OP_DOUBLE, OP_RIGHT, OP_DRAG, OP_WAIT, OP_LOOP, OP_END, OP_UNTIL = range(8)
+
+class PlaylistError(ValueError):
+    """Lỗi cú pháp playlist, kèm số dòng"""
+
+    def __init__(self, line_number, message):
+        super().__init__(f"line {line_number}: {message}")
+        self.line_number = line_number
+
+class Program:
+    """Chương trình đã biên dịch: các mảng song song, mỗi chỉ số là một lệnh.
+
+    ops: mã lệnh; x/y: tọa độ (OP_LOOP: x = số lần; OP_END: x = vị trí lệnh
+    đầu thân vòng lặp; OP_UNTIL: x = 1 nếu hết giờ vẫn chạy tiếp);
+    x2/y2: điểm cuối của drag; seconds: thời gian chờ sau lệnh (OP_UNTIL:
+    timeout); duration: thời gian kéo; ref: chỉ số trong conditions.
+    actions: tổng số lệnh thao tác sẽ chạy (đã nhân số lần lặp).
+    """
+
+    def __init__(self):
+        self.ops = array("b")
+        self.x = array("l")
+        self.y = array("l")
+        self.x2 = array("l")
+        self.y2 = array("l")
+        self.seconds = array("d")
+        self.duration = array("d")
+        self.ref = array("l")
+        self.conditions = []
+        self.actions = 0
+        self.max_depth = 0
+
+    def __len__(self):
+        return len(self.ops)
+
+    def emit(self, op, x=0, y=0, seconds=0.0, x2=0, y2=0, duration=0.0, ref=-1):
+        self.ops.append(op)
+        self.x.append(x)
+        self.y.append(y)
+        self.x2.append(x2)
+        self.y2.append(y2)
+        self.seconds.append(seconds)
+        self.duration.append(duration)
+        self.ref.append(ref)
+        return len(self.ops) - 1
+
+class _Compiler:
+    def __init__(self, click_sets, default_delay):
+        self.click_sets = click_sets
+        self.program = Program()
+        self.delay = default_delay
+        self.multiplier = 1
+        self.depth = 0
+
+    def action(self, op, x, y, seconds, x2=0, y2=0, duration=0.0):
+        self.program.emit(op, x, y, seconds, x2, y2, duration)
+        self.program.actions += self.multiplier
+
+    def open_loop(self, count):
+        index = self.program.emit(OP_LOOP, count)
+        self.multiplier *= count
+        self.depth += 1
+        self.program.max_depth = max(self.program.max_depth, self.depth)
+        return index
+
+    def close_loop(self, loop_index, count):
+        self.program.emit(OP_END, loop_index + 1)
+        self.multiplier //= count
+        self.depth -= 1
+
+    def until(self, condition, timeout, continue_on_timeout):
+        self.program.conditions.append(condition)
+        self.program.emit(OP_UNTIL, 1 if continue_on_timeout else 0, seconds=timeout,
+                          ref=len(self.program.conditions) - 1)
+
+    def click_set(self, name, line_number):
+        if name not in self.click_sets:
+            raise PlaylistError(line_number, f"unknown click set '{name}'")
+        for item in self.click_sets[name]:
+            # Bộ nhấp đọc từ file JSON - giá trị hỏng báo lỗi kèm số dòng playlist
+            try:
+                x, y = int(item.get("x", 0)), int(item.get("y", 0))
+                delay = float(item.get("delay", self.delay))
+                if delay < 0:
+                    raise ValueError(f"negative delay {delay}")
+                if item.get("until"):
+                    self.until(*condition_from_spec(item["until"]))
+            except (TypeError, ValueError) as e:
+                raise PlaylistError(line_number, f"click set {name!r}: {item.get('name', item)!r}: {e}") from None
+            self.action(OP_CLICK, x, y, delay)
+
+def compile_steps(steps, repeat):
+    """Biên dịch list (x, y, delay[, điều kiện chờ]) lặp repeat lần - lượt chạy của một bộ nhấp.
+
+    Điều kiện chờ (dict như trong condition_from_spec) được kiểm tra trước
+    khi click vị trí đó.
+    """
+    compiler = _Compiler({}, 0.0)
+    if repeat > 0 and steps:
+        loop = compiler.open_loop(repeat)
+        for step in steps:
+            x, y, delay = step[:3]
+            if len(step) > 3 and step[3]:
+                compiler.until(*condition_from_spec(step[3]))
+            compiler.action(OP_CLICK, int(x), int(y), float(delay))
+        compiler.close_loop(loop, repeat)
+    return compiler.program
+
+_BRACE_RE = re.compile(r"([{}])")
+
+def _parse_playlist(text):
+    """Tách playlist thành cây: list (số dòng, lệnh, tham số, thân khối hoặc None).
+
+    Khối viết trên nhiều dòng hoặc gọn trên một dòng: 'repeat 2 { call S }'.
+    """
+    root = []
+    stack = [(None, root)]
+
+    def add(line_number, line, opens):
+        command, _, rest = line.partition(" ")
+        node = (line_number, command.lower(), rest.strip(), [] if opens else None)
+        stack[-1][1].append(node)
+        if opens:
+            stack.append((node, node[3]))
+
+    for line_number, raw in enumerate(text.splitlines(), start=1):
+        line = raw.split("#", 1)[0].strip()
+        if not line:
+            continue
+        # Lệnh đứng trước '{' mở khối; lệnh còn lại trước '}' hoặc cuối dòng là lệnh thường
+        pending = None
+        for part in _BRACE_RE.split(line):
+            part = part.strip()
+            if part == "{":
+                if not pending:
+                    raise PlaylistError(line_number, "'{' without a command")
+                add(line_number, pending, True)
+                pending = None
+            elif part == "}":
+                if pending:
+                    add(line_number, pending, False)
+                    pending = None
+                if len(stack) == 1:
+                    raise PlaylistError(line_number, "unexpected '}'")
+                stack.pop()
+            elif part:
+                pending = part
+        if pending:
+            add(line_number, pending, False)
+    if len(stack) > 1:
+        raise PlaylistError(stack[-1][0][0], "missing '}'")
+    return root
+
+def _numbers(line_number, command, rest, count, optional=0, kind=float):
+    parts = rest.split()
+    if not count <= len(parts) <= count + optional:
+        raise PlaylistError(line_number, f"'{command}' takes {count}"
+                            + (f" to {count + optional}" if optional else "") + " arguments")
+    try:
+        return [kind(part) for part in parts[:count]] + [float(part) for part in parts[count:]]
+    except ValueError:
+        raise PlaylistError(line_number, f"invalid number in '{command} {rest}'") from None
+
+def _seconds(line_number, command, value):
+    """Thời gian trong playlist - giá trị âm sẽ kéo deadline tuyệt đối lùi lại"""
+    if value < 0:
+        raise PlaylistError(line_number, f"'{command}' time must not be negative")
+    return value
+
+def _parse_until(line_number, rest):
+    parts = rest.split()
+    continue_on_timeout = bool(parts) and parts[-1].lower() == "continue"
+    if continue_on_timeout:
+        parts.pop()
+    kind = parts[0].lower() if parts else ""
+    try:
+        if kind == "pixel" and 4 <= len(parts) <= 6:
+            x, y = int(parts[1]), int(parts[2])
+            tolerance = int(parts[4]) if len(parts) > 4 else 0
+            timeout = float(parts[5]) if len(parts) > 5 else DEFAULT_CONDITION_TIMEOUT
+            return ColorCondition(x, y, parse_color(parts[3]), tolerance), timeout, continue_on_timeout
+        if kind == "region" and 6 <= len(parts) <= 7:
+            x, y, width, height = (int(part) for part in parts[1:5])
+            timeout = float(parts[6]) if len(parts) > 6 else DEFAULT_CONDITION_TIMEOUT
+            return HashCondition(x, y, width, height, parts[5]), timeout, continue_on_timeout
+    except ValueError as e:
+        raise PlaylistError(line_number, f"invalid 'until': {e}") from None
+    raise PlaylistError(line_number, "expected 'until pixel X Y RRGGBB [TOL] [TIMEOUT]' "
+                                     "or 'until region X Y W H HASH [TIMEOUT]'")
+
+def compile_playlist(text, click_sets, default_delay):
+    """Biên dịch playlist thành Program.
+
+    Cú pháp, mỗi lệnh một dòng (# là chú thích):
+        set <tên bộ>                 chạy các vị trí của một bộ nhấp
+        click|double|right X Y [D]   click trái / đúp / phải rồi chờ D giây
+        drag X1 Y1 X2 Y2 [T] [D]     kéo trong T giây rồi chờ D giây
+        wait S                       chờ thêm S giây
+        delay S                      delay mặc định cho các lệnh phía sau
+        until pixel X Y RRGGBB [TOL] [TIMEOUT] [continue]
+        until region X Y W H HASH [TIMEOUT] [continue]
+                                     chờ tới khi pixel/vùng khớp (hết giờ thì
+                                     dừng, hoặc chạy tiếp nếu có 'continue');
+                                     màu viết không có '#' vì '#' là chú thích
+        repeat N { ... }             lặp khối N lần (lồng nhau được)
+        def <tên> { ... }            định nghĩa bộ con, gọi bằng: call <tên>
+    Khối viết trên nhiều dòng hoặc trên một dòng ('repeat 3 { call S }').
+    Mọi thời gian phải >= 0.
+    Bộ con và bộ nhấp được chép thẳng vào bộ đệm lệnh lúc biên dịch, nên lúc
+    chạy chỉ còn duyệt mảng.
+    """
+    tree = _parse_playlist(text)
+    definitions = {}
+    body = []
+    for node in tree:
+        line_number, command, rest, block = node
+        if command == "def":
+            if block is None or not rest:
+                raise PlaylistError(line_number, "expected 'def <name> {'")
+            definitions[rest] = block
+        else:
+            body.append(node)
+
+    compiler = _Compiler(click_sets, default_delay)
+    calling = []
+
+    def compile_block(nodes):
+        for line_number, command, rest, block in nodes:
+            if (block is not None) != (command in ("repeat", "def")):
+                raise PlaylistError(line_number, f"'{command}' " + ("does not take" if block is not None else "needs") + " a block")
+            if command == "repeat":
+                count = _numbers(line_number, command, rest, 1, kind=int)[0]
+                if count < 0:
+                    raise PlaylistError(line_number, "repeat count must not be negative")
+                if count == 0:
+                    continue
+                loop = compiler.open_loop(count)
+                compile_block(block)
+                compiler.close_loop(loop, count)
+            elif command == "def":
+                raise PlaylistError(line_number, "'def' is only allowed at the top level")
+            elif command == "set":
+                compiler.click_set(rest, line_number)
+            elif command == "call":
+                if rest not in definitions:
+                    raise PlaylistError(line_number, f"unknown sub-set '{rest}'")
+                if rest in calling:
+                    raise PlaylistError(line_number, f"sub-set '{rest}' calls itself")
+                calling.append(rest)
+                compile_block(definitions[rest])
+                calling.pop()
+            elif command in ("click", "double", "right"):
+                x, y, *delay = _numbers(line_number, command, rest, 2, 1, kind=int)
+                op = {"click": OP_CLICK, "double": OP_DOUBLE, "right": OP_RIGHT}[command]
+                compiler.action(op, x, y, _seconds(line_number, command, delay[0]) if delay else compiler.delay)
+            elif command == "drag":
+                x1, y1, x2, y2, *extra = _numbers(line_number, command, rest, 4, 2, kind=int)
+                duration = _seconds(line_number, command, extra[0]) if extra else 0.0
+                compiler.action(OP_DRAG, x1, y1,
+                                _seconds(line_number, command, extra[1]) if len(extra) > 1 else compiler.delay,
+                                x2, y2, duration)
+            elif command == "wait":
+                compiler.program.emit(OP_WAIT, seconds=_seconds(
+                    line_number, command, _numbers(line_number, command, rest, 1)[0]))
+            elif command == "delay":
+                compiler.delay = _seconds(line_number, command, _numbers(line_number, command, rest, 1)[0])
+            elif command == "until":
+                compiler.until(*_parse_until(line_number, rest))
+            else:
+                raise PlaylistError(line_number, f"unknown command '{command}'")
+
+    compile_block(body)
+    return compiler.program
+
+# ================= THÔNG DỊCH =================
+def run_program(program, backend, stop_event):
+    """Chạy Program theo deadline tuyệt đối trên đồng hồ monotonic.
+
+    Lệnh thao tác thứ k được hẹn ở start + tổng thời gian chờ của các lệnh
+    trước nó, nên thời gian click tự nó tốn và độ trễ của sleep không cộng
+    dồn; bước nào bị trễ thì các bước sau đuổi kịp lịch. Vòng lặp chỉ đọc
+    mảng, không tra dict hay cấp phát theo từng bước. Set stop_event dừng
+    ngay cả khi đang chờ.
+
+    OP_UNTIL dò vùng nhỏ của điều kiện theo backend.poll_interval(vùng) tới
+    khi khớp, rồi tính lại lịch từ lúc đó: lệnh sau chạy ngay khi ứng dụng
+    sẵn sàng thay vì đợi hết delay cố định. Trả về báo cáo tốc độ và jitter.
+
+    Thống kê jitter có kích thước cố định (LatenessStats), nên số lần lặp
+    lớn tùy ý vẫn bắt đầu ngay.
+    """
+    spin, restore_timer = _fine_timer()
+    try:
+        return _run_program(program, backend, stop_event, spin)
+    finally:
+        restore_timer()
+
+def _run_program(program, backend, stop_event, spin):
+    ops, xs, ys = program.ops, program.x, program.y
+    x2s, y2s, seconds, durations = program.x2, program.y2, program.seconds, program.duration
+    refs, conditions = program.ref, program.conditions
+    click, drag = backend.click, backend.drag
+    perf_counter = time.perf_counter
+    condition_waits = 0
+    condition_wait = 0.0
+    timeouts = 0
+    lateness = LatenessStats()
+    record_lateness = lateness.add
+    counters = [0] * program.max_depth
+    depth = 0
+    pc = 0
+    end = len(ops)
+
+    start = perf_counter()
+    deadline = start
+    while pc < end:
+        op = ops[pc]
+        if op < OP_WAIT:
+            if sleep_until(deadline, stop_event, spin):
+                return schedule_report(start, deadline, lateness, True,
+                                       condition_waits, condition_wait, timeouts)
+            record_lateness(perf_counter() - deadline)
+            if op == OP_CLICK:
+                click(xs[pc], ys[pc])
+            elif op == OP_DOUBLE:
+                click(xs[pc], ys[pc], "left", 2)
+            elif op == OP_RIGHT:
+                click(xs[pc], ys[pc], "right")
+            else:
+                drag(xs[pc], ys[pc], x2s[pc], y2s[pc], durations[pc])
+            deadline += seconds[pc]
+        elif op == OP_WAIT:
+            deadline += seconds[pc]
+        elif op == OP_UNTIL:
+            if sleep_until(deadline, stop_event, spin):
+                return schedule_report(start, deadline, lateness, True,
+                                       condition_waits, condition_wait, timeouts)
+            condition = conditions[refs[pc]]
+            region = condition.region
+            poll = backend.poll_interval(region)
+            began = perf_counter()
+            limit = began + seconds[pc]
+            halted = False
+            while not condition.matches(backend.grab(region)):
+                if perf_counter() >= limit:
+                    timeouts += 1
+                    halted = not xs[pc]
+                    break
+                if stop_event.wait(poll):
+                    halted = True
+                    break
+            deadline = perf_counter()
+            condition_waits += 1
+            condition_wait += deadline - began
+            if halted:
+                return schedule_report(start, deadline, lateness, True,
+                                       condition_waits, condition_wait, timeouts)
+        elif op == OP_LOOP:
+            counters[depth] = xs[pc]
+            depth += 1
+        else:
+            counters[depth - 1] -= 1
+            if counters[depth - 1] > 0:
+                pc = xs[pc]
+                continue
+            depth -= 1
+        pc += 1
+    # Chờ hết thời gian chờ của lệnh cuối để thời lượng khớp với lịch
+    stopped = sleep_until(deadline, stop_event, spin)
+    return schedule_report(start, deadline, lateness, stopped,
+                           condition_waits, condition_wait, timeouts)
+
+# ================= ENGINE PHÁT LẠI =================
+class PlaybackEngine:
+    """Phát lại bộ nhấp trên một backend, không phụ thuộc GUI.
+
+    Chỉ có một luồng worker; start() khi đang chạy bị từ chối thay vì mở
+    thêm luồng click chồng lên nhau. stop() set một Event nên worker thức
+    dậy ngay cả khi đang chờ giữa hai click.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._jobs = queue.Queue()
+        self._running = False
+        self._worker = None
+
+    @property
+    def running(self):
+        return self._running
+
+    def play(self, program):
+        """Chạy đồng bộ trên luồng hiện tại; trả về báo cáo của run_program"""
+        self._stop.clear()
+        return run_program(program, self.backend, self._stop)
+
+    def start(self, program, on_done=None):
+        """Chạy trên luồng worker; on_done(report, error) được gọi trên luồng đó khi xong.
+
+        Trả về False nếu đang có lượt phát khác.
+        """
+        with self._lock:
+            if self._running:
+                return False
+            self._running = True
+            self._stop.clear()
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="playback", daemon=True)
+                self._worker.start()
+            self._jobs.put((program, on_done))
+        return True
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            program, on_done = job
+            report, error = None, None
+            try:
+                report = run_program(program, self.backend, self._stop)
+            except Exception as e:
+                error = e
+            finally:
+                with self._lock:
+                    self._running = False
+            if on_done is not None:
+                on_done(report, error)
+
+    def stop(self):
+        self._stop.set()
+
+    def close(self):
+        """Dừng lượt đang phát và kết thúc worker"""
+        self.stop()
+        if self._worker is not None:
+            self._jobs.put(None)
+            self._worker.join()
+            self._worker = None
+
+# ================= ĐIỀU PHỐI PHÍM NÓNG =================
+class HotkeyDispatcher:
+    """Một luồng duy nhất xử lý phím nóng qua hàng đợi lệnh.
+
+    Callback của backend chỉ đưa tên lệnh vào hàng đợi nên luồng nghe phím
+    không bao giờ bị chặn; handler chạy tuần tự trên luồng "hotkeys".
+    Handler đụng tới Tk phải tự chuyển sang luồng Tk bằng root.after.
+
+    Handler bind với immediate=True (ví dụ engine.stop, chỉ set một Event)
+    chạy ngay trong callback phím, không xếp hàng sau handler chậm như
+    chụp màu khi F8. Handler đó không được chặn.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.commands = queue.Queue()
+        self._handlers = {}
+        self._immediate = set()
+        self._thread = threading.Thread(target=self._run, name="hotkeys", daemon=True)
+        self._thread.start()
+
+    def bind(self, key, command, handler, immediate=False):
+        self._handlers[command] = handler
+        if immediate:
+            self._immediate.add(command)
+        self.backend.add_hotkey(key, lambda: self.post(command))
+
+    def post(self, command):
+        if command in self._immediate:
+            self._call(command)
+        else:
+            self.commands.put(command)
+
+    def _run(self):
+        while True:
+            command = self.commands.get()
+            if command is None:
+                return
+            self._call(command)
+
+    def _call(self, command):
+        handler = self._handlers.get(command)
+        if handler is None:
+            return
+        try:
+            handler()
+        except Exception as e:
+            print(f"WARNING: hotkey '{command}' failed: {e}")
+
+    def close(self):
+        self.backend.clear_hotkeys()
+        self.commands.put(None)
+        self._thread.join()
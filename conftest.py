@@ -0,0 +1,30 @@
+import pytest
+
+from class_taxonomy import ClassTaxonomy, parse_classes_text
+
+# ==========================
+# DỮ LIỆU DÙNG CHUNG CHO KIỂM THỬ
+# ==========================
+CLASSES_TEXT = """\
+1. English
+1.1. Lane
+1.1.1. Solid line
+1.1.2. Dashed line
+1.2. Others
+1.2.1. Pole
+2. Tiếng Việt
+2.1. Làn đường
+2.1.1. Vạch liền
+2.1.2. Vạch đứt
+2.2. Khác
+2.2.1. Cột điện
+"""
+
+def make_taxonomy(text=CLASSES_TEXT):
+    return ClassTaxonomy(**parse_classes_text(text))
+
+@pytest.fixture
+def classes_file(tmp_path):
+    path = tmp_path / "classes.txt"
+    path.write_text(CLASSES_TEXT, encoding="utf-8")
+    return str(path)
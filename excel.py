@@ -1,45 +1,70 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
-import pyautogui
-import time
-import threading
-import keyboard
 import json
 import copy
 
-click_sets = {}  # {'Tên bộ': [{'name': 'Tên vị trí', 'x': x, 'y': y}, ...]}
-is_clicking = False  # Dùng để dừng khi nhấn F9
+from click_engine import (HotkeyDispatcher, PlaybackEngine, PlaylistError, PyAutoGuiBackend,
+                          compile_playlist, compile_steps, condition_from_spec, format_color,
+                          format_schedule_report)
+
+click_sets = {}  # {'Tên bộ': [{'name': 'Tên vị trí', 'x': x, 'y': y, 'delay': giây (tùy chọn)}, ...]}
+# Vị trí có thể kèm 'until': {'x', 'y', 'color': '#RRGGBB', 'tolerance', 'timeout'} -
+# chờ pixel đó về đúng màu rồi mới click, thay vì chờ delay cố định
+
+# Backend chuột/phím, engine phát lại và luồng phím nóng - tạo trong main()
+backend = None
+engine = None
+dispatcher = None
+
+# Nội dung playlist đang soạn (giữ lại khi đóng cửa sổ playlist)
+playlist_text = ""
 
 # Lấy bộ đang chọn
 def get_current_set():
     return set_selector.get()
 
-# Lắng nghe phím F8 để thêm vị trí
-def listen_for_hotkeys():
-    while True:
-        keyboard.wait('F8')
-        x, y = pyautogui.position()
-        current_set = get_current_set()
-        if current_set:
-            name = position_name_entry.get().strip()
-            if not name:
-                name = f"Vị trí {len(click_sets[current_set]) + 1}"
-            click_sets[current_set].append({"name": name, "x": x, "y": y})
-            if get_current_set() == current_set:
-                update_position_list()
-        else:
-            messagebox.showwarning("Chưa chọn bộ", "Hãy chọn hoặc tạo một bộ nhấp trước.")
-
-# Lắng nghe phím F9 để dừng auto click
-def listen_for_stop():
-    global is_clicking
-    while True:
-        keyboard.wait('F9')
-        is_clicking = False
+# Phím F8 (luồng phím nóng): lấy vị trí chuột và màu pixel dưới chuột ngay,
+# phần còn lại chạy trên luồng Tk
+def on_capture_hotkey():
+    x, y = backend.position()
+    try:
+        color = tuple(backend.grab((x, y, 1, 1)))
+    except Exception as e:
+        print(f"WARNING: Không đọc được màu tại ({x}, {y}): {e}")
+        color = None
+    root.after(0, capture_position, x, y, color)
+
+# Thêm vị trí (x, y) vào bộ đang chọn - chỉ gọi trên luồng Tk
+def capture_position(x, y, color=None):
+    current_set = get_current_set()
+    if current_set:
+        name = position_name_entry.get().strip()
+        if not name:
+            name = f"Vị trí {len(click_sets[current_set]) + 1}"
+        item = {"name": name, "x": x, "y": y}
+        try:
+            item["delay"] = float(position_delay_entry.get())
+        except ValueError:
+            pass  # Để trống: dùng delay chung
+        if wait_color_var.get() and color is not None:
+            until = {"x": x, "y": y, "color": format_color(color), "tolerance": 8}
+            try:
+                until["timeout"] = float(wait_timeout_entry.get())
+            except ValueError:
+                pass  # Để trống: timeout mặc định
+            item["until"] = until
+        click_sets[current_set].append(item)
+        if get_current_set() == current_set:
+            update_position_list()
+    else:
+        messagebox.showwarning("Chưa chọn bộ", "Hãy chọn hoặc tạo một bộ nhấp trước.")
+
+# Phím F9: dừng auto click
+def stop_clicking():
+    engine.stop()
 
 # Bắt đầu click
 def start_clicking():
-    global is_clicking
     current_set = get_current_set()
     if not current_set or current_set not in click_sets:
         messagebox.showwarning("Lỗi", "Vui lòng chọn một bộ nhấp hợp lệ.")
@@ -51,28 +76,102 @@ def start_clicking():
     except ValueError:
         messagebox.showerror("Lỗi", "Delay và số lần lặp phải là số.")
         return
+    if delay < 0 or repeat < 0:
+        messagebox.showerror("Lỗi", "Delay và số lần lặp không được âm.")
+        return
 
     if not click_sets[current_set]:
         messagebox.showinfo("Trống", "Bộ nhấp hiện tại không có vị trí nào.")
         return
 
-    is_clicking = True
-
-    def click_loop():
-        nonlocal repeat
-        for r in range(repeat):
-            if not is_clicking:
-                break
-            for item in click_sets[current_set]:
-                if not is_clicking:
-                    break
-                x = item.get("x", 0)
-                y = item.get("y", 0)
-                pyautogui.click(x, y)
-                time.sleep(delay)
-        print("Kết thúc auto click.")
-
-    threading.Thread(target=click_loop, daemon=True).start()
+    # Delay riêng của từng vị trí, nếu có, thay cho delay chung
+    # và điều kiện chờ màu, nếu có. File JSON sửa tay có thể chứa giá trị hỏng.
+    steps = []
+    for item in click_sets[current_set]:
+        try:
+            x, y = int(item.get("x", 0)), int(item.get("y", 0))
+            item_delay = float(item.get("delay", delay))
+            if item_delay < 0:
+                raise ValueError(f"delay âm ({item_delay})")
+            until = item.get("until")
+            if until:
+                condition_from_spec(until)
+        except (TypeError, ValueError) as e:
+            messagebox.showerror("Lỗi", f"Vị trí '{item.get('name', 'Không tên')}' không hợp lệ: {e}")
+            return
+        steps.append((x, y, item_delay, until))
+
+    start_program(compile_steps(steps, repeat))
+
+def start_program(program):
+    if not engine.start(program, on_done=on_playback_done):
+        messagebox.showwarning("Đang chạy", "Auto click đang chạy. Nhấn F9 để dừng trước.")
+
+# Cửa sổ soạn và chạy playlist (ghép nhiều bộ nhấp thành một lượt chạy)
+def open_playlist_window():
+    window = tk.Toplevel(root)
+    window.title("📜 Playlist")
+    window.geometry("460x520")
+
+    tk.Label(window, text=(
+        "set <bộ> | click/double/right X Y [delay] | drag X1 Y1 X2 Y2 [thời gian] [delay]\n"
+        "wait S | delay S | repeat N { ... } | def <tên> { ... } | call <tên>\n"
+        "until pixel X Y RRGGBB [sai số] [timeout] | until region X Y W H HASH [timeout]"),
+        fg="gray", justify=tk.LEFT).pack(pady=5)
+    editor = tk.Text(window, width=55, height=22, undo=True)
+    editor.insert("1.0", playlist_text)
+    editor.pack(pady=5, fill=tk.BOTH, expand=True)
+
+    def remember_text(event=None):
+        global playlist_text
+        playlist_text = editor.get("1.0", "end-1c")
+
+    def run_playlist():
+        remember_text()
+        try:
+            delay = float(delay_entry.get())
+        except ValueError:
+            delay = -1
+        if delay < 0:
+            messagebox.showerror("Lỗi", "Delay phải là số không âm.", parent=window)
+            return
+        try:
+            program = compile_playlist(playlist_text, click_sets, delay)
+        except PlaylistError as e:
+            messagebox.showerror("Lỗi playlist", str(e), parent=window)
+            return
+        if not program.actions:
+            messagebox.showinfo("Trống", "Playlist không có thao tác nào.", parent=window)
+            return
+        start_program(program)
+
+    def save_playlist():
+        remember_text()
+        path = filedialog.asksaveasfilename(defaultextension=".txt", filetypes=[("Playlist", "*.txt")], parent=window)
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(playlist_text)
+
+    def load_playlist():
+        path = filedialog.askopenfilename(filetypes=[("Playlist", "*.txt")], parent=window)
+        if path:
+            with open(path, 'r', encoding='utf-8') as f:
+                editor.delete("1.0", tk.END)
+                editor.insert("1.0", f.read())
+            remember_text()
+
+    editor.bind("<KeyRelease>", remember_text)
+    tk.Button(window, text="▶️ Chạy playlist", command=run_playlist).pack(pady=2)
+    tk.Button(window, text="💾 Lưu playlist", command=save_playlist).pack(pady=2)
+    tk.Button(window, text="📂 Mở playlist", command=load_playlist).pack(pady=2)
+
+# Kết thúc một lượt phát (luồng worker)
+def on_playback_done(report, error):
+    if error is not None:
+        print(f"Auto click lỗi: {error}")
+        return
+    print("Kết thúc auto click.")
+    print(format_schedule_report(report))
 
 # Tạo bộ nhấp mới
 def create_new_set():
@@ -133,7 +232,13 @@ def update_position_list(event=None):
             name = item.get("name", "Không tên")
             x = item.get("x", 0)
             y = item.get("y", 0)
-            position_list.insert(tk.END, f"{name} - ({x}, {y})")
+            if "delay" in item:
+                label = f"{name} - ({x}, {y}) - {item['delay']}s"
+            else:
+                label = f"{name} - ({x}, {y})"
+            if item.get("until"):
+                label += f" - ⏳ {item['until'].get('color', 'vùng')}"
+            position_list.insert(tk.END, label)
 
 # Cập nhật combobox chọn bộ
 def update_set_selector():
@@ -167,60 +272,88 @@ def load_from_file():
             messagebox.showerror("Lỗi", f"Không thể đọc file: {e}")
 
 # ================= GUI =================
-root = tk.Tk()
-root.title("🖱️ Auto Clicker Nâng Cao (F8: Thêm, F9: Dừng)")
-root.geometry("500x720")
-
-# --- Tạo/Xoá bộ ---
-tk.Label(root, text="Tên bộ nhấp mới:").pack()
-new_set_entry = tk.Entry(root)
-new_set_entry.pack(pady=5)
-
-# ✅ Checkbox: sao chép từ bộ hiện tại
-copy_from_current_var = tk.BooleanVar()
-tk.Checkbutton(root, text="✅ Sao chép vị trí từ bộ hiện tại", variable=copy_from_current_var).pack()
-
-tk.Button(root, text="➕ Tạo bộ mới", command=create_new_set).pack(pady=2)
-tk.Button(root, text="🗑️ Xoá bộ hiện tại", command=delete_set).pack(pady=2)
-
-# --- Chọn bộ ---
-tk.Label(root, text="Chọn bộ nhấp:").pack()
-set_selector = ttk.Combobox(root, state="readonly")
-set_selector.pack(pady=5)
-set_selector.bind("<<ComboboxSelected>>", update_position_list)
-
-# --- Nhập tên vị trí ---
-tk.Label(root, text="Tên vị trí mới:").pack()
-position_name_entry = tk.Entry(root)
-position_name_entry.pack(pady=5)
-
-# --- Danh sách vị trí ---
-position_list = tk.Listbox(root, width=50, height=10, selectmode=tk.MULTIPLE)
-position_list.pack(pady=5)
-tk.Button(root, text="❌ Xoá vị trí đã chọn", command=delete_selected_positions).pack(pady=2)
-
-# --- Delay và lặp lại ---
-tk.Label(root, text="Delay giữa các click (giây):").pack()
-delay_entry = tk.Entry(root)
-delay_entry.insert(0, "0.5")
-delay_entry.pack(pady=2)
-
-tk.Label(root, text="Số lần lặp lại toàn bộ bộ nhấp:").pack()
-repeat_entry = tk.Entry(root)
-repeat_entry.insert(0, "1")
-repeat_entry.pack(pady=2)
-
-# --- Nút thao tác ---
-tk.Button(root, text="▶️ Bắt đầu Click", command=start_clicking).pack(pady=10)
-
-tk.Label(root, text="💡 Nhấn F8 để thêm vị trí chuột.\n⛔ Nhấn F9 để dừng auto click.", fg="gray").pack(pady=5)
-
-# --- Lưu / Mở file ---
-tk.Button(root, text="💾 Lưu bộ nhấp ra file", command=save_to_file).pack(pady=2)
-tk.Button(root, text="📂 Mở file bộ nhấp", command=load_from_file).pack(pady=2)
-
-# --- Khởi chạy luồng lắng nghe phím nóng ---
-threading.Thread(target=listen_for_hotkeys, daemon=True).start()
-threading.Thread(target=listen_for_stop, daemon=True).start()
-
-root.mainloop()
+def main():
+    global backend, engine, dispatcher, root, new_set_entry, copy_from_current_var, set_selector
+    global position_name_entry, position_delay_entry, position_list, delay_entry, repeat_entry
+    global wait_color_var, wait_timeout_entry
+
+    backend = PyAutoGuiBackend()
+    engine = PlaybackEngine(backend)
+    dispatcher = HotkeyDispatcher(backend)
+
+    root = tk.Tk()
+    root.title("🖱️ Auto Clicker Nâng Cao (F8: Thêm, F9: Dừng)")
+    root.geometry("500x800")
+
+    # --- Tạo/Xoá bộ ---
+    tk.Label(root, text="Tên bộ nhấp mới:").pack()
+    new_set_entry = tk.Entry(root)
+    new_set_entry.pack(pady=5)
+
+    # ✅ Checkbox: sao chép từ bộ hiện tại
+    copy_from_current_var = tk.BooleanVar()
+    tk.Checkbutton(root, text="✅ Sao chép vị trí từ bộ hiện tại", variable=copy_from_current_var).pack()
+
+    tk.Button(root, text="➕ Tạo bộ mới", command=create_new_set).pack(pady=2)
+    tk.Button(root, text="🗑️ Xoá bộ hiện tại", command=delete_set).pack(pady=2)
+
+    # --- Chọn bộ ---
+    tk.Label(root, text="Chọn bộ nhấp:").pack()
+    set_selector = ttk.Combobox(root, state="readonly")
+    set_selector.pack(pady=5)
+    set_selector.bind("<<ComboboxSelected>>", update_position_list)
+
+    # --- Nhập tên vị trí ---
+    tk.Label(root, text="Tên vị trí mới:").pack()
+    position_name_entry = tk.Entry(root)
+    position_name_entry.pack(pady=5)
+
+    tk.Label(root, text="Delay riêng cho vị trí mới (giây, để trống = dùng delay chung):").pack()
+    position_delay_entry = tk.Entry(root)
+    position_delay_entry.pack(pady=2)
+
+    # ⏳ Checkbox: chờ pixel tại vị trí về đúng màu lúc nhấn F8 rồi mới click
+    wait_color_var = tk.BooleanVar()
+    tk.Checkbutton(root, text="⏳ Chờ màu tại vị trí trước khi click", variable=wait_color_var).pack()
+    tk.Label(root, text="Thời gian chờ màu tối đa (giây, hết giờ thì dừng):").pack()
+    wait_timeout_entry = tk.Entry(root)
+    wait_timeout_entry.insert(0, "5")
+    wait_timeout_entry.pack(pady=2)
+
+    # --- Danh sách vị trí ---
+    position_list = tk.Listbox(root, width=50, height=10, selectmode=tk.MULTIPLE)
+    position_list.pack(pady=5)
+    tk.Button(root, text="❌ Xoá vị trí đã chọn", command=delete_selected_positions).pack(pady=2)
+
+    # --- Delay và lặp lại ---
+    tk.Label(root, text="Delay giữa các click (giây):").pack()
+    delay_entry = tk.Entry(root)
+    delay_entry.insert(0, "0.5")
+    delay_entry.pack(pady=2)
+
+    tk.Label(root, text="Số lần lặp lại toàn bộ bộ nhấp:").pack()
+    repeat_entry = tk.Entry(root)
+    repeat_entry.insert(0, "1")
+    repeat_entry.pack(pady=2)
+
+    # --- Nút thao tác ---
+    tk.Button(root, text="▶️ Bắt đầu Click", command=start_clicking).pack(pady=(10, 2))
+    tk.Button(root, text="📜 Playlist (ghép nhiều bộ)", command=open_playlist_window).pack(pady=(2, 10))
+
+    tk.Label(root, text="💡 Nhấn F8 để thêm vị trí chuột.\n⛔ Nhấn F9 để dừng auto click.", fg="gray").pack(pady=5)
+
+    # --- Lưu / Mở file ---
+    tk.Button(root, text="💾 Lưu bộ nhấp ra file", command=save_to_file).pack(pady=2)
+    tk.Button(root, text="📂 Mở file bộ nhấp", command=load_from_file).pack(pady=2)
+
+    # --- Phím nóng ---
+    dispatcher.bind('F8', "capture", on_capture_hotkey)
+    # F9 chạy ngay trong callback phím (chỉ set Event), không chờ sau F8 đang chụp màu
+    dispatcher.bind('F9', "stop", stop_clicking, immediate=True)
+
+    root.mainloop()
+    dispatcher.close()
+    engine.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,650 @@
+import argparse
+import glob
+import hashlib
+import math
+import os
+import re
+import stat
+import struct
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# ==========================
+# ĐỌC GPX - STREAMING (ITERPARSE)
+# ==========================
+# Cache nhị phân: header + segments int64 + wpt lat/lon, trkpt lat/lon float64
+ROUTE_CACHE_DIR = ".route_cache"
+ROUTE_CACHE_SUFFIX = ".route"
+ROUTE_CACHE_MAGIC = b"GPXROUT1"
+_HEADER = struct.Struct("<8sqqq")
+# umask đọc một lần lúc import: os.umask() đổi giá trị chung của process
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+def _local_name(tag):
+    """Bỏ namespace: '{http://www.topografix.com/GPX/1/1}trkpt' → 'trkpt'"""
+    return tag.rsplit("}", 1)[-1]
+
+def parse_gpx(path):
+    """Đọc waypoint và track point của một file GPX bằng iterparse.
+
+    Mỗi phần tử được xóa khỏi cây ngay sau khi đọc, nên bộ nhớ không phụ
+    thuộc kích thước file. Trả về (wpt_lat, wpt_lon, lat, lon, segments)
+    dạng array('d') / array('q'); segments là vị trí bắt đầu của từng
+    trkseg trong mảng track point.
+    """
+    wpt_lat, wpt_lon = array("d"), array("d")
+    lat, lon = array("d"), array("d")
+    segments = array("q")
+    stack = []
+    for event, elem in ET.iterparse(path, events=("start", "end")):
+        if event == "start":
+            stack.append(elem)
+            if _local_name(elem.tag) == "trkseg":
+                segments.append(len(lat))
+            continue
+
+        stack.pop()
+        name = _local_name(elem.tag)
+        if name == "trkpt" or name == "rtept":
+            lat.append(float(elem.get("lat")))
+            lon.append(float(elem.get("lon")))
+        elif name == "wpt":
+            wpt_lat.append(float(elem.get("lat")))
+            wpt_lon.append(float(elem.get("lon")))
+        else:
+            continue
+        # Bỏ các phần tử đã đọc khỏi cha (giữ attrib của cha)
+        if stack:
+            del stack[-1][:]
+
+    if lat and not segments:
+        # rtept không nằm trong trkseg - coi cả route là một đoạn
+        segments.append(0)
+    return wpt_lat, wpt_lon, lat, lon, segments
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+# ==========================
+# ROUTE - MẢNG TỌA ĐỘ MEMORY-MAPPED
+# ==========================
+class Route:
+    """Tọa độ của một file GPX dưới dạng mảng float64 liên tục.
+
+    Khi mở từ cache, các mảng là view chỉ-đọc của file được memory-map nên
+    mở lại gần như tức thì và chỉ trang nào được dùng mới được đọc vào.
+    """
+
+    def __init__(self, path, digest, wpt_lat, wpt_lon, lat, lon, segments):
+        self.path = path
+        self.digest = digest
+        self.wpt_lat = wpt_lat
+        self.wpt_lon = wpt_lon
+        self.lat = lat
+        self.lon = lon
+        self.segments = segments
+
+    @property
+    def name(self):
+        return os.path.splitext(os.path.basename(self.path))[0]
+
+    def __len__(self):
+        return len(self.lat)
+
+    def __repr__(self):
+        return f"Route({self.name!r}, {len(self.wpt_lat)} waypoints, {len(self.lat)} track points)"
+
+def write_route_cache(cache_path, wpt_lat, wpt_lon, lat, lon, segments):
+    """Ghi file cache nguyên tử (file tạm + os.replace)"""
+    directory = os.path.dirname(os.path.abspath(cache_path))
+    fd, tmp_path = tempfile.mkstemp(suffix=ROUTE_CACHE_SUFFIX, dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_HEADER.pack(ROUTE_CACHE_MAGIC, len(wpt_lat), len(lat), len(segments)))
+            for values in (segments, wpt_lat, wpt_lon, lat, lon):
+                if sys.byteorder != "little":
+                    values = array(values.typecode, values)
+                    values.byteswap()
+                values.tofile(f)
+        # mkstemp tạo file 0600 - giữ quyền của file cũ hoặc theo umask như open()
+        try:
+            mode = stat.S_IMODE(os.stat(cache_path).st_mode)
+        except FileNotFoundError:
+            mode = 0o666 & ~_UMASK
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, cache_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def open_route_cache(cache_path, path=None, digest=None):
+    """Memory-map file cache; trả về Route hoặc None nếu file hỏng/không đúng định dạng"""
+    try:
+        size = os.path.getsize(cache_path)
+        if size < _HEADER.size:
+            return None
+        buffer = np.memmap(cache_path, dtype=np.uint8, mode="r")
+    except (OSError, ValueError):
+        return None
+
+    magic, n_wpt, n_trk, n_seg = _HEADER.unpack_from(buffer, 0)
+    if magic != ROUTE_CACHE_MAGIC or size != _HEADER.size + 8 * (n_seg + 2 * n_wpt + 2 * n_trk):
+        return None
+
+    offset = _HEADER.size
+    segments = np.frombuffer(buffer, dtype="<i8", count=n_seg, offset=offset)
+    offset += 8 * n_seg
+    arrays = []
+    for count in (n_wpt, n_wpt, n_trk, n_trk):
+        arrays.append(np.frombuffer(buffer, dtype="<f8", count=count, offset=offset))
+        offset += 8 * count
+    return Route(path or cache_path, digest, *arrays, segments)
+
+class RouteCache:
+    """Cache route theo hash nội dung file GPX.
+
+    File GPX giống nhau (dù khác tên) dùng chung một file cache; file bị
+    sửa thì hash đổi và được đọc lại.
+    """
+
+    def __init__(self, cache_dir=ROUTE_CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def cache_path(self, digest):
+        return os.path.join(self.cache_dir, digest + ROUTE_CACHE_SUFFIX)
+
+    def load(self, path, digest=None):
+        """Mở route từ cache, đọc GPX và ghi cache nếu chưa có"""
+        if digest is None:
+            digest = file_digest(path)
+        cache_path = self.cache_path(digest)
+        route = open_route_cache(cache_path, path, digest)
+        if route is not None:
+            return route
+
+        data = parse_gpx(path)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            write_route_cache(cache_path, *data)
+        except OSError:
+            # Không ghi được cache - vẫn trả về route đọc từ GPX
+            wpt_lat, wpt_lon, lat, lon, segments = (np.frombuffer(values, dtype=values.typecode)
+                                                    for values in data)
+            return Route(path, digest, wpt_lat, wpt_lon, lat, lon, segments)
+        return open_route_cache(cache_path, path, digest)
+
+    def load_many(self, paths, workers=None):
+        """Nạp nhiều route; chỉ các file chưa có cache mới được đọc song song
+        ở process con, nên lần chạy lại không tạo process nào"""
+        paths = list(paths)
+        digests = [file_digest(path) for path in paths]
+        routes = [open_route_cache(self.cache_path(digest), path, digest)
+                  for path, digest in zip(paths, digests)]
+        missing = [i for i, route in enumerate(routes) if route is None]
+
+        # File trùng nội dung chỉ cần đọc một lần
+        pending = {digests[i]: paths[i] for i in missing}
+        if len(pending) > 1 and workers != 1:
+            max_workers = min(workers or os.cpu_count() or 1, len(pending))
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                # Process con chỉ ghi cache; process chính mở lại bằng mmap
+                list(executor.map(_warm_cache, pending.values(), pending.keys(),
+                                  [self.cache_dir] * len(pending), chunksize=4))
+        for i in missing:
+            routes[i] = self.load(paths[i], digests[i])
+        return routes
+
+def _warm_cache(path, digest, cache_dir):
+    RouteCache(cache_dir).load(path, digest)
+
+def expand_route_paths(paths):
+    """File, thư mục hoặc pattern glob → danh sách .gpx"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            matches = glob.glob(os.path.join(path, "*.gpx"))
+        elif glob.has_magic(path):
+            matches = glob.glob(path)
+        else:
+            matches = [path]
+        files.extend(sorted(matches))
+    return files
+
+# ==========================
+# TỌA ĐỘ - DMS HOẶC THẬP PHÂN
+# ==========================
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEGREE = EARTH_RADIUS_M * math.pi / 180
+
+# 35°31'46.42"N, 35°31.5'N, 35°N, 35.5295, -35.5, 35.5N
+_COORD_RE = re.compile(
+    r"""([-+]?\d+(?:\.\d+)?)\s*
+        (?:[°º]\s*
+           (?:(\d+(?:\.\d+)?)\s*['′’]\s*
+              (?:(\d+(?:\.\d+)?)\s*(?:["″”]|'')\s*)?
+           )?
+        )?
+        ([NSEWnsew])?""",
+    re.VERBOSE)
+_COORD_SEPARATORS_RE = re.compile(r"[\s,;/]*")
+
+def parse_coordinate(text):
+    """Đọc một cặp tọa độ DMS hoặc thập phân, trả về (lat, lon) độ thập phân.
+
+    Chấp nhận '35°31'46.42"N 139°44'19.88"E' (có thể xuống dòng giữa hai
+    phần), '35.5295, 139.7388' hoặc '-33.9 151.2'. Có chữ N/S/E/W thì thứ
+    tự tùy ý; không có thì phần đầu là lat. Lỗi định dạng → ValueError.
+    """
+    parts = []
+    rest = []
+    position = 0
+    for match in _COORD_RE.finditer(text):
+        rest.append(text[position:match.start()])
+        position = match.end()
+        degrees, minutes, seconds, hemisphere = match.groups()
+        value = abs(float(degrees)) + float(minutes or 0) / 60 + float(seconds or 0) / 3600
+        if degrees.startswith("-"):
+            value = -value
+        parts.append((value, hemisphere.upper() if hemisphere else None))
+    rest.append(text[position:])
+    if len(parts) != 2 or not all(_COORD_SEPARATORS_RE.fullmatch(piece) for piece in rest):
+        raise ValueError(f"not a coordinate pair: {text.strip()!r}")
+
+    if parts[0][1] in ("E", "W") or parts[1][1] in ("N", "S"):
+        parts.reverse()
+    (lat, lat_hemisphere), (lon, lon_hemisphere) = parts
+    if lat_hemisphere not in (None, "N", "S") or lon_hemisphere not in (None, "E", "W"):
+        raise ValueError(f"conflicting hemispheres in {text.strip()!r}")
+    if lat_hemisphere == "S":
+        lat = -lat
+    if lon_hemisphere == "W":
+        lon = -lon
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError(f"coordinate out of range: {text.strip()!r}")
+    return lat, lon
+
+def parse_coordinate_lines(lines):
+    """Đọc nhiều tọa độ, mỗi dòng một cặp; cặp DMS bị xuống dòng giữa lat và lon vẫn được ghép"""
+    coordinates = []
+    pending = ""
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        text = f"{pending} {line}" if pending else line
+        try:
+            coordinates.append(parse_coordinate(text))
+            pending = ""
+        except ValueError:
+            if pending:
+                raise
+            pending = line
+    if pending:
+        raise ValueError(f"not a coordinate pair: {pending!r}")
+    return coordinates
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Khoảng cách (m) theo haversine; nhận số hoặc mảng numpy (broadcast)"""
+    lat1, lon1, lat2, lon2 = (np.radians(value) for value in (lat1, lon1, lat2, lon2))
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+def _unit_vectors(lat, lon):
+    """(x, y, z) trên mặt cầu đơn vị của các điểm lat/lon (độ)"""
+    lat, lon = np.radians(lat), np.radians(lon)
+    cos_lat = np.cos(lat)
+    return cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)
+
+# ==========================
+# SỐ ĐO ROUTE - VECTOR HÓA
+# ==========================
+def step_lengths_m(route):
+    """Độ dài (m) từng bước giữa hai track point liên tiếp.
+
+    Bước nối cuối đoạn này với đầu đoạn sau (giữa hai trkseg) được tính là 0.
+    """
+    if len(route.lat) < 2:
+        return np.zeros(0)
+    steps = haversine_m(route.lat[:-1], route.lon[:-1], route.lat[1:], route.lon[1:])
+    boundaries = np.asarray(route.segments[1:], dtype=np.int64) - 1
+    steps[boundaries[(boundaries >= 0) & (boundaries < len(steps))]] = 0.0
+    return steps
+
+def route_metrics(route):
+    """Thống kê một route: độ dài, số điểm, số đoạn, bước dài nhất và trung bình"""
+    steps = step_lengths_m(route)
+    moving = steps[steps > 0]
+    return {
+        "length_m": float(steps.sum()),
+        "points": len(route.lat),
+        "segments": len(route.segments),
+        "max_step_m": float(moving.max()) if len(moving) else 0.0,
+        "mean_step_m": float(moving.mean()) if len(moving) else 0.0,
+    }
+
+def density_per_km(counts, length_m):
+    """Số đếm / km cho cả mảng counts; None nếu route không có độ dài"""
+    if length_m <= 0:
+        return None
+    return np.asarray(counts, dtype=np.float64) * (1000.0 / length_m)
+
+# ==========================
+# INDEX KHÔNG GIAN - LƯỚI Ô ĐỀU TRÊN TẤT CẢ ROUTE
+# ==========================
+_CELL_OFFSET = 1 << 20
+_CELL_STRIDE = 1 << 22
+
+class RouteIndex:
+    """Lưới ô lat/lon đều trên track point của nhiều route.
+
+    Điểm được sắp theo ô và mỗi ô giữ một khoảng liên tục (start, end) trong
+    các mảng đã sắp, nên một truy vấn chỉ đọc vài ô quanh điểm cần tìm rồi
+    tính haversine vector hóa trên các điểm đó.
+    """
+
+    def __init__(self, routes, cell_deg=0.005):
+        self.routes = list(routes)
+        self.cell_deg = cell_deg
+        sizes = [len(route) for route in self.routes]
+        if self.routes:
+            lat = np.concatenate([route.lat for route in self.routes])
+            lon = np.concatenate([route.lon for route in self.routes])
+        else:
+            lat = lon = np.empty(0)
+        route_ids = np.repeat(np.arange(len(self.routes), dtype=np.int32), sizes)
+        point_ids = np.concatenate([np.arange(size, dtype=np.int64) for size in sizes]) if sizes else np.empty(0, np.int64)
+
+        keys = self._cell_keys(np.floor(lat / cell_deg), np.floor(lon / cell_deg))
+        order = np.argsort(keys, kind="stable")
+        self.lat = np.ascontiguousarray(lat[order])
+        self.lon = np.ascontiguousarray(lon[order])
+        self.route_ids = route_ids[order]
+        self.point_ids = point_ids[order]
+
+        sorted_keys = keys[order]
+        unique, starts = np.unique(sorted_keys, return_index=True)
+        ends = np.append(starts[1:], len(sorted_keys))
+        self.cells = dict(zip(unique.tolist(), zip(starts.tolist(), ends.tolist())))
+        # Cùng bảng ô dạng mảng để tra cả lô bằng searchsorted (nearest_many)
+        self._cell_key_array = unique
+        self._cell_starts = starts.astype(np.int64)
+        self._cell_ends = ends.astype(np.int64)
+        # Vector đơn vị của từng điểm: khoảng cách dây cung tăng cùng khoảng cách
+        # haversine, nên nearest_many so sánh được mà không cần hàm lượng giác
+        self._x, self._y, self._z = _unit_vectors(self.lat, self.lon)
+        if len(lat):
+            self._lat_cells = (int(np.floor(lat.min() / cell_deg)), int(np.floor(lat.max() / cell_deg)))
+            self._lon_cells = (int(np.floor(lon.min() / cell_deg)), int(np.floor(lon.max() / cell_deg)))
+
+    @staticmethod
+    def _cell_keys(cell_lat, cell_lon):
+        return (np.asarray(cell_lat, dtype=np.int64) + _CELL_OFFSET) * _CELL_STRIDE + \
+            (np.asarray(cell_lon, dtype=np.int64) + _CELL_OFFSET)
+
+    def __len__(self):
+        return len(self.lat)
+
+    def _candidates(self, lat, lon, radius_m):
+        """Chỉ số (trong mảng đã sắp) của các điểm nằm trong các ô có thể cách ≤ radius_m"""
+        cell_lat = math.floor(lat / self.cell_deg)
+        cell_lon = math.floor(lon / self.cell_deg)
+        span_lat = int(math.ceil(radius_m / (self.cell_deg * METERS_PER_DEGREE)))
+        # Ô theo kinh độ hẹp dần về phía cực
+        cos_lat = math.cos(math.radians(min(abs(lat) + span_lat * self.cell_deg, 90.0)))
+        span_lon = int(math.ceil(radius_m / (self.cell_deg * METERS_PER_DEGREE * max(cos_lat, 1e-9))))
+
+        lat_range = range(max(cell_lat - span_lat, self._lat_cells[0]), min(cell_lat + span_lat, self._lat_cells[1]) + 1)
+        lon_range = range(max(cell_lon - span_lon, self._lon_cells[0]), min(cell_lon + span_lon, self._lon_cells[1]) + 1)
+        if len(lat_range) * len(lon_range) > len(self.cells):
+            # Vùng tìm rộng hơn số ô có điểm - duyệt thẳng danh sách ô
+            keys = self._cell_keys(np.arange(lat_range.start, lat_range.stop)[:, None],
+                                   np.arange(lon_range.start, lon_range.stop)[None, :])
+            wanted = set(keys.ravel().tolist()) & self.cells.keys()
+            slices = [self.cells[key] for key in wanted]
+        else:
+            cells = self.cells
+            slices = []
+            for row in lat_range:
+                base = (row + _CELL_OFFSET) * _CELL_STRIDE + _CELL_OFFSET
+                for column in lon_range:
+                    cell = cells.get(base + column)
+                    if cell is not None:
+                        slices.append(cell)
+        if not slices:
+            return np.empty(0, dtype=np.int64)
+        if len(slices) == 1:
+            return np.arange(*slices[0])
+        # Nối các khoảng [start, end) không cần vòng lặp Python
+        bounds = np.array(slices, dtype=np.int64)
+        lengths = bounds[:, 1] - bounds[:, 0]
+        shifts = bounds[:, 0] - (np.cumsum(lengths) - lengths)
+        return np.arange(int(lengths.sum()), dtype=np.int64) + np.repeat(shifts, lengths)
+
+    def within(self, lat, lon, radius_m):
+        """Mọi điểm cách (lat, lon) không quá radius_m.
+
+        Trả về (route_ids, point_ids, distances) sắp theo khoảng cách tăng dần.
+        """
+        if not len(self.lat):
+            return np.empty(0, np.int32), np.empty(0, np.int64), np.empty(0)
+        candidates = self._candidates(lat, lon, radius_m)
+        distances = haversine_m(lat, lon, self.lat[candidates], self.lon[candidates])
+        mask = distances <= radius_m
+        candidates, distances = candidates[mask], distances[mask]
+        order = np.argsort(distances, kind="stable")
+        candidates = candidates[order]
+        return self.route_ids[candidates], self.point_ids[candidates], distances[order]
+
+    def nearest(self, lat, lon, max_distance_m=None):
+        """Điểm gần nhất: (route_id, point_id, khoảng cách m) hoặc None"""
+        if not len(self.lat):
+            return None
+        # Mở rộng dần vùng tìm tới khi gặp điểm, rồi tìm lại trong bán kính đó để chắc chắn
+        step = self.cell_deg * METERS_PER_DEGREE
+        radius = step
+        limit = max_distance_m if max_distance_m is not None else math.inf
+        while True:
+            candidates = self._candidates(lat, lon, min(radius, limit))
+            if len(candidates) or radius >= limit or radius > 4 * EARTH_RADIUS_M:
+                break
+            radius *= 2
+        if not len(candidates):
+            if max_distance_m is not None:
+                return None
+            candidates = np.arange(len(self.lat))
+        distances = haversine_m(lat, lon, self.lat[candidates], self.lon[candidates])
+        best = float(distances.min())
+        if best > min(radius, limit):
+            # Điểm tìm được nằm ở góc ô - có thể còn điểm gần hơn ở ô chưa xét
+            candidates = self._candidates(lat, lon, best)
+            distances = haversine_m(lat, lon, self.lat[candidates], self.lon[candidates])
+        i = int(np.argmin(distances))
+        if max_distance_m is not None and distances[i] > max_distance_m:
+            return None
+        point = candidates[i]
+        return int(self.route_ids[point]), int(self.point_ids[point]), float(distances[i])
+
+    # Số cặp (truy vấn, điểm) tối đa so sánh trong một lượt của nearest_many
+    NEAREST_BATCH_PAIRS = 1 << 20
+    # Nửa cạnh (số ô) của các khối nearest_many thử lần lượt trước khi về nearest()
+    NEAREST_SPANS = (1, 4)
+
+    def _nearest_in_block(self, lats, lons, span):
+        """Điểm gần nhất trong khối (2·span+1)² ô quanh từng truy vấn, vector hóa.
+
+        Trả về (chỉ số điểm trong mảng đã sắp hoặc -1, khoảng cách hoặc inf).
+        """
+        count = len(lats)
+        side = 2 * span + 1
+        offsets = np.arange(-span, span + 1, dtype=np.int64)
+        keys = self._cell_keys(np.floor(lats / self.cell_deg)[:, None] + np.repeat(offsets, side)[None, :],
+                               np.floor(lons / self.cell_deg)[:, None] + np.tile(offsets, side)[None, :]).ravel()
+        slots = np.minimum(np.searchsorted(self._cell_key_array, keys), len(self._cell_key_array) - 1)
+        found = self._cell_key_array[slots] == keys
+        starts = np.where(found, self._cell_starts[slots], 0)
+        lengths = np.where(found, self._cell_ends[slots] - starts, 0)
+
+        # Nối các khoảng [start, end) của mọi ô thành một mảng; cặp của cùng
+        # một truy vấn nằm liền nhau theo thứ tự truy vấn
+        shifts = starts - (np.cumsum(lengths) - lengths)
+        points = np.arange(int(lengths.sum()), dtype=np.int64) + np.repeat(shifts, lengths)
+        per_query = lengths.reshape(count, side * side).sum(axis=1)
+
+        best_points = np.full(count, -1, dtype=np.int64)
+        best_distances = np.full(count, np.inf)
+        owners = np.flatnonzero(per_query)
+        if not len(owners):
+            return best_points, best_distances
+
+        x, y, z = _unit_vectors(lats, lons)
+        queries = np.repeat(np.arange(count), per_query)
+        chords = ((self._x[points] - x[queries]) ** 2 + (self._y[points] - y[queries]) ** 2
+                  + (self._z[points] - z[queries]) ** 2)
+        firsts = np.cumsum(per_query) - per_query
+        nearest = np.minimum.reduceat(chords, firsts[owners])
+        # Vị trí đầu tiên đạt min trong từng đoạn
+        candidates = np.flatnonzero(chords == np.repeat(nearest, per_query[owners]))
+        _, first = np.unique(queries[candidates], return_index=True)
+        chosen = points[candidates[first]]
+        best_points[owners] = chosen
+        best_distances[owners] = haversine_m(lats[owners], lons[owners], self.lat[chosen], self.lon[chosen])
+        return best_points, best_distances
+
+    def nearest_many(self, lats, lons, max_distance_m=None):
+        """nearest() cho cả lô; route_id = -1 và khoảng cách = inf khi không có điểm.
+
+        Tra một khối ô quanh mọi truy vấn cùng lúc bằng numpy. Kết quả chỉ
+        được nhận khi khoảng cách nằm gọn trong khối (cùng điều kiện với
+        _candidates); truy vấn còn lại thử khối lớn hơn, xa hơn nữa mới đi
+        qua nearest() từng điểm.
+        """
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        count = len(lats)
+        route_ids = np.full(count, -1, dtype=np.int32)
+        point_ids = np.full(count, -1, dtype=np.int64)
+        distances = np.full(count, np.inf)
+        if not count or not len(self.lat):
+            return route_ids, point_ids, distances
+
+        points_per_cell = max(len(self.lat) // max(len(self.cells), 1), 1)
+        pending = np.arange(count)
+        for span in self.NEAREST_SPANS:
+            if not len(pending):
+                break
+            best_points = np.empty(len(pending), dtype=np.int64)
+            best_distances = np.empty(len(pending))
+            # Chia lô theo số điểm trung bình mỗi ô để giới hạn bộ nhớ tạm
+            batch = max(self.NEAREST_BATCH_PAIRS // ((2 * span + 1) ** 2 * points_per_cell), 1)
+            for begin in range(0, len(pending), batch):
+                chunk = pending[begin:begin + batch]
+                best_points[begin:begin + batch], best_distances[begin:begin + batch] = \
+                    self._nearest_in_block(lats[chunk], lons[chunk], span)
+
+            # Bán kính mà _candidates chỉ cần các ô trong khối
+            covered = (span * self.cell_deg * METERS_PER_DEGREE
+                       * np.cos(np.radians(np.minimum(np.abs(lats[pending]) + span * self.cell_deg, 90.0))))
+            resolved = best_distances <= covered
+            hits = resolved
+            if max_distance_m is not None:
+                # max_distance_m nằm gọn trong khối: không thấy điểm trong khối là không có điểm nào
+                resolved = resolved | (max_distance_m <= covered)
+                hits = resolved & (best_distances <= max_distance_m)
+            found = pending[hits]
+            route_ids[found] = self.route_ids[best_points[hits]]
+            point_ids[found] = self.point_ids[best_points[hits]]
+            distances[found] = best_distances[hits]
+            pending = pending[~resolved]
+
+        for i in pending.tolist():
+            hit = self.nearest(float(lats[i]), float(lons[i]), max_distance_m)
+            if hit is not None:
+                route_ids[i], point_ids[i], distances[i] = hit
+        return route_ids, point_ids, distances
+
+    def routes_within(self, lat, lon, radius_m):
+        """Route đi qua trong bán kính radius_m: list (route, khoảng cách gần nhất), gần nhất trước"""
+        route_ids, _, distances = self.within(lat, lon, radius_m)
+        best = {}
+        for route_id, distance in zip(route_ids.tolist(), distances.tolist()):
+            best.setdefault(route_id, distance)
+        return [(self.routes[route_id], distance) for route_id, distance in best.items()]
+
+# ==========================
+# CHẠY TỪ DÒNG LỆNH
+# ==========================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parse GPX routes into the memory-mapped route cache.")
+    parser.add_argument("inputs", nargs="*", default=["route_*.gpx"], help="GPX files, directories or glob patterns")
+    parser.add_argument("--cache-dir", default=ROUTE_CACHE_DIR, help=f"cache directory (default: {ROUTE_CACHE_DIR})")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--near", help="coordinate (DMS or decimal) or a file with one per line, e.g. text.txt")
+    parser.add_argument("--radius", type=float, default=50.0, help="radius in metres for --near (default: 50)")
+    parser.add_argument("--store", help="dataset store to look up datasets linked to the matching routes")
+    args = parser.parse_args(argv)
+
+    files = expand_route_paths(args.inputs)
+    if not files:
+        parser.error("no GPX files found")
+
+    start = time.perf_counter()
+    routes = RouteCache(args.cache_dir).load_many(files, args.workers)
+    elapsed = time.perf_counter() - start
+    if not args.near:
+        for route in routes:
+            metrics = route_metrics(route)
+            print(f"{route.name}\twaypoints={len(route.wpt_lat)}\ttrack points={metrics['points']}"
+                  f"\tsegments={metrics['segments']}\tlength={metrics['length_m'] / 1000:.3f} km")
+        print(f"Loaded {len(routes)} routes in {elapsed * 1000:.1f} ms")
+        return 0
+
+    try:
+        if os.path.isfile(args.near):
+            with open(args.near, "r", encoding="utf-8") as f:
+                coordinates = parse_coordinate_lines(f)
+        else:
+            coordinates = [parse_coordinate(args.near)]
+    except ValueError as e:
+        parser.error(str(e))
+
+    datasets_by_route = {}
+    if args.store:
+        from classes_counter import open_dataset_store
+        store = open_dataset_store(args.store)
+        for dataset, path in store.route_links():
+            datasets_by_route.setdefault(os.path.abspath(path), []).append(dataset)
+        store.close()
+
+    index = RouteIndex(routes)
+    start = time.perf_counter()
+    route_ids, point_ids, distances = index.nearest_many([lat for lat, _ in coordinates],
+                                                         [lon for _, lon in coordinates])
+    elapsed = time.perf_counter() - start
+    for (lat, lon), route_id, point_id, distance in zip(coordinates, route_ids, point_ids, distances):
+        print(f"{lat:.7f}, {lon:.7f}")
+        if route_id < 0:
+            print("\tno track points")
+            continue
+        print(f"\tnearest: {routes[route_id].name} point {point_id} ({distance:.1f} m)")
+        for route, route_distance in index.routes_within(lat, lon, args.radius):
+            datasets = datasets_by_route.get(os.path.abspath(route.path), [])
+            linked = f"\tdatasets: {', '.join(datasets)}" if datasets else ""
+            print(f"\twithin {args.radius:g} m: {route.name} ({route_distance:.1f} m){linked}")
+    print(f"{len(coordinates)} queries over {len(index)} track points in {elapsed * 1000:.2f} ms")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,60 @@
+import os
+import subprocess
+import sys
+
+import openpyxl
+
+import aggregate_counts
+from aggregate_counts import aggregate, read_workbook_counts, workbook_day
+
+# ==========================
+# KIỂM THỬ TỔNG HỢP WORKBOOK
+# ==========================
+def write_workbook(path, sheets):
+    wb = openpyxl.Workbook()
+    wb.remove(wb.active)
+    for title, rows in sheets.items():
+        ws = wb.create_sheet(title)
+        for row in rows:
+            ws.append(row)
+    wb.save(path)
+    return str(path)
+
+def test_import_does_not_need_tk():
+    code = "import sys, aggregate_counts; sys.exit('tkinter' in sys.modules)"
+    assert subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(aggregate_counts.__file__)).returncode == 0
+
+def test_workbook_day_is_iso(tmp_path):
+    full = write_workbook(tmp_path / "作業管理表_20251015.xlsx", {"Counts_English": []})
+    short = write_workbook(tmp_path / "作業管理表_1016.xlsx", {"Counts_English": []})
+    os.utime(short, (1750000000, 1750000000))  # giữa tháng 6/2025
+    assert workbook_day(full) == "2025-10-15"
+    assert workbook_day(short) == "2025-10-16"
+
+def test_read_and_aggregate_across_languages(tmp_path, classes_file):
+    aggregate_counts._init_worker(classes_file)
+    first = write_workbook(tmp_path / "作業管理表_20251015.xlsx", {
+        "Counts_English": [["Dataset Name", "Working Time", "Solid line", "Dashed line", "Pole"],
+                           ["A", "00:10:00", 1, 2, 3]],
+        # Cột đảo thứ tự, dataset A đã tính ở sheet trước
+        "Counts_Tiếng Việt": [["Dataset Name", "Working Time", "Cột điện", "Vạch liền", "Vạch đứt"],
+                              ["A", "00:10:00", 9, 9, 9],
+                              ["B", "01:00:00", 5, 4, None]],
+    })
+    second = write_workbook(tmp_path / "作業管理表_20251016.xlsx", {
+        "Counts_English": [["Dataset Name", "Working Time", "Solid line", "Dashed line", "Pole"],
+                           ["A", "00:05:00", 1, 0, 0]],
+    })
+    broken = tmp_path / "作業管理表_20251017.xlsx"
+    broken.write_bytes(b"not a workbook")
+
+    results = [read_workbook_counts(path) for path in (first, second, str(broken))]
+    assert results[0][1:] == ("2025-10-15", [("A", 600, [1, 2, 3]), ("B", 3600, [4, 0, 5])], None)
+    assert results[2][1] is None and results[2][2] == [] and results[2][3]
+
+    by_class, by_dataset, by_day = aggregate(results, 3)
+    assert by_class == [6, 2, 8]
+    assert by_dataset["A"]["seconds"] == 900
+    assert by_dataset["A"]["days"] == {"2025-10-15", "2025-10-16"}
+    assert sorted(by_day) == ["2025-10-15", "2025-10-16"]
+    assert by_day["2025-10-15"]["datasets"] == 2
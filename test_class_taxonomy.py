@@ -0,0 +1,88 @@
+import os
+
+from conftest import CLASSES_TEXT, make_taxonomy
+
+import class_taxonomy
+from class_taxonomy import TAXONOMY_CACHE_SUFFIX, match_taxonomies, parse_classes_text, read_taxonomy_file
+
+# ==========================
+# KIỂM THỬ TAXONOMY CLASS
+# ==========================
+def test_parse_classes_text():
+    data = parse_classes_text(CLASSES_TEXT)
+    assert list(data["class_sets"]) == ["English", "Tiếng Việt"]
+    assert data["class_mapping"][1] == {"English": "Solid line", "Tiếng Việt": "Vạch liền"}
+    assert data["children_by_parent"] == {0: [1, 2], 3: [4]}
+    assert data["class_keys"] == {0: "1", 1: "1.1", 2: "1.2", 3: "2", 4: "2.1"}
+    assert data["columns"] == {0: "LEFT", 3: "RIGHT"}
+
+def test_taxonomy_indexes():
+    taxonomy = make_taxonomy()
+    assert taxonomy.parent_indices == (0, 3)
+    assert taxonomy.children_by_parent == {0: (1, 2), 3: (4,)}
+    assert taxonomy.parent_of == {1: 0, 2: 0, 4: 3}
+    assert taxonomy.child_indices == (1, 2, 4)
+    assert taxonomy.child_names["Tiếng Việt"] == ("Vạch liền", "Vạch đứt", "Cột điện")
+    assert taxonomy.index_by_key["2.1"] == 4
+    assert taxonomy.class_name(2, "English") == "Dashed line"
+    assert taxonomy.class_name(9, "English", "?") == "?"
+    assert not make_taxonomy("")
+
+def test_resolve_header():
+    taxonomy = make_taxonomy()
+    # Ngôn ngữ chọn theo số cột khớp; tên duy nhất ở ngôn ngữ khác vẫn nhận
+    assert taxonomy.resolve_header(["Vạch đứt", "Solid line", "?"]) == (2, 1, None)
+    assert taxonomy.resolve_header(["Pole", "Dashed line"], "English") == (4, 2)
+    assert taxonomy.language_by_header[("Vạch liền", "Vạch đứt", "Cột điện")] == "Tiếng Việt"
+
+def test_resolve_header_ambiguous_name():
+    # "Pole" có ở cả hai ngôn ngữ nhưng là hai class khác nhau
+    taxonomy = make_taxonomy(CLASSES_TEXT.replace("Vạch liền", "Pole"))
+    assert "Pole" not in taxonomy.unique_name_index
+    assert taxonomy.resolve_header(["Pole"], "English") == (4,)
+    assert taxonomy.resolve_header(["Pole"], "Tiếng Việt") == (1,)
+    assert taxonomy.resolve_header(["Pole", "Dashed line"], "Tiếng Việt") == (1, 2)
+
+def test_match_taxonomies_insert_and_rename():
+    old = make_taxonomy()
+    inserted = make_taxonomy(CLASSES_TEXT
+                             .replace("1.1.1. Solid line", "1.1.1. Zebra\n1.1.2. Solid line")
+                             .replace("1.1.2. Dashed line", "1.1.3. Dashed line")
+                             .replace("2.1.1. Vạch liền", "2.1.1. Vạch ngựa vằn\n2.1.2. Vạch liền")
+                             .replace("2.1.2. Vạch đứt", "2.1.3. Vạch đứt"))
+    mapping = match_taxonomies(old, inserted)
+    for old_index in old.child_indices:
+        assert old.class_mapping[old_index] == inserted.class_mapping[mapping[old_index]]
+
+    # Sửa tên ở mọi ngôn ngữ: ghép theo key "2.1"
+    renamed = make_taxonomy(CLASSES_TEXT.replace("Pole", "Utility pole").replace("Cột điện", "Cột"))
+    assert match_taxonomies(old, renamed)[4] == 4
+
+    removed = make_taxonomy(CLASSES_TEXT.replace("1.1.2. Dashed line\n", "").replace("2.1.2. Vạch đứt\n", ""))
+    assert 2 not in match_taxonomies(old, removed)
+
+# ----------------------------
+# CACHE TAXONOMY
+# ----------------------------
+def test_taxonomy_cache_roundtrip(classes_file, monkeypatch):
+    parsed = read_taxonomy_file(classes_file)
+    assert os.path.exists(classes_file + TAXONOMY_CACHE_SUFFIX)
+
+    # Lần sau đọc từ cache, không parse lại
+    monkeypatch.setattr(class_taxonomy, "parse_classes_text", None)
+    cached = read_taxonomy_file(classes_file)
+    for name in ("class_sets", "class_mapping", "children_by_parent", "class_keys", "columns",
+                 "name_index", "unique_name_index", "language_by_header"):
+        assert getattr(cached, name) == getattr(parsed, name)
+
+def test_taxonomy_cache_invalidated_by_content(classes_file):
+    read_taxonomy_file(classes_file)
+    with open(classes_file, "a", encoding="utf-8") as f:
+        f.write("2.2.2. Biển báo\n")
+    assert read_taxonomy_file(classes_file).class_name(5, "Tiếng Việt") == "Biển báo"
+
+def test_taxonomy_cache_corrupt_is_ignored(classes_file):
+    with open(classes_file + TAXONOMY_CACHE_SUFFIX, "wb") as f:
+        f.write(b"\x00garbage")
+    assert read_taxonomy_file(classes_file).child_indices == (1, 2, 4)
+    assert read_taxonomy_file(classes_file).child_indices == (1, 2, 4)
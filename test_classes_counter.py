@@ -0,0 +1,337 @@
+import json
+import os
+import sqlite3
+import stat
+import threading
+import time
+import types
+
+import openpyxl
+import pytest
+
+from conftest import CLASSES_TEXT, make_taxonomy
+
+import classes_counter
+from classes_counter import (
+    CounterApp,
+    CountStore,
+    ExcelSaveWorker,
+    SessionJournal,
+    SqliteDatasetStore,
+    load_hotkeys_from_file,
+    modifier_masks,
+    write_workbook_rows,
+)
+
+# ==========================
+# KIỂM THỬ CLASSES_COUNTER - KHÔNG CẦN TK
+# ==========================
+# Các method của CounterApp được gọi trên một đối tượng giả chỉ có đúng
+# thuộc tính chúng dùng, nên không cần cửa sổ Tk.
+def bind(stub, *names):
+    for name in names:
+        setattr(stub, name, types.MethodType(getattr(CounterApp, name), stub))
+    return stub
+
+# Chèn một class con vào đầu mỗi parent: key "1.1", "1.2", "2.1" đều đổi số
+INSERTED_TEXT = (CLASSES_TEXT
+                 .replace("1.1.1. Solid line\n1.1.2. Dashed line", "1.1.1. Zebra\n1.1.2. Solid line\n1.1.3. Dashed line")
+                 .replace("1.2.1. Pole", "1.2.1. Sign\n1.2.2. Pole")
+                 .replace("2.1.1. Vạch liền\n2.1.2. Vạch đứt", "2.1.1. Vạch ngựa vằn\n2.1.2. Vạch liền\n2.1.3. Vạch đứt")
+                 .replace("2.2.1. Cột điện", "2.2.1. Biển báo\n2.2.2. Cột điện"))
+
+# ----------------------------
+# BỘ ĐẾM
+# ----------------------------
+def test_count_store_updates_and_notifies():
+    store = CountStore(5)
+    changes, records = [], []
+    store.on_change = changes.append
+    store.on_record = lambda index, old, new: records.append((index, old, new))
+
+    store.increment(1)
+    store.increment(1, 4)
+    store.decrement(2)  # không xuống dưới 0, không báo
+    store.set(4, "7")
+    store.set(4, 7)
+    assert store.take((1, 2, 4)) == [5, 0, 7]
+    assert store.total() == 12 and store.total((4,)) == 7
+    assert changes == [1, 1, 4]
+    assert records == [(1, 0, 1), (1, 1, 5), (4, 0, 7)]
+
+    store.add({1: -10, 2: 3, 4: 0})
+    assert store.take((1, 2, 4)) == [0, 3, 7]
+    assert records[-2:] == [(1, 5, 0), (2, 0, 3)]
+
+def test_count_store_bulk_operations():
+    store = CountStore(3)
+    changes = []
+    store.on_change = changes.append
+    before = store.snapshot()
+    store.assign([1, 2, 3])
+    assert store.diff(before) == [(0, 0, 1), (1, 0, 2), (2, 0, 3)]
+
+    store.remap({0: 3, 2: 0}, 4)
+    assert list(store.values) == [3, 0, 0, 1] and len(store) == 4
+    store.reset()
+    assert store.total() == 0 and len(store) == 4
+    assert changes == [None, None, None]
+
+# ----------------------------
+# PHÍM TẮT ĐẾM
+# ----------------------------
+NUM_LOCK_WIN32 = 0x0008
+
+def write_hotkeys(tmp_path, data):
+    path = tmp_path / "hotkeys.json"
+    path.write_text(json.dumps(data), encoding="utf-8")
+    return str(path)
+
+def test_load_hotkeys_from_file(tmp_path, capsys):
+    filename = write_hotkeys(tmp_path, {"decrement_modifier": "Shift", "keys": {
+        "Q": "1.1", "F1": "Pole", "w": "1.2", "x": "1", "z": "9.9"}})
+    hotkeys, mask = load_hotkeys_from_file(make_taxonomy(), filename)
+    assert hotkeys == {"q": 1, "F1": 4, "w": 2}
+    assert mask == 0x0001
+    assert capsys.readouterr().out.count("WARNING") == 2
+
+    assert load_hotkeys_from_file(make_taxonomy(), str(tmp_path / "missing.json")) == ({}, 0x0004)
+    with pytest.raises(ValueError):
+        load_hotkeys_from_file(make_taxonomy(), write_hotkeys(tmp_path, {"decrement_modifier": "Hyper"}))
+
+def test_alt_mask_per_platform():
+    assert modifier_masks("win32")["Alt"] == 0x20000
+    assert modifier_masks("linux")["Alt"] == 0x0008
+    assert not modifier_masks("win32")["Alt"] & NUM_LOCK_WIN32
+
+def test_num_lock_alone_does_not_decrement(tmp_path, monkeypatch):
+    monkeypatch.setattr(classes_counter, "MODIFIER_MASKS", modifier_masks("win32"))
+    hotkeys, mask = load_hotkeys_from_file(
+        make_taxonomy(), write_hotkeys(tmp_path, {"decrement_modifier": "Alt", "keys": {"q": "1.1"}}))
+    stub = bind(types.SimpleNamespace(
+        hotkeys=hotkeys, decrement_mask=mask, _pending_deltas={}, _flush_scheduled=True,
+    ), "_on_hotkey")
+    def press(state):
+        return stub._on_hotkey(types.SimpleNamespace(widget=None, keysym="q", state=state))
+
+    assert press(NUM_LOCK_WIN32) == "break"
+    assert stub._pending_deltas == {1: 1}
+    press(NUM_LOCK_WIN32 | 0x20000)
+    assert stub._pending_deltas == {1: 0}
+
+# ----------------------------
+# NHẬT KÝ PHIÊN
+# ----------------------------
+def test_session_journal_replay_skips_torn_last_line(tmp_path):
+    path = str(tmp_path / "session.journal")
+    journal = SessionJournal(path)
+    journal.open()
+    journal.append("c", "1.1", 0, 1)
+    journal.append("c", "1.1", 1, 2)
+    journal.append("c", "2.1", 0, 5)
+    journal.close()
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('[1.0,"c","1.2",0')
+
+    counts, _, changes = SessionJournal(path).replay()
+    assert counts == {"1.1": 2, "2.1": 5}
+    assert changes == [("1.1", 0, 1), ("1.1", 1, 2), ("2.1", 0, 5)]
+
+    # Ghi tiếp sau crash không dính vào dòng ghi dở
+    journal = SessionJournal(path)
+    journal.open()
+    journal.append("c", "1.2", 0, 3)
+    journal.close()
+    with open(path, encoding="utf-8") as f:
+        assert json.loads(f.read().splitlines()[-1])[2:] == ["1.2", 0, 3]
+    assert SessionJournal(path).replay()[0]["1.2"] == 3
+
+def test_session_journal_remaps_keys_after_class_inserted(tmp_path):
+    path = str(tmp_path / "session.journal")
+    old, new = make_taxonomy(), make_taxonomy(INSERTED_TEXT)
+    journal = SessionJournal(path)
+    journal.open()
+    journal.set_taxonomy(old)
+    journal.set_taxonomy(old)  # không đổi thì không ghi lại
+    journal.append("c", "1.1", 0, 2)
+    journal.append("c", "2.1", 0, 5)
+    journal.close()
+    assert journal.record_count == 3
+
+    counts, _, changes = SessionJournal(path).replay(new)
+    assert counts == {"1.2": 2, "2.2": 5}
+    assert changes == [("1.2", 0, 2), ("2.2", 0, 5)]
+    assert SessionJournal(path).replay(old)[0] == {"1.1": 2, "2.1": 5}
+
+    # Snapshot giữ danh tính taxonomy sau khi compact
+    journal = SessionJournal(path)
+    journal.replay()
+    journal.open()
+    journal.compact({"1.1": 2, "2.1": 5}, 10.0)
+    journal.close()
+    assert SessionJournal(path).replay(new)[:2] == ({"1.2": 2, "2.2": 5}, 10.0)
+
+def test_session_journal_taxonomy_change_mid_journal(tmp_path):
+    path = str(tmp_path / "session.journal")
+    old, new = make_taxonomy(), make_taxonomy(INSERTED_TEXT)
+    journal = SessionJournal(path)
+    journal.open()
+    journal.set_taxonomy(old)
+    journal.append("c", "1.1", 0, 2)
+    # Nạp lại classes.txt lúc đang chạy, rồi đếm class mới chèn (key "1.1" mới)
+    journal.set_taxonomy(new)
+    journal.append("c", "1.1", 0, 1)
+    journal.close()
+    counts, _, changes = SessionJournal(path).replay(new)
+    assert counts == {"1.2": 2, "1.1": 1}
+    assert changes == [("1.2", 0, 2), ("1.1", 0, 1)]
+
+def test_session_journal_snapshot_keeps_file_mode(tmp_path):
+    journal = SessionJournal(str(tmp_path / "session.journal"))
+    journal.compact({}, 0.0)
+    os.chmod(journal.snapshot_path, 0o640)
+    journal.compact({"1.1": 1}, 0.0)
+    journal.close()
+    assert stat.S_IMODE(os.stat(journal.snapshot_path).st_mode) == 0o640
+
+# ----------------------------
+# NẠP LẠI CLASSES.TXT
+# ----------------------------
+def test_watch_taxonomy_file_waits_for_stable_file(classes_file):
+    reloads = []
+    stub = types.SimpleNamespace(
+        taxonomy_file=classes_file,
+        taxonomy=make_taxonomy(),
+        _pending_taxonomy_stamp=None,
+        _confirm_dropped_classes=lambda new, mapping: True,
+        reload_taxonomy=lambda new, mapping: reloads.append((new, mapping)),
+        root=types.SimpleNamespace(after=lambda ms, callback: None),
+    )
+    bind(stub, "_stat_taxonomy_file", "watch_taxonomy_file")
+    stub._taxonomy_stamp = stub._stat_taxonomy_file()
+
+    stub.watch_taxonomy_file()
+    assert not reloads
+
+    with open(classes_file, "w", encoding="utf-8") as f:
+        f.write(CLASSES_TEXT.replace("1.2.1. Pole", "1.2.1. Sign\n1.2.2. Pole")
+                .replace("2.2.1. Cột điện", "2.2.1. Biển báo\n2.2.2. Cột điện"))
+    os.utime(classes_file, ns=(1, 1))
+    stub.watch_taxonomy_file()
+    assert not reloads  # vừa đổi - chờ lần sau
+    stub.watch_taxonomy_file()
+    assert len(reloads) == 1
+    new, mapping = reloads[0]
+    assert new.class_name(mapping[4], "English") == "Pole"
+    assert mapping[4] == 5
+
+    # Đứng yên thì không nạp lại nữa
+    stub.watch_taxonomy_file()
+    assert len(reloads) == 1
+
+# ----------------------------
+# GHI WORKBOOK
+# ----------------------------
+HEADER = ["Dataset Name", "Working Time", "Solid line", "Dashed line", "Pole"]
+
+def read_rows(filename, sheet_name):
+    wb = openpyxl.load_workbook(filename, read_only=True)
+    try:
+        return [list(row) for row in wb[sheet_name].iter_rows(values_only=True)]
+    finally:
+        wb.close()
+
+def test_write_workbook_rows_upserts(tmp_path):
+    filename = str(tmp_path / "counts.xlsx")
+    write_workbook_rows(filename, [("Counts_English", HEADER, ["A", "00:01:00", 1, 2, 3]),
+                                   ("Counts_English", HEADER, ["B", "00:02:00", 4, 5, 6])])
+    write_workbook_rows(filename, [("Counts_English", HEADER, ["A", "00:03:00", 7, 8, 9]),
+                                   ("Counts_Tiếng Việt", HEADER, ["C", "00:04:00", 0, 0, 1])])
+    assert read_rows(filename, "Counts_English") == [HEADER, ["A", "00:03:00", 7, 8, 9],
+                                                     ["B", "00:02:00", 4, 5, 6]]
+    assert read_rows(filename, "Counts_Tiếng Việt") == [HEADER, ["C", "00:04:00", 0, 0, 1]]
+    assert os.listdir(tmp_path) == ["counts.xlsx"]
+
+def test_write_workbook_rows_keeps_file_mode(tmp_path):
+    filename = str(tmp_path / "counts.xlsx")
+    umask = os.umask(0)
+    os.umask(umask)
+    write_workbook_rows(filename, [("Counts_English", HEADER, ["A", "00:01:00", 1, 2, 3])])
+    assert stat.S_IMODE(os.stat(filename).st_mode) == 0o666 & ~umask
+
+    os.chmod(filename, 0o640)
+    write_workbook_rows(filename, [("Counts_English", HEADER, ["A", "00:01:00", 1, 2, 4])])
+    assert stat.S_IMODE(os.stat(filename).st_mode) == 0o640
+
+def test_excel_save_worker_coalesces(tmp_path, monkeypatch):
+    release = threading.Event()
+    written = []
+    def fake_write(filename, rows):
+        release.wait(5)
+        written.append((filename, rows))
+    monkeypatch.setattr(classes_counter, "write_workbook_rows", fake_write)
+
+    worker = ExcelSaveWorker()
+    worker.submit("a.xlsx", "Counts_English", HEADER, ["A", "00:00:01", 1, 0, 0])
+    while worker._pending:  # chờ luồng ghi lấy a.xlsx và bị chặn
+        time.sleep(0.001)
+    for value in range(1, 4):
+        worker.submit("b.xlsx", "Counts_English", HEADER, ["A", "00:00:01", value, 0, 0])
+    worker.submit("b.xlsx", "Counts_English", HEADER, ["B", "00:00:01", 9, 0, 0])
+    release.set()
+    worker.close()
+
+    assert [filename for filename, _ in written] == ["a.xlsx", "b.xlsx"]
+    assert [values for _, _, values in written[1][1]] == [["A", "00:00:01", 3, 0, 0], ["B", "00:00:01", 9, 0, 0]]
+    results = [worker.results.get_nowait() for _ in range(2)]
+    assert results == [("a.xlsx", 1, None), ("b.xlsx", 2, None)]
+
+# ----------------------------
+# KHO DATASET SQLITE
+# ----------------------------
+def test_store_upsert_and_load(tmp_path):
+    store = SqliteDatasetStore(str(tmp_path / "counts.db"))
+    store.save("A", 60, {"1.1": 1, "1.2": 2, "2.1": 3}, "English")
+    store.save("B", 5, {"1.1": 9})
+    store.save("A", 90, {"1.1": 4, "2.1": 0}, "Tiếng Việt")
+
+    assert store.load("A") == (90, {"1.1": 4, "2.1": 0}, "Tiếng Việt")
+    assert store.load("missing") is None
+    assert [row[:3] for row in store.datasets()] == [("A", 90, "Tiếng Việt"), ("B", 5, None)]
+    day = store.days()[0]
+    assert len(store.days()) == 1 and len(day) == 10
+    assert store.iter_datasets(day) == {"A": (90, {"1.1": 4, "2.1": 0}, "Tiếng Việt"), "B": (5, {"1.1": 9}, None)}
+    store.close()
+
+def test_store_remaps_keys_after_class_inserted(tmp_path):
+    path = str(tmp_path / "counts.db")
+    old = make_taxonomy()
+    store = SqliteDatasetStore(path)
+    store.save("A", 60, {"1.1": 1, "1.2": 2, "2.1": 3}, "English", old)
+    store.close()
+
+    new = make_taxonomy(INSERTED_TEXT)
+    assert new.class_keys[new.name_index[("English", "Solid line")]] == "1.2"
+    store = SqliteDatasetStore(path)
+    expected = {"1.2": 1, "1.3": 2, "2.2": 3}
+    assert store.load("A", new) == (60, expected, "English")
+    assert store.iter_datasets(None, new)["A"][1] == expected
+    # Cùng taxonomy lúc lưu thì giữ nguyên key
+    assert store.load("A", old)[1] == {"1.1": 1, "1.2": 2, "2.1": 3}
+    store.close()
+
+def test_store_opens_database_without_taxonomy_column(tmp_path):
+    path = str(tmp_path / "counts.db")
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE datasets (name TEXT PRIMARY KEY, working_seconds INTEGER NOT NULL, language TEXT,
+                               saved_at TEXT NOT NULL, day TEXT NOT NULL);
+        CREATE TABLE counts (dataset TEXT NOT NULL, class_key TEXT NOT NULL, count INTEGER NOT NULL,
+                             PRIMARY KEY (dataset, class_key)) WITHOUT ROWID;
+        INSERT INTO datasets VALUES ('A', 60, 'English', '2025-10-15 10:00:00', '2025-10-15');
+        INSERT INTO counts VALUES ('A', '1.1', 7);
+    """)
+    conn.close()
+    store = SqliteDatasetStore(path)
+    assert store.load("A", make_taxonomy(INSERTED_TEXT)) == (60, {"1.1": 7}, "English")
+    store.close()
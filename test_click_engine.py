@@ -0,0 +1,248 @@
+import sys
+import threading
+import time
+import types
+
+import pytest
+
+import click_engine
+from click_engine import (
+    CONDITION_POLL_INTERVAL,
+    FULL_SCREEN_POLL_INTERVAL,
+    SPIN_THRESHOLD,
+    WIN32_COARSE_SPIN,
+    WIN32_FINE_SPIN,
+    OP_END,
+    OP_LOOP,
+    ColorCondition,
+    LatenessStats,
+    PlaylistError,
+    PyAutoGuiBackend,
+    RecordingBackend,
+    SyntheticScreen,
+    compile_playlist,
+    compile_steps,
+    condition_from_spec,
+    run_program,
+)
+
+# ==========================
+# KIỂM THỬ ENGINE PHÁT LẠI - KHÔNG CẦN DESKTOP
+# ==========================
+def play(program, frame_source=None):
+    backend = RecordingBackend(frame_source=frame_source)
+    report = run_program(program, backend, threading.Event())
+    return backend, report
+
+# ----------------------------
+# PLAYLIST
+# ----------------------------
+def test_playlist_nesting_and_sub_sets():
+    click_sets = {"A": [{"x": 1, "y": 2, "delay": 0}, {"x": 3, "y": 4}]}
+    program = compile_playlist("""
+        def B { right 5 6 0 }
+        repeat 3 {
+            set A      # 2 click
+            repeat 2 {
+                call B
+            }
+        }
+        click 7 8
+    """, click_sets, 0.0)
+    assert program.actions == 3 * (2 + 2) + 1
+    assert list(program.ops).count(OP_LOOP) == list(program.ops).count(OP_END) == 2
+
+    backend, report = play(program)
+    assert report["clicks"] == program.actions
+    clicks = [(args[0], args[1], args[2]) for _, name, args in backend.events if name == "click"]
+    assert clicks[:4] == [(1, 2, "left"), (3, 4, "left"), (5, 6, "right"), (5, 6, "right")]
+    assert clicks[-1] == (7, 8, "left")
+
+def test_playlist_one_line_and_multi_line_blocks_match():
+    click_sets = {"S": [{"x": 1, "y": 1}]}
+    inline = compile_playlist("repeat 2 { set S }\ndef T { click 2 2 }\ncall T", click_sets, 0.0)
+    multi = compile_playlist("repeat 2 {\n set S\n}\ndef T {\n click 2 2\n}\ncall T", click_sets, 0.0)
+    assert list(inline.ops) == list(multi.ops)
+    assert list(inline.x) == list(multi.x)
+
+@pytest.mark.parametrize("text, line, message", [
+    ("click 1 1\nwait -1", 2, "must not be negative"),
+    ("delay -0.5", 1, "must not be negative"),
+    ("click 1 1 -1", 1, "must not be negative"),
+    ("repeat 2 {\n click 1 1\n", 1, "missing '}'"),
+    ("click 1 1\n}", 2, "unexpected '}'"),
+    ("{ click 1 1 }", 1, "without a command"),
+    ("set X", 1, "unknown click set"),
+    ("call Y", 1, "unknown sub-set"),
+    ("def Z {\n call Z\n}\ncall Z", 2, "calls itself"),
+    ("repeat 2", 1, "needs a block"),
+    ("click a b", 1, "invalid number"),
+    ("until pixel 1 2 zzzzzz", 1, "invalid 'until'"),
+])
+def test_playlist_errors_report_line(text, line, message):
+    with pytest.raises(PlaylistError) as excinfo:
+        compile_playlist(text, {}, 0.0)
+    assert excinfo.value.line_number == line
+    assert message in str(excinfo.value)
+
+def test_playlist_bad_click_set_values():
+    with pytest.raises(PlaylistError, match="click set 'B'"):
+        compile_playlist("\nset B", {"B": [{"x": "abc", "y": 1}]}, 0.1)
+    with pytest.raises(PlaylistError, match="line 1: click set 'N'"):
+        compile_playlist("set N", {"N": [{"x": 1, "y": 1, "delay": -1}]}, 0.1)
+
+def test_run_program_stop_event():
+    stop_event = threading.Event()
+    stop_event.set()
+    report = run_program(compile_steps([(1, 1, 10.0)], 5), RecordingBackend(), stop_event)
+    assert report["stopped"]
+    assert report["clicks"] == 0
+
+# ----------------------------
+# LỊCH CHẠY VÀ THỐNG KÊ JITTER
+# ----------------------------
+def test_huge_repeat_starts_and_stops():
+    program = compile_steps([(1, 1, 0.0005)] * 5, 10 ** 9)
+    assert program.actions == 5 * 10 ** 9
+    backend = RecordingBackend()
+    stop_event = threading.Event()
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(run_program(program, backend, stop_event)))
+    thread.start()
+    time.sleep(0.1)
+    stop_event.set()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert result["stopped"]
+    assert 0 < result["clicks"] == len(backend.clicks())
+
+def test_lateness_stats_bounded():
+    stats = LatenessStats(size=100, seed=1)
+    for i in range(10000):
+        stats.add(i / 10000)
+    assert len(stats) == 10000 and len(stats.samples) == 100
+    assert stats.max == 0.9999
+    assert abs(stats.total / stats.count - 0.49995) < 1e-9
+    assert 0.9 < stats.percentile(0.99) <= 0.9999
+
+    exact = LatenessStats()
+    for value in (0.003, 0.001, 0.002):
+        exact.add(value)
+    assert exact.percentile(0.99) == 0.003 and exact.percentile(0.5) == 0.002
+    assert LatenessStats().percentile(0.99) == 0.0
+
+def test_fine_timer_per_platform(monkeypatch):
+    import ctypes
+    monkeypatch.setattr(sys, "platform", "linux")
+    spin, restore = click_engine._fine_timer()
+    assert spin == SPIN_THRESHOLD
+    restore()
+
+    monkeypatch.setattr(sys, "platform", "win32")
+    monkeypatch.delattr(ctypes, "WinDLL", raising=False)
+    assert click_engine._fine_timer()[0] == WIN32_COARSE_SPIN
+
+    calls = []
+    class FakeWinmm:
+        def timeBeginPeriod(self, period):
+            calls.append(("begin", period))
+            return 0
+        def timeEndPeriod(self, period):
+            calls.append(("end", period))
+            return 0
+    monkeypatch.setattr(ctypes, "WinDLL", lambda name: FakeWinmm(), raising=False)
+    spin, restore = click_engine._fine_timer()
+    assert spin == WIN32_FINE_SPIN and calls == [("begin", 1)]
+    restore()
+    assert calls == [("begin", 1), ("end", 1)]
+
+# ----------------------------
+# ĐIỀU KIỆN CHỜ
+# ----------------------------
+def test_color_condition_tolerance():
+    screen = SyntheticScreen(20, 20)
+    screen.fill((5, 5, 1, 1), (100, 150, 200))
+    region = (5, 5, 1, 1)
+    assert ColorCondition(5, 5, (100, 150, 200)).matches(screen(region))
+    assert ColorCondition(5, 5, (103, 148, 200), tolerance=3).matches(screen(region))
+    assert not ColorCondition(5, 5, (104, 150, 200), tolerance=3).matches(screen(region))
+
+def test_condition_from_spec():
+    condition, timeout, continue_on_timeout = condition_from_spec(
+        {"x": 3, "y": 4, "color": "#0a0b0c", "tolerance": 2, "timeout": 1.5, "on_timeout": "continue"})
+    assert condition.region == (3, 4, 1, 1)
+    assert condition.color == (10, 11, 12)
+    assert (timeout, continue_on_timeout) == (1.5, True)
+    with pytest.raises(ValueError):
+        condition_from_spec({"x": 1})
+
+def test_until_waits_for_color_then_clicks():
+    screen = SyntheticScreen(20, 20)
+    screen.fill_after(0.05, (2, 2, 1, 1), (0, 255, 0))
+    spec = {"x": 2, "y": 2, "color": "#00ff00", "timeout": 2}
+    backend, report = play(compile_steps([(9, 9, 0.0, spec)], 1), screen)
+    assert backend.clicks()[0][1:] == (9, 9)
+    assert report["condition_waits"] == 1
+    assert report["timeouts"] == 0
+    assert report["condition_wait_ms"] >= 40
+
+def test_until_timeout_stops_or_continues():
+    screen = SyntheticScreen(4, 4)
+    backend, report = play(compile_playlist("until pixel 0 0 ffffff 0 0.02\nclick 1 1", {}, 0.0), screen)
+    assert report["stopped"] and report["timeouts"] == 1 and not backend.clicks()
+    backend, report = play(compile_playlist("until pixel 0 0 ffffff 0 0.02 continue\nclick 1 1", {}, 0.0), screen)
+    assert not report["stopped"] and report["timeouts"] == 1 and len(backend.clicks()) == 1
+
+def test_until_polls_at_backend_interval():
+    class SlowGrabBackend(RecordingBackend):
+        def poll_interval(self, region):
+            return 0.02
+    screen = SyntheticScreen(4, 4)
+    grabs = []
+    backend = SlowGrabBackend(frame_source=lambda region: grabs.append(region) or screen(region))
+    report = run_program(compile_playlist("until pixel 0 0 ffffff 0 0.1 continue", {}, 0.0),
+                         backend, threading.Event())
+    assert report["timeouts"] == 1
+    assert len(grabs) <= 7
+
+# ----------------------------
+# CHỤP VÙNG MÀN HÌNH
+# ----------------------------
+class FakeShot:
+    def __init__(self, monitor):
+        self.monitor = monitor
+        self.rgb = bytes(3 * monitor["width"] * monitor["height"])
+
+class FakeMss:
+    def grab(self, monitor):
+        return FakeShot(monitor)
+
+def fake_backend(monkeypatch, with_mss):
+    calls = []
+    pyautogui = types.ModuleType("pyautogui")
+    pyautogui.screenshot = lambda region=None: calls.append(("screenshot", region))
+    pyautogui.pixel = lambda x, y: calls.append(("pixel", x, y)) or (1, 2, 3)
+    monkeypatch.setitem(sys.modules, "pyautogui", pyautogui)
+    if with_mss:
+        mss = types.ModuleType("mss")
+        mss.mss = FakeMss
+        monkeypatch.setitem(sys.modules, "mss", mss)
+    else:
+        monkeypatch.setitem(sys.modules, "mss", None)
+    return PyAutoGuiBackend(), calls
+
+def test_grab_uses_mss_region(monkeypatch):
+    backend, calls = fake_backend(monkeypatch, with_mss=True)
+    assert backend.grab((10, 20, 4, 2)) == bytes(24)
+    assert not calls
+    assert backend.poll_interval((10, 20, 4, 2)) == CONDITION_POLL_INTERVAL
+
+def test_grab_without_mss_polls_slower(monkeypatch):
+    monkeypatch.setattr(sys, "platform", "linux")
+    backend, calls = fake_backend(monkeypatch, with_mss=False)
+    assert backend.poll_interval((10, 20, 1, 1)) == FULL_SCREEN_POLL_INTERVAL
+    monkeypatch.setattr(sys, "platform", "win32")
+    assert backend.grab((10, 20, 1, 1)) == bytes((1, 2, 3))
+    assert calls == [("pixel", 10, 20)]
+    assert backend.poll_interval((10, 20, 1, 1)) == CONDITION_POLL_INTERVAL
+    assert backend.poll_interval((10, 20, 8, 8)) == FULL_SCREEN_POLL_INTERVAL
@@ -0,0 +1,164 @@
+import math
+import os
+import stat
+
+import numpy as np
+import pytest
+
+import gpx_routes
+from gpx_routes import Route, RouteCache, RouteIndex, haversine_m, parse_coordinate, parse_gpx
+
+# ==========================
+# KIỂM THỬ ROUTE GPX
+# ==========================
+GPX_TEXT = """<?xml version="1.0" encoding="UTF-8"?>
+<gpx xmlns="http://www.topografix.com/GPX/1/1" version="1.1">
+  <wpt lat="35.5" lon="139.7"><name>Start</name></wpt>
+  <trk><name>Test</name>
+    <trkseg>
+      <trkpt lat="35.50" lon="139.70"><ele>1</ele></trkpt>
+      <trkpt lat="35.51" lon="139.71"/>
+    </trkseg>
+    <trkseg>
+      <trkpt lat="35.52" lon="139.72"/>
+    </trkseg>
+  </trk>
+</gpx>
+"""
+
+def write_gpx(directory, name, text=GPX_TEXT):
+    path = directory / name
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+def test_parse_gpx(tmp_path):
+    wpt_lat, wpt_lon, lat, lon, segments = parse_gpx(write_gpx(tmp_path, "a.gpx"))
+    assert (list(wpt_lat), list(wpt_lon)) == ([35.5], [139.7])
+    assert list(zip(lat, lon)) == [(35.50, 139.70), (35.51, 139.71), (35.52, 139.72)]
+    assert list(segments) == [0, 2]
+
+# ----------------------------
+# CACHE MEMORY-MAPPED
+# ----------------------------
+def test_route_cache_roundtrip(tmp_path):
+    path = write_gpx(tmp_path, "a.gpx")
+    cache = RouteCache(str(tmp_path / "cache"))
+    first = cache.load(path)
+    second = cache.load(path)
+    for route in (first, second):
+        assert list(route.wpt_lat) == [35.5] and list(route.wpt_lon) == [139.7]
+        assert list(route.lat) == [35.50, 35.51, 35.52]
+        assert list(route.lon) == [139.70, 139.71, 139.72]
+        assert list(route.segments) == [0, 2]
+    # Mở lại từ cache: view chỉ-đọc của file được memory-map
+    assert isinstance(second.lat.base, np.memmap)
+    assert not second.lat.flags.writeable
+    assert os.listdir(cache.cache_dir) == [second.digest + gpx_routes.ROUTE_CACHE_SUFFIX]
+
+def test_route_cache_rebuilds_damaged_file(tmp_path):
+    path = write_gpx(tmp_path, "a.gpx")
+    cache = RouteCache(str(tmp_path / "cache"))
+    digest = cache.load(path).digest
+    with open(cache.cache_path(digest), "r+b") as f:
+        f.truncate(40)
+    assert gpx_routes.open_route_cache(cache.cache_path(digest)) is None
+    assert list(cache.load(path).lat) == [35.50, 35.51, 35.52]
+
+def test_route_cache_file_mode(tmp_path):
+    umask = os.umask(0)
+    os.umask(umask)
+    cache = RouteCache(str(tmp_path / "cache"))
+    route = cache.load(write_gpx(tmp_path, "a.gpx"))
+    assert stat.S_IMODE(os.stat(cache.cache_path(route.digest)).st_mode) == 0o666 & ~umask
+
+def test_load_many_starts_pool_only_for_uncached(tmp_path, monkeypatch):
+    paths = [write_gpx(tmp_path, "a.gpx"),
+             write_gpx(tmp_path, "b.gpx", GPX_TEXT.replace("35.52", "35.53")),
+             write_gpx(tmp_path, "copy.gpx")]
+    cache = RouteCache(str(tmp_path / "cache"))
+    warmed = []
+    class InlineExecutor:
+        def __init__(self, max_workers=None):
+            warmed.append(max_workers)
+        def __enter__(self):
+            return self
+        def __exit__(self, *exc):
+            return False
+        def map(self, fn, *iterables, chunksize=1):
+            return map(fn, *iterables)
+    monkeypatch.setattr(gpx_routes, "ProcessPoolExecutor", InlineExecutor)
+
+    routes = cache.load_many(paths, workers=8)
+    assert warmed == [2]  # a.gpx và copy.gpx trùng nội dung
+    assert [route.path for route in routes] == paths
+    assert float(routes[1].lat[-1]) == 35.53
+
+    # Đã có cache: không tạo process nào
+    class NoPool:
+        def __init__(self, *args, **kwargs):
+            pytest.fail("process pool started with every route cached")
+    monkeypatch.setattr(gpx_routes, "ProcessPoolExecutor", NoPool)
+    assert [len(route) for route in cache.load_many(paths)] == [3, 3, 3]
+
+# ----------------------------
+# TỌA ĐỘ VÀ ROUTE
+# ----------------------------
+@pytest.mark.parametrize("text, expected", [
+    ("35.5295, 139.7388", (35.5295, 139.7388)),
+    ("-33.9 151.2", (-33.9, 151.2)),
+    ("35°31'46.42\"N 139°44'19.88\"E", (35 + 31 / 60 + 46.42 / 3600, 139 + 44 / 60 + 19.88 / 3600)),
+    ("139°44.5'E\n35°31.5'N", (35.525, 139 + 44.5 / 60)),
+    ("33.9S, 151.2W", (-33.9, -151.2)),
+])
+def test_parse_coordinate(text, expected):
+    assert parse_coordinate(text) == pytest.approx(expected)
+
+@pytest.mark.parametrize("text", ["35.5", "91 10", "35N 36N", "abc def"])
+def test_parse_coordinate_rejects(text):
+    with pytest.raises(ValueError):
+        parse_coordinate(text)
+
+def random_walk_index(rng):
+    routes = []
+    for i in range(4):
+        steps = rng.normal(0, 0.0005, size=(500, 2)).cumsum(axis=0)
+        lat, lon = 35.6 + i * 0.01 + steps[:, 0], 139.7 + steps[:, 1]
+        routes.append(Route(f"r{i}.gpx", "", np.empty(0), np.empty(0), lat, lon, np.array([0])))
+    return RouteIndex(routes, cell_deg=0.002)
+
+def test_route_index_nearest_matches_brute_force():
+    rng = np.random.default_rng(0)
+    index = random_walk_index(rng)
+    routes = index.routes
+
+    for lat, lon in zip(rng.uniform(35.55, 35.7, 50), rng.uniform(139.65, 139.75, 50)):
+        route_id, point_id, distance = index.nearest(lat, lon)
+        brute = [haversine_m(lat, lon, route.lat, route.lon) for route in routes]
+        best = min(float(d.min()) for d in brute)
+        assert math.isclose(distance, best, rel_tol=1e-9)
+        assert math.isclose(float(brute[route_id][point_id]), best, rel_tol=1e-9)
+
+    assert index.nearest(0.0, 0.0, max_distance_m=1000) is None
+
+@pytest.mark.parametrize("max_distance_m", [None, 30.0, 200.0, 2000.0])
+def test_nearest_many_matches_nearest(max_distance_m):
+    rng = np.random.default_rng(1)
+    index = random_walk_index(rng)
+    # Gần route, cách vài ô và ở rất xa (đi qua nearest() từng điểm)
+    lats = np.concatenate([rng.uniform(35.55, 35.7, 300), rng.uniform(34.0, 36.0, 20)])
+    lons = np.concatenate([rng.uniform(139.65, 139.75, 300), rng.uniform(138.0, 141.0, 20)])
+    route_ids, point_ids, distances = index.nearest_many(lats, lons, max_distance_m)
+    for i, (lat, lon) in enumerate(zip(lats.tolist(), lons.tolist())):
+        hit = index.nearest(lat, lon, max_distance_m)
+        if hit is None:
+            assert (route_ids[i], point_ids[i], distances[i]) == (-1, -1, math.inf)
+        else:
+            assert math.isclose(distances[i], hit[2], rel_tol=1e-9)
+            assert math.isclose(float(haversine_m(lat, lon, index.routes[route_ids[i]].lat[point_ids[i]],
+                                                  index.routes[route_ids[i]].lon[point_ids[i]])),
+                                hit[2], rel_tol=1e-9)
+
+def test_nearest_many_empty():
+    route_ids, point_ids, distances = RouteIndex([]).nearest_many([35.0], [139.0])
+    assert (route_ids.tolist(), point_ids.tolist(), distances.tolist()) == ([-1], [-1], [math.inf])
+    assert len(random_walk_index(np.random.default_rng(0)).nearest_many([], [])[0]) == 0